@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.cache_utils.APICacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -173,18 +174,82 @@ EMAIL_HOST_USER = 'your-email@gmail.com'  # Replace with actual email
 EMAIL_HOST_PASSWORD = 'your-app-password'  # Replace with actual password
 DEFAULT_FROM_EMAIL = 'FinSplit <noreply@finsplit.com>'
 
+# Transactional email outbox, delivered by the send_outbox command (see core/outbox.py)
+FINSPLIT_EMAIL_OUTBOX = {
+    'ENABLED': True,          # False sends through the in-process dispatcher below instead
+    'BATCH_SIZE': 100,        # emails claimed per batch
+    'MAX_ATTEMPTS': 6,        # sends tried before an email is marked failed
+    'BACKOFF_BASE': 30,       # seconds before the first retry, doubled on each further one
+    'BACKOFF_MAX': 3600,      # longest wait between retries
+    'CLAIM_TIMEOUT': 300,     # seconds before a crashed worker's claimed emails are retried
+    'POLL_INTERVAL': 5.0,     # seconds send_outbox sleeps when nothing is due
+}
+
+# Users with digest delivery get one email per window instead of one per
+# expense, settlement or invite (see core/digests.py and send_digests)
+FINSPLIT_EMAIL_DIGEST_WINDOW = 3600  # seconds
+
+# Pooled in-process email sending (see core/email_dispatcher.py)
+FINSPLIT_EMAIL_DISPATCHER = {
+    'WORKERS': 2,             # sending threads per process, each with one SMTP connection
+    'QUEUE_SIZE': 1000,       # emails waiting to be sent, beyond which senders block
+    'BATCH_SIZE': 50,         # emails a worker takes from the queue at a time
+    'BATCH_WAIT': 0.05,       # seconds a worker waits to fill a batch
+    'ENQUEUE_TIMEOUT': 2.0,   # seconds a sender blocks on a full queue before the email is dropped
+    'IDLE_TIMEOUT': 30.0,     # seconds without work before a worker closes its connection
+}
+
 # Caching
+# Shared by every worker process on the host (see core/shm_cache.py).
+# Capacity is BUCKETS * WAYS entries; values larger than SLOT_SIZE are not cached.
+# Cache files are unpickled on read, so they live in a directory only this
+# app's user can write to (created 0700 by core.shm_cache), never in /tmp
+CACHE_DIR = os.environ.get('FINSPLIT_CACHE_DIR', os.path.join(BASE_DIR, 'var', 'cache'))
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'core.shm_cache.SharedMemoryCache',
+        'LOCATION': os.environ.get('FINSPLIT_CACHE_FILE', os.path.join(CACHE_DIR, 'finsplit-cache')),
         'TIMEOUT': 300,  # 5 minutes
+        # Bump when the layout of cached values changes (e.g. core/cache_codec.py)
+        'VERSION': 2,
         'OPTIONS': {
-            'MAX_ENTRIES': 1000,
+            'BUCKETS': 1024,
+            'WAYS': 8,
+            'SLOT_SIZE': 8192,
         }
-    }
+    },
+    # Rendered {% cache %} fragments (pool pages, dashboard) are larger
+    'template_fragments': {
+        'BACKEND': 'core.shm_cache.SharedMemoryCache',
+        'LOCATION': os.environ.get('FINSPLIT_FRAGMENT_CACHE_FILE', os.path.join(CACHE_DIR, 'finsplit-fragments')),
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'BUCKETS': 256,
+            'WAYS': 8,
+            'SLOT_SIZE': 32768,
+        }
+    },
+}
+
+# Per-process cache in front of CACHES['default'] (see core/cache_utils.py)
+FINSPLIT_LOCAL_CACHE = {
+    'MAX_ENTRIES': 1000,      # cached values kept per process
+    'TIMEOUT': 30,            # seconds a value or generation is kept locally at most
+    'POLL_INTERVAL': 1.0,     # seconds between checks for other processes' invalidations
 }
 
+# Background re-warming of invalidated caches (see core/warmer.py)
+FINSPLIT_CACHE_WARMER = {
+    'WORKERS': 2,             # warming threads per process; 0 disables the warmer
+    'MAX_PENDING': 100,       # pools and users waiting to be warmed, beyond which requests are dropped
+    'ACTIVE_WINDOW': 900,     # seconds a viewed pool or user counts as active
+}
+
+# Settlement solver (?mode=optimal on the settle page and API)
+SETTLEMENT_OPTIMAL_TIME_BUDGET = 0.5  # CPU seconds before falling back to the greedy plan
+SETTLEMENT_OPTIMAL_MAX_BALANCES = 25  # non-zero balances the exact solver will attempt
+
 # Login/Logout URLs
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = '/'
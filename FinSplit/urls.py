@@ -19,7 +19,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.admin import cache_stats_view
+
 urlpatterns = [
+    path('admin/cache-stats/', admin.site.admin_view(cache_stats_view), name='admin_cache_stats'),
     path('admin/', admin.site.urls),
     path('', include('core.urls')),
     path('api/', include('core.api_urls')),
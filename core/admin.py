@@ -4,11 +4,14 @@ Django admin configuration for core app.
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import (
     UserProfile, Pool, Member, Expense, ExpenseSplit, 
-    Transaction, Invitation
+    Transaction, Invitation, MemberBalance, Outbox
 )
 
 
@@ -55,8 +58,8 @@ class UserAdmin(BaseUserAdmin):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     """Admin for UserProfile model."""
-    list_display = ['user', 'upi_id', 'phone_number', 'created_at']
-    list_filter = ['created_at']
+    list_display = ['user', 'upi_id', 'phone_number', 'email_delivery', 'created_at']
+    list_filter = ['email_delivery', 'created_at']
     search_fields = ['user__username', 'user__email', 'upi_id', 'phone_number']
     readonly_fields = ['created_at', 'updated_at']
 
@@ -221,6 +224,39 @@ class TransactionAdmin(admin.ModelAdmin):
     mark_cancelled.short_description = 'Mark selected transactions as cancelled'
 
 
+@admin.register(MemberBalance)
+class MemberBalanceAdmin(admin.ModelAdmin):
+    """Read-only admin for the balance ledger (use the rebuild_ledger command to repair)."""
+    list_display = ['user', 'pool', 'paid', 'owed', 'sent', 'received', 'net', 'updated_at']
+    list_filter = ['pool']
+    search_fields = ['user__username', 'pool__name']
+    readonly_fields = ['pool', 'user', 'paid', 'owed', 'sent', 'received', 'net', 'updated_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Outbox)
+class OutboxAdmin(admin.ModelAdmin):
+    """Admin for queued emails (delivered by the send_outbox command)."""
+    list_display = ['subject', 'status', 'attempts', 'created_at', 'next_attempt_at', 'sent_at', 'latency_ms']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'recipients']
+    readonly_fields = ['created_at', 'sent_at', 'latency_ms', 'claimed_until', 'last_error']
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        """Queue selected failed or waiting emails for the next worker batch."""
+        updated = queryset.exclude(status__in=['sent', 'sending']).update(
+            status='pending', next_attempt_at=timezone.now(), attempts=0
+        )
+        self.message_user(request, f'{updated} emails queued for retry.')
+    retry_now.short_description = 'Retry selected emails now'
+
+
 @admin.register(Invitation)
 class InvitationAdmin(admin.ModelAdmin):
     """Admin for Invitation model."""
@@ -248,6 +284,28 @@ class InvitationAdmin(admin.ModelAdmin):
     is_expired.short_description = 'Expired'
 
 
+# Cache statistics page (routed at admin/cache-stats/ in FinSplit/urls.py)
+
+def cache_stats_view(request):
+    """Per-prefix cache hit rates across all workers, for tuning CACHE_TIMEOUTS."""
+    from .cache_stats import reset_prefix_stats
+    from .cache_utils import get_cache_stats
+    
+    if request.method == 'POST':
+        reset_prefix_stats()
+        return redirect('admin_cache_stats')
+    
+    stats = get_cache_stats()
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Cache statistics',
+        'stats': stats,
+        'prefixes': stats.get('prefixes', {}).get('prefixes', {}),
+        'since': stats.get('prefixes', {}).get('since'),
+    }
+    return TemplateResponse(request, 'admin/cache_stats.html', context)
+
+
 # Unregister the default User admin and register our custom one
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
@@ -19,6 +19,11 @@ urlpatterns = [
     # Custom API endpoints
     path('pools/<int:pool_id>/summary/', api_views.pool_summary, name='pool_summary'),
     path('pools/<int:pool_id>/balances/', api_views.pool_balances, name='pool_balances'),
+    path('pools/<int:pool_id>/settlements/', api_views.pool_settlements, name='pool_settlements'),
+    path('pools/<int:pool_id>/settlements/commit/', api_views.commit_pool_settlements, name='commit_pool_settlements'),
+    path('pools/<int:pool_id>/import/', api_views.import_pool_expenses, name='import_pool_expenses'),
+    path('me/settlements/', api_views.my_settlements, name='my_settlements'),
+    path('cache-stats/', api_views.cache_statistics, name='cache_statistics'),
     path('expenses/<int:expense_id>/split/', api_views.expense_split, name='expense_split'),
     path('validate-upi/', api_views.validate_upi, name='validate_upi'),
     path('send-invite/', api_views.send_invite_email, name='send_invite_email'),
@@ -3,17 +3,27 @@ API views for core app using Django REST Framework.
 """
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 from django.core.cache import cache
-from django.core.mail import send_mail
+from django.db import transaction
 from django.conf import settings
-import threading
+from django.views.decorators.cache import never_cache
+import time
 import requests
 from .models import Pool, Member, Expense, Transaction, ExpenseSplit
+from . import cache_stats
+from .conditional import pool_api_condition
+from .email_utils import send_email_async as queue_email
+from .cache_utils import (
+    CACHE_TIMEOUTS, get_cache_stats, get_cached_user_settlements, pool_scopes, scoped_cache_key
+)
+from .importer import DEFAULT_BATCH_SIZE, IMPORT_FORMATS, import_expenses
+from .settlement import get_pool_settlement_plan, commit_settlement_plan
+from .splits import SplitError, allocate_split, pool_member_ids, save_expense_splits
 from .serializers import (
     PoolSerializer, MemberSerializer, ExpenseSerializer, 
     TransactionSerializer, ExpenseSplitSerializer
@@ -98,18 +108,21 @@ class TransactionViewSet(viewsets.ModelViewSet):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@pool_api_condition
 def pool_summary(request, pool_id):
     """Get summary information for a pool."""
     pool = get_object_or_404(Pool, id=pool_id, members=request.user)
     
     # Check cache first
-    cache_key = f'pool_summary_{pool_id}'
+    cache_key = scoped_cache_key('api_pool_summary', pool_scopes(pool.id), pool.id)
     cached_summary = cache.get(cache_key)
+    cache_stats.record('api_pool_summary', 'hits' if cached_summary else 'misses')
     
     if cached_summary:
         return Response(cached_summary)
     
     # Calculate summary
+    started = time.perf_counter()
     total_expenses = pool.get_total_expenses()
     member_count = pool.get_member_count()
     balances = pool.get_balances()
@@ -130,14 +143,17 @@ def pool_summary(request, pool_id):
         'balances_count': len([b for b in balances.values() if b['balance'] != 0])
     }
     
-    # Cache for 5 minutes
-    cache.set(cache_key, summary, 300)
+    # Cache for 5 minutes, or until the pool changes
+    cache_stats.record_compute('api_pool_summary', time.perf_counter() - started)
+    cache.set(cache_key, summary, CACHE_TIMEOUTS['pool_summary'])
+    cache_stats.record('api_pool_summary', 'sets')
     
     return Response(summary)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@pool_api_condition
 def pool_balances(request, pool_id):
     """Get detailed balances for all members in a pool."""
     pool = get_object_or_404(Pool, id=pool_id, members=request.user)
@@ -163,49 +179,205 @@ def pool_balances(request, pool_id):
     })
 
 
-@api_view(['POST'])
+@api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def expense_split(request, expense_id):
-    """Create or update expense splits."""
-    expense = get_object_or_404(Expense, id=expense_id)
+def pool_settlements(request, pool_id):
+    """
+    Get the suggested transfers that settle every balance in a pool.
+    Pass ?mode=optimal for the fewest possible transfers.
+    """
+    pool = get_object_or_404(Pool, id=pool_id, members=request.user)
     
-    # Check if user has permission to modify this expense
-    if expense.created_by != request.user:
+    mode = request.query_params.get('mode', 'greedy')
+    if mode not in ('greedy', 'optimal'):
         return Response(
-            {'error': 'You do not have permission to modify this expense.'},
-            status=status.HTTP_403_FORBIDDEN
+            {'error': 'mode must be "greedy" or "optimal".'},
+            status=status.HTTP_400_BAD_REQUEST
         )
     
-    splits_data = request.data.get('splits', [])
+    plan = get_pool_settlement_plan(pool, mode=mode)
+    
+    return Response({
+        'pool_id': pool.id,
+        'mode': mode,
+        'version': plan.version,
+        'algorithm': plan.algorithm,
+        'elapsed_ms': plan.elapsed_ms,
+        'settlements': [
+            {
+                'from_user_id': settlement['from_user_id'],
+                'from_username': settlement['from_user'].username,
+                'to_user_id': settlement['to_user_id'],
+                'to_username': settlement['to_user'].username,
+                'amount': settlement['amount'],
+            }
+            for settlement in plan.settlements
+        ]
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def commit_pool_settlements(request, pool_id):
+    """
+    Commit the current settlement plan as pending transactions.
+    The client sends back the plan version it was shown.
+    """
+    pool = get_object_or_404(Pool, id=pool_id, members=request.user)
     
-    if not splits_data:
+    mode = request.data.get('mode', 'greedy')
+    if mode not in ('greedy', 'optimal'):
         return Response(
-            {'error': 'No splits data provided.'},
+            {'error': 'mode must be "greedy" or "optimal".'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Validate total amount
-    total_split_amount = sum(float(split['amount']) for split in splits_data)
-    if abs(total_split_amount - float(expense.amount)) > 0.01:
+    plan = get_pool_settlement_plan(pool, mode=mode)
+    if request.data.get('version') != plan.version:
+        return Response(
+            {'error': 'Balances changed since this plan was fetched.', 'version': plan.version},
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    created = commit_settlement_plan(pool, plan)
+    
+    return Response({
+        'pool_id': pool.id,
+        'version': plan.version,
+        'created': len(created),
+        'transactions': TransactionSerializer(created, many=True).data,
+    }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def my_settlements(request):
+    """Get the current user's settlements netted across all of their pools."""
+    settlements = get_cached_user_settlements(request.user.id)
+    
+    if settlements is None:
+        return Response(
+            {'error': 'Could not compute settlements.'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    return Response(settlements)
+
+
+@never_cache
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_statistics(request):
+    """Cache statistics for staff: per-prefix counts across all workers, tiers and warmer."""
+    return Response(get_cache_stats())
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_pool_expenses(request, pool_id):
+    """
+    Bulk import expenses into a pool from CSV or NDJSON.
+    
+    Send the file as a multipart upload named 'file', or as the raw request
+    body with a text/csv or application/x-ndjson content type.
+    """
+    pool = get_object_or_404(Pool, id=pool_id, members=request.user)
+    
+    content_type = request.content_type or ''
+    if content_type.startswith('multipart/form-data'):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'No file uploaded.'}, status=status.HTTP_400_BAD_REQUEST)
+        stream, name = upload, upload.name.lower()
+    else:
+        stream, name = request.stream, ''
+    
+    file_format = request.query_params.get('file_format')
+    if not file_format:
+        is_ndjson = name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type
+        file_format = 'ndjson' if is_ndjson else 'csv'
+    if file_format not in IMPORT_FORMATS or stream is None:
         return Response(
-            {'error': 'Split amounts do not match expense total.'},
+            {'error': f'Send a CSV or NDJSON file (file_format: {", ".join(IMPORT_FORMATS)}).'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Clear existing splits
-    expense.splits.all().delete()
+    try:
+        batch_size = min(max(int(request.query_params.get('batch_size', DEFAULT_BATCH_SIZE)), 1), 5000)
+    except ValueError:
+        return Response({'error': 'batch_size must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    result = import_expenses(
+        pool, stream, file_format=file_format, created_by=request.user, batch_size=batch_size
+    )
+    return Response(
+        result,
+        status=status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST
+    )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def expense_split(request, expense_id):
+    """Create or update expense splits."""
+    expense = get_object_or_404(Expense, id=expense_id)
     
-    # Create new splits
-    for split_data in splits_data:
-        ExpenseSplit.objects.create(
-            expense=expense,
-            user_id=split_data['user_id'],
-            amount=split_data['amount'],
-            percentage=split_data.get('percentage')
+    # Check if user has permission to modify this expense
+    if expense.created_by != request.user:
+        return Response(
+            {'error': 'You do not have permission to modify this expense.'},
+            status=status.HTTP_403_FORBIDDEN
         )
     
-    # Clear cache
-    cache.delete(f'pool_summary_{expense.pool.id}')
+    splits_data = request.data.get('splits')
+    method = request.data.get('split_method', 'manual')
+    
+    if splits_data:
+        # Explicit [{user_id, amount}] rows are an exact-amount split
+        method = 'manual'
+        try:
+            values = {int(split_data['user_id']): split_data['amount'] for split_data in splits_data}
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {'error': 'Each split needs a user_id and an amount.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(values) != len(splits_data):
+            return Response(
+                {'error': 'Each member can only appear once in a split.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    elif method == 'exclude':
+        try:
+            values = {int(user_id): True for user_id in request.data.get('excluded_user_ids', [])}
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'excluded_user_ids must be a list of user ids.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    elif method == 'equal':
+        values = {}
+    else:
+        try:
+            values = {int(user_id): value for user_id, value in request.data.get('split_values', {}).items()}
+        except (AttributeError, ValueError):
+            values = None
+        if not values:
+            return Response(
+                {'error': 'No splits data provided.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    try:
+        allocation = allocate_split(method, expense.amount, pool_member_ids(expense.pool_id), values)
+        # Old splits are replaced and the ledger updated in one transaction
+        with transaction.atomic():
+            if expense.split_method != method:
+                expense.split_method = method
+                expense.save(update_fields=['split_method'])
+            save_expense_splits(expense, allocation, replace=True)
+    except SplitError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     return Response({'message': 'Expense splits updated successfully.'})
 
@@ -243,17 +415,8 @@ def validate_upi(request):
 
 
 def send_email_async(subject, message, recipient_list):
-    """Send email asynchronously using threading."""
-    try:
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=recipient_list,
-            fail_silently=False,
-        )
-    except Exception as e:
-        print(f"Failed to send email: {e}")
+    """Queue a plain-text email on the pooled dispatcher."""
+    return queue_email(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list)
 
 
 @api_view(['POST'])
@@ -290,11 +453,7 @@ def send_invite_email(request):
     """
     
     # Send email asynchronously
-    email_thread = threading.Thread(
-        target=send_email_async,
-        args=(subject, message, [email])
-    )
-    email_thread.start()
+    send_email_async(subject, message, [email])
     
     return Response({
         'message': f'Invitation sent to {email} successfully.'
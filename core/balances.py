@@ -0,0 +1,83 @@
+"""
+Balance engine for FinSplit.
+Computes what every member of a pool paid, owes and has settled with a fixed
+number of grouped SUM queries, independent of how many expenses a pool has.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+import logging
+
+from django.db.models import Sum
+
+from .models import Expense, ExpenseSplit, Transaction, MemberBalance
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0.00')
+
+
+def _empty_totals():
+    return {'paid': ZERO, 'owed': ZERO, 'sent': ZERO, 'received': ZERO, 'net': ZERO}
+
+
+def _grouped_sum(queryset, group_field, user_ids):
+    """Yield (user_id, total) pairs from one GROUP BY query."""
+    if user_ids is not None:
+        queryset = queryset.filter(**{f'{group_field}__in': user_ids})
+    rows = queryset.order_by().values(group_field).annotate(total=Sum('amount'))
+    for row in rows:
+        yield row[group_field], row['total'] or ZERO
+
+
+def aggregate_pool_balances(pool_id, user_ids=None):
+    """
+    Compute balances for a pool straight from expenses, splits and settled
+    transactions using four grouped aggregations.
+
+    Returns {user_id: {'paid', 'owed', 'sent', 'received', 'net'}} for every
+    user with activity in the pool (restricted to ``user_ids`` if given).
+    """
+    if user_ids is not None:
+        user_ids = list(user_ids)
+    totals = defaultdict(_empty_totals)
+
+    sources = [
+        (Expense.objects.filter(pool_id=pool_id), 'paid_by_id', 'paid'),
+        (ExpenseSplit.objects.filter(expense__pool_id=pool_id), 'user_id', 'owed'),
+        (Transaction.objects.filter(pool_id=pool_id, is_settled=True), 'from_user_id', 'sent'),
+        (Transaction.objects.filter(pool_id=pool_id, is_settled=True), 'to_user_id', 'received'),
+    ]
+    for queryset, group_field, column in sources:
+        for user_id, total in _grouped_sum(queryset, group_field, user_ids):
+            totals[user_id][column] = total
+
+    for row in totals.values():
+        row['net'] = row['paid'] - row['owed'] + row['sent'] - row['received']
+
+    return dict(totals)
+
+
+def get_pool_balances(pool_id, user_ids=None):
+    """
+    Read balances for a pool from the ledger in a single indexed query.
+
+    Returns the same shape as aggregate_pool_balances(). Users without a
+    ledger row have no activity in the pool and are left out.
+    """
+    rows = MemberBalance.objects.filter(pool_id=pool_id)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=list(user_ids))
+
+    return {
+        row['user_id']: row
+        for row in rows.values('user_id', 'paid', 'owed', 'sent', 'received', 'net')
+    }
+
+
+def get_user_balance(pool_id, user_id):
+    """Balance of one user in one pool (zeroes when they have no activity)."""
+    row = get_pool_balances(pool_id, [user_id]).get(user_id)
+    if row is None:
+        return _empty_totals()
+    return row
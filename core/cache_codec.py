@@ -0,0 +1,129 @@
+"""
+Compact encoding of cached values for FinSplit.
+Balances, summaries and member lists are cached as tuples of plain values
+(amounts as integer paise) instead of lists of dicts, and any payload whose
+pickle exceeds a threshold is zlib-compressed. The shared cache then holds
+more entries and large pools still fit in a slot.
+"""
+
+import logging
+import pickle
+import zlib
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_THRESHOLD = getattr(settings, 'FINSPLIT_CACHE_COMPRESS_THRESHOLD', 1024)
+COMPRESS_LEVEL = 6
+
+# Flags stored with each encoded value
+PLAIN = 0
+COMPACT = 1
+COMPRESSED = 2
+
+
+class _Skip(Exception):
+    """Value does not have the shape a codec expects; store it as it is."""
+
+
+def _paise(amount):
+    paise = round(amount * 100)
+    if paise / 100 != amount:
+        raise _Skip
+    return paise
+
+
+def _amount(paise):
+    return paise / 100
+
+
+def _record_codec(fields, amounts=()):
+    """Codec for a dict with exactly ``fields``; ``amounts`` are stored as paise."""
+    def pack(record):
+        if len(record) != len(fields):
+            raise _Skip
+        return tuple(_paise(record[field]) if field in amounts else record[field] for field in fields)
+
+    def unpack(row):
+        return {
+            field: _amount(value) if field in amounts else value
+            for field, value in zip(fields, row)
+        }
+    return pack, unpack
+
+
+def _list_codec(fields, amounts=()):
+    pack_record, unpack_record = _record_codec(fields, amounts)
+    return (
+        lambda records: tuple(pack_record(record) for record in records),
+        lambda rows: [unpack_record(row) for row in rows],
+    )
+
+
+def _keyed_codec(fields, amounts=()):
+    """Codec for {fields[0]: record} dicts, such as balances keyed by user id."""
+    pack_record, unpack_record = _record_codec(fields, amounts)
+
+    def pack(records):
+        rows = []
+        for key, record in records.items():
+            if record.get(fields[0]) != key:
+                raise _Skip
+            rows.append(pack_record(record))
+        return tuple(rows)
+
+    def unpack(rows):
+        return {row[0]: unpack_record(row) for row in rows}
+    return pack, unpack
+
+
+AMOUNTS = ('paid', 'owes', 'balance')
+
+# cache_result prefix: (pack, unpack)
+CODECS = {
+    'pool_balances': _keyed_codec(('user_id', 'username') + AMOUNTS, AMOUNTS),
+    'user_balance': _record_codec(AMOUNTS, AMOUNTS),
+    'pool_summary': _record_codec(
+        ('total_expenses', 'member_count', 'expense_count', 'last_expense_date', 'created_at')
+    ),
+    'pool_members': _list_codec(('id', 'username', 'email', 'first_name', 'last_name')),
+    'user_pools': _list_codec(('id', 'name', 'description', 'created_at', 'created_by__username')),
+}
+
+
+def encode(prefix, value):
+    """(flags, payload) to cache in place of ``value``."""
+    flags, payload = PLAIN, value
+    codec = CODECS.get(prefix)
+    if codec and value:
+        try:
+            flags, payload = COMPACT, codec[0](value)
+        except (_Skip, KeyError, TypeError, AttributeError):
+            logger.debug(f"Caching {prefix} value without compact encoding")
+
+    if payload is not None and not isinstance(payload, (int, float, str)):
+        data = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+        if len(data) > COMPRESS_THRESHOLD:
+            return flags | COMPRESSED, zlib.compress(data, COMPRESS_LEVEL)
+    return flags, payload
+
+
+def decode(prefix, flags, payload):
+    """The value that encode() was given."""
+    if flags & COMPRESSED:
+        payload = pickle.loads(zlib.decompress(payload))
+    if flags & COMPACT:
+        payload = CODECS[prefix][1](payload)
+    return payload
+
+
+def compress_bytes(data):
+    """(compressed, data) for bytes such as a response body."""
+    if len(data) > COMPRESS_THRESHOLD:
+        return True, zlib.compress(data, COMPRESS_LEVEL)
+    return False, data
+
+
+def decompress_bytes(compressed, data):
+    return zlib.decompress(data) if compressed else data
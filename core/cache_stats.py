@@ -0,0 +1,143 @@
+"""
+Per-prefix cache statistics for FinSplit.
+Counts hits, misses, sets, evictions and recompute time for each cache key
+prefix (pool_balances, api_response, ...). Each process counts locally and
+adds its counts to shared counters in the cache every few seconds, so the
+totals cover all workers on the host.
+"""
+
+from collections import Counter, defaultdict
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+STATS_FLUSH_INTERVAL = getattr(settings, 'FINSPLIT_CACHE_STATS_FLUSH_INTERVAL', 5.0)
+STATS_FIELDS = ('hits', 'misses', 'sets', 'evictions', 'computes', 'compute_us')
+SINCE_KEY = 'finsplit:stats:since'
+PREFIXES_KEY = 'finsplit:stats:prefixes'
+
+_counts = defaultdict(Counter)
+_prefixes = set()
+_lock = threading.Lock()
+_last_flush = {'at': time.monotonic()}
+
+
+def _stats_key(prefix, field):
+    return f"finsplit:stats:{prefix}:{field}"
+
+
+def _key_prefix(key):
+    """'pool_balances' for ':1:finsplit:pool_balances:12:...'."""
+    parts = key.split(':')
+    if 'finsplit' in parts:
+        index = parts.index('finsplit')
+        if index + 1 < len(parts):
+            return parts[index + 1]
+    return 'other'
+
+
+def record(prefix, field, amount=1):
+    """Count a cache event ('hits', 'misses', 'sets' or 'evictions') for a prefix."""
+    with _lock:
+        _counts[prefix][field] += amount
+    _maybe_flush()
+
+
+def record_compute(prefix, seconds):
+    """Count one recompute of a cached value and how long it took."""
+    with _lock:
+        _counts[prefix]['computes'] += 1
+        _counts[prefix]['compute_us'] += int(seconds * 1_000_000)
+    _maybe_flush()
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush['at'] >= STATS_FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Add this process's counts to the shared totals."""
+    global _counts
+    with _lock:
+        _last_flush['at'] = time.monotonic()
+        counts, _counts = _counts, defaultdict(Counter)
+
+    # Evictions are seen by the backend, which only knows the evicted keys
+    drain = getattr(cache, 'drain_evictions', None)
+    if drain:
+        for key in drain():
+            counts[_key_prefix(key)]['evictions'] += 1
+
+    if not counts:
+        return
+    try:
+        cache.add(SINCE_KEY, timezone.now().isoformat(), None)
+        for prefix, fields in counts.items():
+            _prefixes.add(prefix)
+            for field, amount in fields.items():
+                if not amount:
+                    continue
+                key = _stats_key(prefix, field)
+                try:
+                    cache.incr(key, amount)
+                except ValueError:
+                    if not cache.add(key, amount, None):
+                        cache.incr(key, amount)
+        cache.set(PREFIXES_KEY, sorted(_prefixes | set(_known_prefixes())), None)
+    except Exception as e:
+        logger.error(f"Failed to flush cache statistics: {str(e)}")
+
+
+def _known_prefixes():
+    return cache.get(PREFIXES_KEY) or []
+
+
+def get_prefix_stats():
+    """
+    Totals per prefix across all workers: counts, hit rate and mean
+    recompute time in milliseconds.
+    """
+    from .cache_utils import CACHE_TIMEOUTS
+
+    flush()
+    prefixes = sorted(set(CACHE_TIMEOUTS) | set(_known_prefixes()) | _prefixes)
+    keys = [_stats_key(prefix, field) for prefix in prefixes for field in STATS_FIELDS]
+    values = cache.get_many(keys)
+
+    stats = {}
+    for prefix in prefixes:
+        counts = {field: values.get(_stats_key(prefix, field), 0) for field in STATS_FIELDS}
+        lookups = counts['hits'] + counts['misses']
+        compute_us = counts.pop('compute_us')
+        stats[prefix] = {
+            **counts,
+            'hit_rate': round(counts['hits'] / lookups, 4) if lookups else None,
+            'compute_ms_total': round(compute_us / 1000, 3),
+            'compute_ms_mean': round(compute_us / 1000 / counts['computes'], 3) if counts['computes'] else None,
+            'timeout': CACHE_TIMEOUTS.get(prefix),
+        }
+    return {'since': cache.get(SINCE_KEY), 'prefixes': stats}
+
+
+def reset_prefix_stats():
+    """Forget all counts, shared and local."""
+    global _counts
+    from .cache_utils import CACHE_TIMEOUTS
+
+    with _lock:
+        _counts = defaultdict(Counter)
+    drain = getattr(cache, 'drain_evictions', None)
+    if drain:
+        drain()
+    prefixes = set(CACHE_TIMEOUTS) | set(_known_prefixes()) | _prefixes
+    cache.delete_many(
+        [_stats_key(prefix, field) for prefix in prefixes for field in STATS_FIELDS]
+        + [SINCE_KEY, PREFIXES_KEY]
+    )
@@ -3,16 +3,25 @@ Caching utilities for FinSplit.
 Implements caching for expensive operations like pool summaries and balance calculations.
 """
 
-from django.core.cache import cache
+from django.core.cache import cache, caches
 from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from functools import wraps
 import hashlib
 import json
 import logging
+import math
+import random
+import time
 from decimal import Decimal
 from django.utils import timezone
 from datetime import timedelta
 
+from . import cache_codec, cache_stats
+from .local_cache import LocalCache
+
 logger = logging.getLogger(__name__)
 
 # Cache timeout settings (in seconds)
@@ -24,11 +33,19 @@ CACHE_TIMEOUTS = {
     'user_pools': 120,        # 2 minutes
     'pool_members': 300,      # 5 minutes
     'api_response': 60,       # 1 minute
+    'settlement_plan': 600,   # 10 minutes (keyed by balance state)
+    'user_settlements': 180,  # 3 minutes
+    'fragments': 600,         # 10 minutes (keyed by pool version)
+    'email_body': 86400,      # 1 day (keyed by template and event)
 }
 
 
 def generate_cache_key(prefix, *args, **kwargs):
     """Generate a unique cache key based on prefix and arguments."""
+    # Plain integer ids (the common case) are used as they are
+    if not kwargs and all(type(arg) is int for arg in args):
+        return f"finsplit:{prefix}:{':'.join(str(arg) for arg in args)}"
+    
     # Create a string representation of all arguments
     key_data = {
         'args': args,
@@ -42,69 +59,274 @@ def generate_cache_key(prefix, *args, **kwargs):
     return f"finsplit:{prefix}:{key_hash}"
 
 
-def cache_result(cache_key_prefix, timeout=None):
-    """Decorator to cache function results."""
+# Generation counters
+#
+# Cached values that depend on a pool or a user carry that pool's or user's
+# generation number in their key. Invalidating a pool or user is a single
+# atomic increment of its counter: later lookups build new keys, and the
+# entries under the old keys are never read again and simply expire.
+
+def _generation_key(kind, object_id):
+    return f"finsplit:gen:{kind}:{object_id}"
+
+
+def _initial_generation():
+    # Counters can be evicted; starting from the clock keeps a recreated
+    # counter from reusing a generation that old entries were stored under
+    return time.time_ns() // 1000
+
+
+def get_generations(scopes):
+    """Current generation for each (kind, id) scope, in at most one cache round trip."""
+    _sync_local_cache()
+    keys = [_generation_key(kind, object_id) for kind, object_id in scopes]
+    generations = {key: local_generations.get(key) for key in keys}
+    
+    missing = [key for key, generation in generations.items() if generation is None]
+    if missing:
+        found = cache.get_many(missing)
+        for key in missing:
+            generation = found.get(key)
+            if generation is None:
+                cache.add(key, _initial_generation(), None)
+                generation = cache.get(key)
+            generations[key] = generation
+            local_generations.set(key, generation, LOCAL_CACHE_TIMEOUT)
+    
+    return [generations[key] for key in keys]
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # No counter yet: nothing can be cached under it, so just create one
+        if not cache.add(key, _initial_generation(), None):
+            return cache.incr(key)
+        return cache.get(key)
+
+
+def bump_generation(kind, object_id):
+    """Start a new generation for a pool or user, orphaning its cached entries."""
+    key = _generation_key(kind, object_id)
+    generation = _incr(key)
+    # Tell other processes to drop the generations they hold locally
+    _incr(EPOCH_KEY)
+    local_generations.delete(key)
+    return generation
+
+
+# In-process tier
+#
+# Each worker keeps recently used values and generation counters in a
+# bounded LRU (core.local_cache) in front of the shared cache. Values are
+# stored under their generation-scoped keys, so they never go stale on their
+# own account; only the local copies of generation counters can. Every
+# bump_generation() also increments a shared epoch, and each process polls
+# it at most once per LOCAL_CACHE_POLL_INTERVAL, dropping its local
+# counters when it has moved.
+LOCAL_CACHE = getattr(settings, 'FINSPLIT_LOCAL_CACHE', {})
+LOCAL_CACHE_TIMEOUT = LOCAL_CACHE.get('TIMEOUT', 30)
+LOCAL_CACHE_POLL_INTERVAL = LOCAL_CACHE.get('POLL_INTERVAL', 1.0)
+EPOCH_KEY = 'finsplit:gen:epoch'
+
+local_cache = LocalCache(LOCAL_CACHE.get('MAX_ENTRIES', 1000))
+local_generations = LocalCache(LOCAL_CACHE.get('MAX_GENERATIONS', 10000))
+shared_cache_stats = {'hits': 0, 'misses': 0}
+_epoch = {'value': None, 'checked_at': float('-inf')}
+
+
+def _sync_local_cache():
+    now = time.monotonic()
+    if now - _epoch['checked_at'] < LOCAL_CACHE_POLL_INTERVAL:
+        return
+    _epoch['checked_at'] = now
+    
+    epoch = cache.get(EPOCH_KEY)
+    if epoch is None:
+        # The shared cache was cleared or lost the key: trust nothing local
+        cache.add(EPOCH_KEY, _initial_generation(), None)
+        epoch = cache.get(EPOCH_KEY)
+        local_cache.clear()
+        local_generations.clear()
+    elif epoch != _epoch['value']:
+        local_generations.clear()
+    _epoch['value'] = epoch
+
+
+def _local_timeout(expires_at):
+    return min(LOCAL_CACHE_TIMEOUT, expires_at - time.time())
+
+
+def clear_caches():
+    """Clear every configured cache and this process's local tier."""
+    for alias in settings.CACHES:
+        caches[alias].clear()
+    local_cache.clear()
+    local_generations.clear()
+    _epoch.update(value=None, checked_at=float('-inf'))
+
+
+def scoped_cache_key(prefix, scopes, *args, **kwargs):
+    """Cache key for ``prefix`` and arguments, tied to the scopes' generations."""
+    key = generate_cache_key(prefix, *args, **kwargs)
+    if not scopes:
+        return key
+    return f"{key}:{'.'.join(str(generation) for generation in get_generations(scopes))}"
+
+
+def pool_scopes(pool_id):
+    return [('pool', pool_id)]
+
+
+def user_scopes(user_id):
+    """A user and every pool they are in: for values built from all of them."""
+    return [('user', user_id)] + [('pool', pool['id']) for pool in get_cached_user_pools(user_id) or []]
+
+
+# Stampede protection for cache_result
+#
+# Entries are stored as (encoded value, compute seconds, expiry time, codec
+# flags), so a cached None is a hit like any other value. Values are encoded
+# compactly and compressed when large (see core/cache_codec.py). Each entry outlives its expiry by
+# STALE_GRACE seconds; while one caller recomputes an expired key under a
+# short lock, the others get the stale value instead of piling onto the
+# database. Hot keys are refreshed a little early, at random, with a
+# probability that grows as expiry nears and with the cost of recomputing
+# (XFetch), so they rarely expire at all.
+NEGATIVE_TIMEOUT = 30      # seconds a None result is cached
+STALE_GRACE = 60           # seconds an expired entry can still be served
+LOCK_TIMEOUT = 30          # seconds before a crashed recompute's lock lapses
+LOCK_WAIT = 5.0            # seconds to wait for another caller's recompute
+XFETCH_BETA = 1.0          # > 1 refreshes earlier, < 1 later
+
+_MISSING = object()
+
+
+def _should_refresh(compute_time, expires_at, beta):
+    """XFetch: refresh early with probability rising towards expiry."""
+    return time.time() - compute_time * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def _store(cache_key, prefix, value, compute_time, timeout):
+    expires_at = time.time() + timeout
+    flags, payload = cache_codec.encode(prefix, value)
+    cache.set(cache_key, (payload, compute_time, expires_at, flags), timeout + STALE_GRACE)
+    local_cache.set(cache_key, value, _local_timeout(expires_at))
+
+
+def _load(prefix, entry):
+    """(value, compute seconds, expiry time) of a stored entry."""
+    payload, compute_time, expires_at, flags = entry
+    return cache_codec.decode(prefix, flags, payload), compute_time, expires_at
+
+
+def _wait_for(cache_key):
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def cache_result(cache_key_prefix, timeout=None, scopes=None, negative_timeout=NEGATIVE_TIMEOUT, beta=XFETCH_BETA):
+    """
+    Decorator to cache function results.
+    
+    ``scopes`` is called with the function's arguments and returns the
+    (kind, id) scopes the result depends on, e.g. [('pool', pool_id)].
+    A None result is cached for ``negative_timeout`` seconds. Only one
+    caller at a time recomputes a key; see the notes above.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             # Generate cache key
-            cache_key = generate_cache_key(cache_key_prefix, *args, **kwargs)
+            cache_key = scoped_cache_key(
+                cache_key_prefix, scopes(*args, **kwargs) if scopes else None, *args, **kwargs
+            )
+            
+            # Try the local tier, then the shared cache
+            value = local_cache.get(cache_key, _MISSING)
+            if value is not _MISSING:
+                cache_stats.record(cache_key_prefix, 'hits')
+                return value
+            
+            entry = cache.get(cache_key)
+            shared_cache_stats['misses' if entry is None else 'hits'] += 1
+            cache_stats.record(cache_key_prefix, 'misses' if entry is None else 'hits')
+            if entry is not None:
+                value, compute_time, expires_at = _load(cache_key_prefix, entry)
+                if not _should_refresh(compute_time, expires_at, beta):
+                    logger.debug(f"Cache hit for {cache_key}")
+                    local_cache.set(cache_key, value, _local_timeout(expires_at))
+                    return value
             
-            # Try to get from cache
-            result = cache.get(cache_key)
-            if result is not None:
-                logger.debug(f"Cache hit for {cache_key}")
-                return result
+            lock_key = f"{cache_key}:lock"
+            if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+                # Someone else is recomputing: serve what we have, or wait for theirs
+                if entry is not None:
+                    logger.debug(f"Serving stale value for {cache_key} during refresh")
+                    return value
+                entry = _wait_for(cache_key)
+                if entry is not None:
+                    return _load(cache_key_prefix, entry)[0]
+                logger.warning(f"Timed out waiting for {cache_key}; computing anyway")
+                lock_key = None
             
             # Execute function and cache result
-            result = func(*args, **kwargs)
-            cache_timeout = timeout or CACHE_TIMEOUTS.get(cache_key_prefix, 300)
-            cache.set(cache_key, result, cache_timeout)
-            logger.debug(f"Cache set for {cache_key} with timeout {cache_timeout}")
+            try:
+                started = time.perf_counter()
+                result = func(*args, **kwargs)
+                compute_time = time.perf_counter() - started
+                cache_stats.record_compute(cache_key_prefix, compute_time)
+                if result is None:
+                    cache_timeout = negative_timeout
+                else:
+                    cache_timeout = timeout or CACHE_TIMEOUTS.get(cache_key_prefix, 300)
+                _store(cache_key, cache_key_prefix, result, compute_time, cache_timeout)
+                cache_stats.record(cache_key_prefix, 'sets')
+                logger.debug(f"Cache set for {cache_key} with timeout {cache_timeout}")
+            finally:
+                if lock_key:
+                    cache.delete(lock_key)
             
             return result
         return wrapper
     return decorator
 
 
-def invalidate_cache_pattern(pattern):
-    """Invalidate all cache keys matching a pattern."""
-    try:
-        # This is a simplified version - in production, you might want to use Redis
-        # with pattern matching or maintain a list of cache keys
-        cache.clear()  # For now, clear all cache
-        logger.info(f"Cache cleared for pattern: {pattern}")
-    except Exception as e:
-        logger.error(f"Failed to invalidate cache pattern {pattern}: {str(e)}")
-
-
 def invalidate_pool_cache(pool_id):
     """Invalidate all cache entries related to a specific pool."""
-    patterns = [
-        f"finsplit:pool_summary:*{pool_id}*",
-        f"finsplit:pool_balances:*{pool_id}*",
-        f"finsplit:pool_members:*{pool_id}*",
-        f"finsplit:user_balance:*{pool_id}*",
-    ]
+    try:
+        bump_generation('pool', pool_id)
+        logger.info(f"Cache invalidated for pool {pool_id}")
+    except Exception as e:
+        logger.error(f"Failed to invalidate cache for pool {pool_id}: {str(e)}")
+        return
     
-    for pattern in patterns:
-        invalidate_cache_pattern(pattern)
+    from .warmer import warmer
+    warmer.invalidated('pool', pool_id)
 
 
 def invalidate_user_cache(user_id):
     """Invalidate all cache entries related to a specific user."""
-    patterns = [
-        f"finsplit:user_pools:*{user_id}*",
-        f"finsplit:user_balance:*{user_id}*",
-    ]
+    try:
+        bump_generation('user', user_id)
+        logger.info(f"Cache invalidated for user {user_id}")
+    except Exception as e:
+        logger.error(f"Failed to invalidate cache for user {user_id}: {str(e)}")
+        return
     
-    for pattern in patterns:
-        invalidate_cache_pattern(pattern)
+    from .warmer import warmer
+    warmer.invalidated('user', user_id)
 
 
 # Cached functions for expensive operations
 
-@cache_result('pool_summary')
+@cache_result('pool_summary', scopes=pool_scopes)
 def get_cached_pool_summary(pool_id):
     """Get cached pool summary including total expenses, member count, etc."""
     from .models import Pool
@@ -126,78 +348,58 @@ def get_cached_pool_summary(pool_id):
         return None
 
 
-@cache_result('pool_balances')
+@cache_result('pool_balances', scopes=pool_scopes)
 def get_cached_pool_balances(pool_id):
     """Get cached balance calculations for all pool members."""
     from .models import Pool
+    from .balances import get_pool_balances
     
     try:
         pool = Pool.objects.get(id=pool_id)
         balances = {}
         
-        for member in pool.members.all():
-            # Calculate what user paid
-            paid_amount = sum(
-                expense.amount for expense in pool.expenses.filter(paid_by=member)
-            )
-            
-            # Calculate what user owes
-            owed_amount = Decimal('0')
-            for expense in pool.expenses.all():
-                splits = expense.splits.filter(user=member)
-                if splits.exists():
-                    owed_amount += sum(split.amount for split in splits)
-            
-            balance = paid_amount - owed_amount
-            
-            balances[member.id] = {
-                'user_id': member.id,
-                'username': member.username,
-                'paid': float(paid_amount),
-                'owes': float(owed_amount),
-                'balance': float(balance),
+        for member in pool.members.values('id', 'username'):
+            balances[member['id']] = {
+                'user_id': member['id'],
+                'username': member['username'],
+                'paid': 0.0,
+                'owes': 0.0,
+                'balance': 0.0,
             }
         
+        # One ledger row per member that has any activity
+        for user_id, row in get_pool_balances(pool.id, balances).items():
+            balances[user_id].update({
+                'paid': float(row['paid']),
+                'owes': float(row['owed']),
+                'balance': float(row['net']),
+            })
+        
         return balances
     except Exception as e:
         logger.error(f"Error getting pool balances for pool {pool_id}: {str(e)}")
-        return {}
+        return None
 
 
-@cache_result('user_balance')
+@cache_result('user_balance', scopes=lambda user_id, pool_id: pool_scopes(pool_id))
 def get_cached_user_balance(user_id, pool_id):
     """Get cached balance for a specific user in a specific pool."""
-    from .models import Pool, User
+    from .balances import get_user_balance
     
     try:
-        user = User.objects.get(id=user_id)
-        pool = Pool.objects.get(id=pool_id)
-        
-        # Calculate what user paid
-        paid_amount = sum(
-            expense.amount for expense in pool.expenses.filter(paid_by=user)
-        )
-        
-        # Calculate what user owes
-        owed_amount = Decimal('0')
-        for expense in pool.expenses.all():
-            splits = expense.splits.filter(user=user)
-            if splits.exists():
-                owed_amount += sum(split.amount for split in splits)
-        
-        balance = paid_amount - owed_amount
+        row = get_user_balance(pool_id, user_id)
         
         return {
-            'paid': float(paid_amount),
-            'owes': float(owed_amount),
-            'balance': float(balance),
+            'paid': float(row['paid']),
+            'owes': float(row['owed']),
+            'balance': float(row['net']),
         }
     except Exception as e:
         logger.error(f"Error getting user balance for user {user_id} in pool {pool_id}: {str(e)}")
-        return {'paid': 0, 'owes': 0, 'balance': 0}
+        return None
 
 
-@cache_result('user_pools')
+@cache_result('user_pools', scopes=lambda user_id: [('user', user_id)])
 def get_cached_user_pools(user_id):
     """Get cached list of pools for a user."""
     from .models import Pool, User
@@ -211,10 +413,10 @@ def get_cached_user_pools(user_id):
         return list(pools)
     except Exception as e:
         logger.error(f"Error getting user pools for user {user_id}: {str(e)}")
-        return []
+        return None
 
 
-@cache_result('pool_members')
+@cache_result('pool_members', scopes=pool_scopes)
 def get_cached_pool_members(pool_id):
     """Get cached list of pool members."""
     from .models import Pool
@@ -228,7 +430,19 @@ def get_cached_pool_members(pool_id):
         return list(members)
     except Exception as e:
         logger.error(f"Error getting pool members for pool {pool_id}: {str(e)}")
-        return []
+        return None
+
+
+@cache_result('user_settlements', scopes=user_scopes)
+def get_cached_user_settlements(user_id):
+    """Get cached cross-pool settlements for a user."""
+    from .netting import get_user_settlements
+    
+    try:
+        return get_user_settlements(user_id)
+    except Exception as e:
+        logger.error(f"Error getting cross-pool settlements for user {user_id}: {str(e)}")
+        return None
 
 
 # Cache warming functions
@@ -257,16 +471,31 @@ def warm_user_cache(user_id):
     user_pools = get_cached_user_pools(user_id)
     
     # Warm up user balances for each pool
-    for pool in user_pools:
+    for pool in user_pools or []:
         get_cached_user_balance(user_id, pool['id'])
     
+    # Warm up the dashboard's cross-pool settlements
+    get_cached_user_settlements(user_id)
+    
     logger.info(f"Cache warmed for user {user_id}")
 
 
 # Cache statistics and monitoring
 
+def _shared_tier_stats():
+    stats = dict(shared_cache_stats, evictions=None)
+    # Backends such as core.shm_cache report their own counters, for all workers
+    backend_stats = getattr(cache, 'get_stats', None)
+    if backend_stats:
+        stats['backend'] = backend_stats()
+        stats['evictions'] = stats['backend'].get('evictions')
+    return stats
+
+
 def get_cache_stats():
     """Get cache statistics."""
+    from .warmer import warmer
+    
     try:
         # This would depend on your cache backend
         # For memcached or Redis, you could get actual stats
@@ -274,6 +503,13 @@ def get_cache_stats():
             'backend': settings.CACHES['default']['BACKEND'],
             'status': 'active',
             'timeouts': CACHE_TIMEOUTS,
+            'warmer': warmer.stats(),
+            'prefixes': cache_stats.get_prefix_stats(),
+            'tiers': {
+                'local': local_cache.stats(),
+                'local_generations': local_generations.stats(),
+                'shared': _shared_tier_stats(),
+            },
         }
     except Exception as e:
         logger.error(f"Error getting cache stats: {str(e)}")
@@ -282,33 +518,90 @@ def get_cache_stats():
 
 # Cache middleware for API responses
 
+# Response headers stored with a cached body; the rest are added again by
+# the outer middleware (sessions, CSRF, security) on every request.
+API_CACHE_HEADERS = ('Content-Type', 'Content-Language', 'Vary', 'Allow')
+
+
+def _etag(content):
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+def _not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 class APICacheMiddleware:
-    """Middleware to cache API responses."""
+    """
+    Cache authenticated API GET responses per user.
+
+    Entries hold the rendered body (compressed when large) and a few headers,
+    keyed by the user, the full path, the Accept header and the generations
+    of the user and their pools, so any change to those pools or memberships
+    misses. Responses
+    carry a strong ETag of the body unless the view set its own; a matching
+    If-None-Match is answered with 304 from the cache without running the
+    view. Must come after AuthenticationMiddleware.
+    """
     
     def __init__(self, get_response):
         self.get_response = get_response
     
     def __call__(self, request):
-        # Check if this is an API request
-        if request.path.startswith('/api/') and request.method == 'GET':
-            cache_key = generate_cache_key('api_response', request.path, request.GET.dict())
-            
-            # Try to get cached response
-            cached_response = cache.get(cache_key)
-            if cached_response:
-                logger.debug(f"API cache hit for {request.path}")
-                return cached_response
+        user = getattr(request, 'user', None)
+        if not (request.path.startswith('/api/') and request.method in ('GET', 'HEAD')
+                and user is not None and user.is_authenticated):
+            return self.get_response(request)
         
+        # Responses are per user and tied to the user's pools' generations
+        cache_key = scoped_cache_key(
+            'api_response', user_scopes(user.id),
+            request.get_full_path(), request.headers.get('Accept', ''), user.id
+        )
+        
+        cached = cache.get(cache_key)
+        cache_stats.record('api_response', 'misses' if cached is None else 'hits')
+        if cached is not None:
+            etag, compressed, content, headers = cached
+            content = cache_codec.decompress_bytes(compressed, content)
+            if _etag_matches(request, etag):
+                logger.debug(f"API cache hit (not modified) for {request.path}")
+                return _not_modified(etag)
+            logger.debug(f"API cache hit for {request.path}")
+            response = HttpResponse(content, headers=headers)
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        
+        started = time.perf_counter()
         response = self.get_response(request)
+        cache_stats.record_compute('api_response', time.perf_counter() - started)
         
-        # Cache successful GET responses
-        if (request.path.startswith('/api/') and 
-            request.method == 'GET' and 
-            response.status_code == 200):
-            
-            cache_key = generate_cache_key('api_response', request.path, request.GET.dict())
-            cache.set(cache_key, response, CACHE_TIMEOUTS['api_response'])
-            logger.debug(f"API response cached for {request.path}")
+        if (response.status_code != 200 or response.streaming or response.cookies
+                or 'no-store' in response.get('Cache-Control', '')):
+            return response
         
+        # Views with their own validators (see core.conditional) keep them
+        etag = response.get('ETag') or _etag(response.content)
+        headers = {name: response[name] for name in API_CACHE_HEADERS if response.has_header(name)}
+        compressed, content = cache_codec.compress_bytes(response.content)
+        cache.set(cache_key, (etag, compressed, content, headers), CACHE_TIMEOUTS['api_response'])
+        cache_stats.record('api_response', 'sets')
+        logger.debug(f"API response cached for {request.path}")
+        
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
         return response
-
@@ -0,0 +1,71 @@
+"""
+Conditional GET for pool views.
+Answers If-None-Match and If-Modified-Since from Pool.version and
+Pool.updated_at, read in one indexed lookup, so polling clients get
+304 Not Modified without any balances being computed.
+"""
+
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.views.decorators.http import condition
+
+from .models import Pool
+from .warmer import mark_active
+
+
+def _pool_state(request, pool_id):
+    """(version, updated_at) of a pool the user belongs to, or None. Read once per request."""
+    states = request.__dict__.setdefault('_pool_states', {})
+    if pool_id not in states:
+        states[pool_id] = (
+            Pool.objects.filter(pk=pool_id, members=request.user)
+            .values_list('version', 'updated_at')
+            .first()
+        )
+        if states[pool_id] is not None:
+            # Keeps the pool warm for its next visitor (see core.warmer)
+            mark_active('pool', pool_id)
+            mark_active('user', request.user.id)
+    return states[pool_id]
+
+
+def _pool_etag(request, pool_id, extra=''):
+    state = _pool_state(request, pool_id)
+    if state is None:
+        # Not a member: let the view answer with its 404
+        return None
+    # Weak: the JSON and browsable API renderings share a version
+    return f'W/"{pool_id}.{state[0]}.{request.user.id}{extra}"'
+
+
+def _pool_last_modified(request, pool_id, **kwargs):
+    state = _pool_state(request, pool_id)
+    return state[1] if state else None
+
+
+def _api_etag(request, pool_id, **kwargs):
+    return _pool_etag(request, pool_id)
+
+
+def _page_etag(request, pool_id, **kwargs):
+    # A pending flash message must be shown, so the page is rendered
+    if len(get_messages(request)):
+        return None
+    # Forms on the page embed the CSRF token, which changes on login
+    csrf = hashlib.blake2b(
+        (request.META.get('CSRF_COOKIE') or '').encode(), digest_size=4
+    ).hexdigest()
+    return _pool_etag(request, pool_id, f'.{csrf}')
+
+
+def _page_last_modified(request, pool_id, **kwargs):
+    if _page_etag(request, pool_id) is None:
+        return None
+    return _pool_last_modified(request, pool_id)
+
+
+# Decorators for views taking a pool_id argument. Apply below login and
+# permission checks so request.user is known.
+pool_api_condition = condition(etag_func=_api_etag, last_modified_func=_pool_last_modified)
+pool_page_condition = condition(etag_func=_page_etag, last_modified_func=_page_last_modified)
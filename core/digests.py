@@ -0,0 +1,113 @@
+"""
+Notification digests for FinSplit.
+Users who choose digest delivery get no email per expense, settlement or
+invite. The event is stored instead, and send_due_digests() sends each
+such user one email listing everything that happened once their oldest
+pending event is DIGEST_WINDOW seconds old.
+"""
+
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .email_render import render_email
+from .models import NotificationEvent, UserProfile
+
+logger = logging.getLogger(__name__)
+
+DIGEST_WINDOW = getattr(settings, 'FINSPLIT_EMAIL_DIGEST_WINDOW', 3600)
+DIGEST_CHUNK_SIZE = 200
+
+
+def digest_user_ids(user_ids):
+    """The subset of ``user_ids`` who chose digest delivery (one query)."""
+    return set(
+        UserProfile.objects.filter(user_id__in=list(user_ids), email_delivery='digest')
+        .values_list('user_id', flat=True)
+    )
+
+
+def record_events(kind, recipients, summary, pool=None, amount=None, url=''):
+    """Store one event per recipient for their next digest."""
+    NotificationEvent.objects.bulk_create([
+        NotificationEvent(
+            recipient=recipient, kind=kind, pool=pool, summary=summary[:255], amount=amount, url=url
+        )
+        for recipient in recipients
+    ])
+
+
+def _group_by_pool(events):
+    groups = {}
+    for event in events:
+        key = event.pool_id
+        if key not in groups:
+            groups[key] = {'pool': event.pool, 'events': []}
+        groups[key]['events'].append(event)
+    return list(groups.values())
+
+
+def send_due_digests(window=None, now=None):
+    """
+    Send a digest to every user whose oldest unsent event is at least
+    ``window`` seconds old. Each chunk of recipients is queued and marked
+    sent in one transaction. Returns (digests sent, events included).
+    """
+    from .email_utils import send_email_async
+
+    window = DIGEST_WINDOW if window is None else window
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=window)
+    recipient_ids = list(
+        NotificationEvent.objects.filter(sent_at__isnull=True)
+        .values('recipient')
+        .annotate(oldest=Min('created_at'))
+        .filter(oldest__lte=cutoff)
+        .values_list('recipient', flat=True)
+    )
+
+    digests = events_sent = 0
+    for start in range(0, len(recipient_ids), DIGEST_CHUNK_SIZE):
+        chunk = recipient_ids[start:start + DIGEST_CHUNK_SIZE]
+        with transaction.atomic():
+            events = list(
+                NotificationEvent.objects.filter(recipient_id__in=chunk, sent_at__isnull=True)
+                .select_related('recipient', 'pool')
+                .order_by('recipient_id', 'created_at')
+            )
+            by_recipient = {}
+            for event in events:
+                by_recipient.setdefault(event.recipient_id, []).append(event)
+
+            for recipient_events in by_recipient.values():
+                recipient = recipient_events[0].recipient
+                if not recipient.email:
+                    continue
+                context = {
+                    'user': recipient,
+                    'event_count': len(recipient_events),
+                    'groups': _group_by_pool(recipient_events),
+                    'site_name': 'FinSplit',
+                    'dashboard_url': f"{settings.SITE_URL}/dashboard/" if hasattr(settings, 'SITE_URL') else 'http://localhost:8000/dashboard/',
+                }
+                html_message, plain_message = render_email('emails/notification_digest.html', context)
+                send_email_async(
+                    subject=f"{len(recipient_events)} update(s) on FinSplit",
+                    message=plain_message,
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    recipient_list=[recipient.email],
+                    html_message=html_message,
+                )
+                digests += 1
+
+            # Events of recipients without an address are dropped with the rest
+            NotificationEvent.objects.filter(id__in=[event.id for event in events]).update(sent_at=now)
+            events_sent += len(events)
+
+    if digests:
+        logger.info(f"Sent {digests} digest(s) covering {events_sent} event(s)")
+    return digests, events_sent
@@ -0,0 +1,182 @@
+"""
+Pooled email sending for FinSplit.
+Messages go onto a bounded queue and a few worker threads send them in
+batches, each worker over one SMTP connection that it keeps open between
+batches, instead of a thread and a TLS handshake per email.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+EMAIL_DISPATCHER = getattr(settings, 'FINSPLIT_EMAIL_DISPATCHER', {})
+
+_STOP = object()
+
+
+class EmailDispatcher:
+    """
+    Sends EmailMessages from a bounded queue on a fixed pool of workers.
+
+    send() blocks for up to ``enqueue_timeout`` seconds when the queue is
+    full, then gives up and returns False, so a burst slows its producers
+    down instead of growing memory without limit. Each worker takes up to
+    ``batch_size`` queued messages at a time and sends them one after
+    another on its own connection, which is reopened after an error and
+    closed after ``idle_timeout`` seconds without work. Only the message
+    that failed is retried, so nothing already delivered is sent twice.
+    """
+
+    def __init__(self, workers=2, queue_size=1000, batch_size=50, batch_wait=0.05,
+                 enqueue_timeout=2.0, idle_timeout=30.0, connection_factory=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.enqueue_timeout = enqueue_timeout
+        self.idle_timeout = idle_timeout
+        self.connection_factory = connection_factory or (lambda: get_connection(fail_silently=False))
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.counts = {
+            'queued': 0, 'rejected': 0, 'sent': 0, 'failed': 0, 'batches': 0, 'connections': 0,
+        }
+
+    def _count(self, field, amount=1):
+        with self._lock:
+            self.counts[field] += amount
+
+    def _start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for number in range(len(self._threads), self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f'finsplit-mailer-{number}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def send(self, message, timeout=None):
+        """Queue an EmailMessage. Returns False if the queue stayed full."""
+        if len(self._threads) < self.workers:
+            self._start()
+        try:
+            self._queue.put(message, timeout=self.enqueue_timeout if timeout is None else timeout)
+        except queue.Full:
+            self._count('rejected')
+            logger.error(f"Email queue full; dropped message to {message.to}")
+            return False
+        self._count('queued')
+        return True
+
+    def _next_batch(self, first):
+        """Up to batch_size messages, and whether a stop request ended the batch."""
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is _STOP:
+                # Shutdown queues one per worker; this worker stops after the batch
+                self._queue.task_done()
+                return batch, True
+            batch.append(message)
+        return batch, False
+
+    def _deliver(self, connection, batch):
+        """
+        Send a batch message by message over one connection, reconnecting
+        once for a message that fails. send_messages() may fail after
+        delivering part of a list, so messages are never handed over
+        together. Returns the connection to keep.
+        """
+        self._count('batches')
+        for index, message in enumerate(batch):
+            for attempt in (1, 2):
+                try:
+                    if connection is None:
+                        connection = self.connection_factory()
+                        connection.open()
+                        self._count('connections')
+                    sent = connection.send_messages([message]) or 0
+                    self._count('sent', sent)
+                    self._count('failed', 1 - sent)
+                    break
+                except Exception as e:
+                    logger.warning(f"Email to {message.to} failed (attempt {attempt}): {str(e)}")
+                    self._close(connection)
+                    connection = None
+            else:
+                # The server is unreachable; do not reconnect for every remaining message
+                dropped = len(batch) - index
+                self._count('failed', dropped)
+                logger.error(f"Dropped {dropped} email(s) after repeated send failures")
+                return None
+        return connection
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _work(self):
+        connection = None
+        while True:
+            try:
+                message = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Idle: do not hold a server connection open for nothing
+                self._close(connection)
+                connection = None
+                continue
+            if message is _STOP:
+                self._queue.task_done()
+                self._close(connection)
+                return
+            batch, stop = self._next_batch(message)
+            try:
+                connection = self._deliver(connection, batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                self._close(connection)
+                return
+
+    def flush(self):
+        """Block until every queued message has been sent or given up on."""
+        self._queue.join()
+
+    def shutdown(self):
+        """Send what is queued, then stop the workers and close their connections."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, 'pending': self._queue.qsize(), 'workers': len(self._threads)}
+
+
+dispatcher = EmailDispatcher(
+    workers=EMAIL_DISPATCHER.get('WORKERS', 2),
+    queue_size=EMAIL_DISPATCHER.get('QUEUE_SIZE', 1000),
+    batch_size=EMAIL_DISPATCHER.get('BATCH_SIZE', 50),
+    batch_wait=EMAIL_DISPATCHER.get('BATCH_WAIT', 0.05),
+    enqueue_timeout=EMAIL_DISPATCHER.get('ENQUEUE_TIMEOUT', 2.0),
+    idle_timeout=EMAIL_DISPATCHER.get('IDLE_TIMEOUT', 30.0),
+)
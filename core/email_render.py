@@ -0,0 +1,83 @@
+"""
+Email rendering for FinSplit.
+A template is rendered once per event with the context every recipient
+shares; fields that differ per recipient (their name, ...) are left as
+placeholders and filled in with a string substitution for each email.
+Rendered bodies are cached by (template, event), so sending the same event
+again, e.g. inviting several people to a pool, does not render it again.
+"""
+
+import html as html_lib
+import logging
+import re
+
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.connection import ConnectionProxy
+from django.utils.html import escape
+
+from . import cache_stats
+from .cache_codec import compress_bytes, decompress_bytes
+from .cache_utils import CACHE_TIMEOUTS, generate_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Rendered emails are larger than most cached values; a proxy, like
+# django.core.cache.cache, so it follows changes to CACHES
+body_cache = ConnectionProxy(caches, 'template_fragments')
+
+_PLACEHOLDER = re.compile(r'\[\[finsplit:(\w+)\]\]')
+_TAG = re.compile(r'<[^>]*>')
+_BLANK_LINES = re.compile(r'\n\s*\n+')
+
+
+def placeholder(field):
+    """Marker left in the rendered body for a per-recipient field."""
+    return f'[[finsplit:{field}]]'
+
+
+def plain_text(html):
+    """
+    Text alternative of one of our HTML emails. A regex is enough for our
+    own templates and is much cheaper than strip_tags()'s HTML parser,
+    which would also keep the <style> block.
+    """
+    body = html[html.find('<body'):] if '<body' in html else html
+    text = html_lib.unescape(_TAG.sub('', body))
+    return _BLANK_LINES.sub('\n\n', '\n'.join(line.strip() for line in text.splitlines())).strip()
+
+
+def render_email(template_name, context, event_key=None, recipient_fields=()):
+    """
+    (html, text) for ``template_name`` rendered with ``context``, with each
+    of ``recipient_fields`` left as a placeholder for personalize(). With an
+    ``event_key`` the result is cached; the key must change whenever the
+    event's content does.
+    """
+    key = None
+    if event_key is not None:
+        key = generate_cache_key('email_body', template_name, event_key, *sorted(recipient_fields))
+        cached = body_cache.get(key)
+        if cached is not None:
+            cache_stats.record('email_body', 'hits')
+            html, text = decompress_bytes(*cached).decode().split('\0', 1)
+            return html, text
+        cache_stats.record('email_body', 'misses')
+
+    # get_template() returns the engine's compiled, cached template
+    template = get_template(template_name)
+    html = template.render({**context, **{field: placeholder(field) for field in recipient_fields}})
+    text = plain_text(html)
+
+    if key is not None:
+        body_cache.set(key, compress_bytes(f'{html}\0{text}'.encode()), CACHE_TIMEOUTS['email_body'])
+        cache_stats.record('email_body', 'sets')
+    return html, text
+
+
+def personalize(body, values, html=True):
+    """Fill the placeholders in ``body``; values are HTML-escaped for HTML bodies."""
+    def replace(match):
+        value = str(values.get(match.group(1), ''))
+        return escape(value) if html else value
+    return _PLACEHOLDER.sub(replace, body)
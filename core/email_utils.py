@@ -3,42 +3,61 @@ Email utility functions for FinSplit.
 Handles sending invites, expense summaries, and notifications.
 """
 
-import threading
-from django.core.mail import send_mail, EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from datetime import timedelta
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import get_template
 from django.conf import settings
+from django.utils import timezone
+from django.db import transaction as db_transaction
 from django.contrib.auth.models import User
-from .models import Pool, Expense, Member
+from .models import Pool, Expense, Member, ExpenseSplit
+from .balances import get_user_balance
+from .digests import digest_user_ids, record_events
+from .email_dispatcher import dispatcher
+from .email_render import personalize, render_email
+from .outbox import enqueue_email, outbox_enabled
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def build_email(subject, message, from_email, recipient_list, html_message=None):
+    """An EmailMultiAlternatives with an optional HTML part."""
+    email = EmailMultiAlternatives(subject, message, from_email, recipient_list)
+    if html_message:
+        email.attach_alternative(html_message, "text/html")
+    return email
+
+
 def send_email_async(subject, message, from_email, recipient_list, html_message=None):
-    """Send email asynchronously using threading."""
-    def send_email():
-        try:
-            if html_message:
-                email = EmailMultiAlternatives(subject, message, from_email, recipient_list)
-                email.attach_alternative(html_message, "text/html")
-                email.send()
-            else:
-                send_mail(subject, message, from_email, recipient_list)
-            logger.info(f"Email sent successfully to {recipient_list}")
-        except Exception as e:
-            logger.error(f"Failed to send email to {recipient_list}: {str(e)}")
-    
-    # Start email sending in a separate thread
-    email_thread = threading.Thread(target=send_email)
-    email_thread.daemon = True
-    email_thread.start()
+    """
+    Queue an email. By default it is written to the outbox in the current
+    transaction; with the outbox disabled it goes to the in-process
+    dispatcher once the transaction commits.
+    """
+    if outbox_enabled():
+        enqueue_email(subject, message, from_email, recipient_list, html_message)
+        logger.info(f"Email to {recipient_list} added to the outbox")
+        return True
+
+    email = build_email(subject, message, from_email, recipient_list, html_message)
+    db_transaction.on_commit(lambda: dispatcher.send(email))
+    return True
 
 
 def send_pool_invite_email(inviter, pool, invited_email):
     """Send pool invitation email to a user."""
     subject = f"You've been invited to join '{pool.name}' on FinSplit"
     
+    # A registered user who chose digests gets the invite in their next digest
+    invitee = User.objects.filter(email__iexact=invited_email).order_by('id').first()
+    if invitee and digest_user_ids([invitee.id]):
+        record_events(
+            'invite', [invitee], f"{inviter.username} added you to {pool.name}", pool=pool,
+            url=f"{settings.SITE_URL}/pools/{pool.id}/" if hasattr(settings, 'SITE_URL') else f'http://localhost:8000/pools/{pool.id}/'
+        )
+        return
+    
     context = {
         'pool': pool,
         'invited_email': invited_email,
@@ -47,9 +66,14 @@ def send_pool_invite_email(inviter, pool, invited_email):
         'login_url': f"{settings.SITE_URL}/auth/login/" if hasattr(settings, 'SITE_URL') else 'http://localhost:8000/auth/login/'
     }
     
-    # Render HTML email template
-    html_message = render_to_string('emails/pool_invite.html', context)
-    plain_message = strip_tags(html_message)
+    # Invites from one admin to one pool share a body until the pool or the
+    # inviter's details shown in it change
+    html_message, plain_message = render_email(
+        'emails/pool_invite.html', context,
+        event_key=(
+            'invite', pool.id, pool.version, inviter.id, inviter.username, inviter.first_name, inviter.email,
+        ),
+    )
     
     send_email_async(
         subject=subject,
@@ -63,22 +87,39 @@ def send_pool_invite_email(inviter, pool, invited_email):
 def send_expense_notification_email(expense, members):
     """Send expense notification email to pool members."""
     subject = f"New expense added: {expense.title}"
+    pool_url = f"{settings.SITE_URL}/pools/{expense.pool.id}/" if hasattr(settings, 'SITE_URL') else f'http://localhost:8000/pools/{expense.pool.id}/'
     
-    context = {
-        'expense': expense,
-        'pool': expense.pool,
-        'site_name': 'FinSplit',
-        'pool_url': f"{settings.SITE_URL}/pools/{expense.pool.id}/" if hasattr(settings, 'SITE_URL') else f'http://localhost:8000/pools/{expense.pool.id}/'
-    }
-    
-    # Render HTML email template
-    html_message = render_to_string('emails/expense_notification.html', context)
-    plain_message = strip_tags(html_message)
-    
-    # Send to all members except the one who created the expense
-    recipient_emails = [member.email for member in members if member != expense.created_by and member.email]
+    # Notify all members except the one who created the expense
+    recipients = [member for member in members if member != expense.created_by and member.email]
+    digest_ids = digest_user_ids(member.id for member in recipients)
+    if digest_ids:
+        record_events(
+            'expense', [member for member in recipients if member.id in digest_ids],
+            f"{expense.paid_by.username} paid for {expense.title}", pool=expense.pool,
+            amount=expense.amount, url=pool_url,
+        )
+    recipient_emails = [member.email for member in recipients if member.id not in digest_ids]
     
     if recipient_emails:
+        context = {
+            'expense': expense,
+            'pool': expense.pool,
+            'site_name': 'FinSplit',
+            'pool_url': pool_url
+        }
+        
+        # One email to every instant recipient: nothing in it is per recipient.
+        # Names shown from other rows are part of the key, as editing them
+        # leaves expense.updated_at alone
+        html_message, plain_message = render_email(
+            'emails/expense_notification.html', context,
+            event_key=(
+                'expense', expense.id, expense.updated_at.isoformat(), expense.pool.name,
+                expense.paid_by.username, expense.paid_by.first_name,
+                expense.created_by.username, expense.created_by.first_name,
+            ),
+        )
+
         send_email_async(
             subject=subject,
             message=plain_message,
@@ -92,18 +133,16 @@ def send_expense_summary_email(pool, user):
     """Send expense summary email for a pool."""
     subject = f"Expense Summary for '{pool.name}'"
     
-    # Calculate user's balance and expenses
+    # User's balance comes from the balance engine; listings are single queries
     user_expenses = pool.expenses.filter(paid_by=user)
-    user_splits = []
+    user_splits = ExpenseSplit.objects.filter(
+        expense__pool=pool, user=user
+    ).select_related('expense')
     
-    for expense in pool.expenses.all():
-        splits = expense.splits.filter(user=user)
-        if splits.exists():
-            user_splits.extend(splits)
-    
-    total_paid = sum(expense.amount for expense in user_expenses)
-    total_owed = sum(split.amount for split in user_splits)
-    balance = total_paid - total_owed
+    totals = get_user_balance(pool.id, user.id)
+    total_paid = totals['paid']
+    total_owed = totals['owed']
+    balance = totals['net']
     
     context = {
         'pool': pool,
@@ -118,8 +157,7 @@ def send_expense_summary_email(pool, user):
     }
     
     # Render HTML email template
-    html_message = render_to_string('emails/expense_summary.html', context)
-    plain_message = strip_tags(html_message)
+    html_message, plain_message = render_email('emails/expense_summary.html', context)
     
     send_email_async(
         subject=subject,
@@ -141,9 +179,17 @@ def send_settlement_reminder_email(transaction):
         'pool_url': f"{settings.SITE_URL}/pools/{transaction.pool.id}/settle/" if hasattr(settings, 'SITE_URL') else f'http://localhost:8000/pools/{transaction.pool.id}/settle/'
     }
     
-    # Render HTML email template
-    html_message = render_to_string('emails/settlement_reminder.html', context)
-    plain_message = strip_tags(html_message)
+    # Keyed on everything shown: a corrected UPI id must reach the next reminder
+    payer, payee = transaction.from_user, transaction.to_user
+    payee_profile = getattr(payee, 'profile', None)
+    html_message, plain_message = render_email(
+        'emails/settlement_reminder.html', context,
+        event_key=(
+            'settlement_reminder', transaction.id, transaction.amount, transaction.status, transaction.pool.name,
+            payer.username, payer.first_name, payee.username, payee.first_name,
+            payee_profile.upi_id if payee_profile else '',
+        ),
+    )
     
     send_email_async(
         subject=subject,
@@ -155,27 +201,21 @@ def send_settlement_reminder_email(transaction):
 
 
 def send_weekly_summary_email(user):
-    """Send weekly summary email to user."""
+    """Send weekly summary email to user (send_weekly_summaries does this for everyone)."""
+    from .summaries import render_weekly_summary, weekly_summary_contexts
+
     subject = "Your Weekly FinSplit Summary"
     
-    # Get user's pools and recent activity
-    user_pools = Pool.objects.filter(members=user)
-    recent_expenses = Expense.objects.filter(
-        pool__in=user_pools,
-        created_at__gte=timezone.now() - timedelta(days=7)
-    ).order_by('-created_at')
-    
-    context = {
-        'user': user,
-        'user_pools': user_pools,
-        'recent_expenses': recent_expenses,
-        'site_name': 'FinSplit',
-        'dashboard_url': f"{settings.SITE_URL}/dashboard/" if hasattr(settings, 'SITE_URL') else 'http://localhost:8000/dashboard/'
-    }
+    # Same grouped queries as the batch job, for a chunk of one
+    since = timezone.now() - timedelta(days=7)
+    contexts = weekly_summary_contexts(
+        [{'id': user.id, 'username': user.username, 'first_name': user.first_name, 'email': user.email}], since
+    )
+    if user.id not in contexts or not user.email:
+        return
     
     # Render HTML email template
-    html_message = render_to_string('emails/weekly_summary.html', context)
-    plain_message = strip_tags(html_message)
+    html_message, plain_message = render_weekly_summary(contexts[user.id])
     
     send_email_async(
         subject=subject,
@@ -209,14 +249,17 @@ def validate_email_templates():
         'emails/expense_notification.html',
         'emails/expense_summary.html',
         'emails/settlement_reminder.html',
-        'emails/weekly_summary.html'
+        'emails/weekly_summary.html',
+        'emails/settlement_confirmation.html',
+        'emails/notification_digest.html',
     ]
     
     missing_templates = []
     
     for template in required_templates:
         try:
-            render_to_string(template, {})
+            # Loading compiles the template; rendering needs each email's context
+            get_template(template)
         except:
             missing_templates.append(template)
     
@@ -228,53 +271,64 @@ def validate_email_templates():
 
 
 
+def _settlement_confirmation_body(transaction, recipient, is_payer):
+    """The confirmation for one side of a settlement, rendered once per side and transaction."""
+    html_message, _ = render_email(
+        'emails/settlement_confirmation.html',
+        {'transaction': transaction, 'is_payer': is_payer},
+        event_key=(
+            'settlement', transaction.id, is_payer, transaction.settled_at.isoformat() if transaction.settled_at else '',
+            transaction.amount, transaction.pool.name, transaction.from_user.username, transaction.to_user.username,
+        ),
+        recipient_fields=('recipient_name',),
+    )
+    return personalize(html_message, {'recipient_name': recipient.first_name or recipient.username})
+
+
 def send_settlement_confirmation_email(transaction):
     """Send settlement confirmation email to both parties."""
     try:
         subject = f"Settlement Confirmed - {transaction.pool.name}"
+        pool_url = f"{settings.SITE_URL}/pools/{transaction.pool.id}/settle/" if hasattr(settings, 'SITE_URL') else f'http://localhost:8000/pools/{transaction.pool.id}/settle/'
+        digest_ids = digest_user_ids([transaction.from_user_id, transaction.to_user_id])
         
         # Email to the payer (from_user)
-        payer_context = {
-            'transaction': transaction,
-            'recipient_name': transaction.from_user.first_name or transaction.from_user.username,
-            'is_payer': True,
-        }
-        payer_html_content = render_to_string('emails/settlement_confirmation.html', payer_context)
-        
-        def send_payer_email():
-            send_mail(
-                subject=subject,
-                message=f"Your payment of ₹{transaction.amount} to {transaction.to_user.username} has been confirmed as settled.",
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[transaction.from_user.email],
-                html_message=payer_html_content,
-                fail_silently=True,
+        if transaction.from_user_id in digest_ids:
+            record_events(
+                'settlement', [transaction.from_user],
+                f"{transaction.to_user.username} confirmed your payment", pool=transaction.pool,
+                amount=transaction.amount, url=pool_url,
+            )
+        else:
+            payer_html_content = _settlement_confirmation_body(transaction, transaction.from_user, is_payer=True)
+            
+            send_email_async(
+                subject,
+                f"Your payment of ₹{transaction.amount} to {transaction.to_user.username} has been confirmed as settled.",
+                settings.DEFAULT_FROM_EMAIL,
+                [transaction.from_user.email],
+                payer_html_content,
             )
         
         # Email to the payee (to_user)
-        payee_context = {
-            'transaction': transaction,
-            'recipient_name': transaction.to_user.first_name or transaction.to_user.username,
-            'is_payer': False,
-        }
-        payee_html_content = render_to_string('emails/settlement_confirmation.html', payee_context)
-        
-        def send_payee_email():
-            send_mail(
-                subject=subject,
-                message=f"You have confirmed receipt of ₹{transaction.amount} from {transaction.from_user.username}.",
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[transaction.to_user.email],
-                html_message=payee_html_content,
-                fail_silently=True,
+        if transaction.to_user_id in digest_ids:
+            record_events(
+                'settlement', [transaction.to_user],
+                f"You confirmed a payment from {transaction.from_user.username}", pool=transaction.pool,
+                amount=transaction.amount, url=pool_url,
+            )
+        else:
+            payee_html_content = _settlement_confirmation_body(transaction, transaction.to_user, is_payer=False)
+            
+            send_email_async(
+                subject,
+                f"You have confirmed receipt of ₹{transaction.amount} from {transaction.from_user.username}.",
+                settings.DEFAULT_FROM_EMAIL,
+                [transaction.to_user.email],
+                payee_html_content,
             )
         
-        # Send emails in separate threads
-        threading.Thread(target=send_payer_email).start()
-        threading.Thread(target=send_payee_email).start()
-        
-        logger.info(f"Settlement confirmation emails sent for transaction {transaction.id}")
+        logger.info(f"Settlement confirmation emails queued for transaction {transaction.id}")
         
     except Exception as e:
         logger.error(f"Failed to send settlement confirmation emails for transaction {transaction.id}: {str(e)}")
-
@@ -0,0 +1,105 @@
+"""
+Streaming export for FinSplit.
+Yields a pool's expenses, splits or transactions as CSV or NDJSON lines,
+reading the rows with values_list() in chunks so memory use does not grow
+with the size of the pool.
+"""
+
+import csv
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Expense, ExpenseSplit, Transaction
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CHUNK_SIZE = 2000
+
+# kind: (model, pool lookup, date field, [(column, field)])
+EXPORTS = {
+    'expenses': (Expense, 'pool_id', 'expense_date', [
+        ('id', 'id'),
+        ('date', 'expense_date'),
+        ('title', 'title'),
+        ('description', 'description'),
+        ('amount', 'amount'),
+        ('paid_by', 'paid_by__username'),
+        ('created_by', 'created_by__username'),
+        ('split_method', 'split_method'),
+        ('created_at', 'created_at'),
+    ]),
+    'splits': (ExpenseSplit, 'expense__pool_id', 'expense__expense_date', [
+        ('expense_id', 'expense_id'),
+        ('date', 'expense__expense_date'),
+        ('title', 'expense__title'),
+        ('user', 'user__username'),
+        ('amount', 'amount'),
+        ('percentage', 'percentage'),
+    ]),
+    'transactions': (Transaction, 'pool_id', 'created_at', [
+        ('id', 'id'),
+        ('created_at', 'created_at'),
+        ('from_user', 'from_user__username'),
+        ('to_user', 'to_user__username'),
+        ('amount', 'amount'),
+        ('status', 'status'),
+        ('is_settled', 'is_settled'),
+        ('settled_at', 'settled_at'),
+        ('payment_method', 'payment_method'),
+        ('upi_transaction_id', 'upi_transaction_id'),
+        ('notes', 'notes'),
+    ]),
+}
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _day_bounds(start_date, end_date):
+    start = end = None
+    if start_date:
+        start = timezone.make_aware(datetime.combine(start_date, time.min))
+    if end_date:
+        end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return start, end
+
+
+def export_rows(pool_id, kind, start_date=None, end_date=None):
+    """
+    Rows (tuples) of one export kind for a pool, oldest first. ``start_date``
+    and ``end_date`` are inclusive dates.
+    """
+    model, pool_lookup, date_field, columns = EXPORTS[kind]
+    queryset = model.objects.filter(**{pool_lookup: pool_id})
+
+    start, end = _day_bounds(start_date, end_date)
+    if start:
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{date_field}__lt': end})
+
+    fields = [field for _, field in columns]
+    return queryset.order_by(date_field, 'pk').values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def stream_export(pool_id, kind, file_format='csv', start_date=None, end_date=None):
+    """
+    Generator of CSV or NDJSON text for a pool export. The CSV header is
+    yielded before the first query runs, so a response can start at once.
+    """
+    columns = [column for column, _ in EXPORTS[kind][3]]
+
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        for row in export_rows(pool_id, kind, start_date, end_date):
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in export_rows(pool_id, kind, start_date, end_date):
+            yield encoder.encode(dict(zip(columns, row))) + '\n'
@@ -4,13 +4,14 @@ Django forms for core app.
 from django import forms
 from django.contrib.auth.models import User
 from .models import Pool, Expense, Member, UserProfile, ExpenseSplit
+from .splits import SplitError, allocate_split, pool_member_ids
 
 
 class UserProfileForm(forms.ModelForm):
     """Form for user profile."""
     class Meta:
         model = UserProfile
-        fields = ['upi_id', 'phone_number']
+        fields = ['upi_id', 'phone_number', 'email_delivery']
         widgets = {
             'upi_id': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -20,8 +21,14 @@ class UserProfileForm(forms.ModelForm):
                 'class': 'form-control',
                 'placeholder': 'e.g., +91 9876543210'
             }),
+            'email_delivery': forms.Select(attrs={'class': 'form-select'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sign-up does not ask; a missing value keeps the model default
+        self.fields['email_delivery'].required = False
+
 
 class PoolForm(forms.ModelForm):
     """Form for creating and editing pools."""
@@ -91,12 +98,58 @@ class ExpenseForm(forms.ModelForm):
         pool = kwargs.pop('pool', None)
         super().__init__(*args, **kwargs)
         
+        self.pool = pool
+        self.split_allocation = None
+        
         if pool:
             # Limit paid_by choices to pool members
             self.fields['paid_by'].queryset = User.objects.filter(
                 member__pool=pool,
                 member__is_active=True
             )
+    
+    def split_values(self, member_ids):
+        """
+        Per-member split inputs posted with the form, keyed by user id, or
+        None when the form carries no split inputs at all.
+        """
+        if self.cleaned_data.get('split_method') == 'exclude':
+            if 'split_members' not in self.data:
+                return None
+            included = set(self.data.getlist('split_members'))
+            return {user_id: True for user_id in member_ids if str(user_id) not in included}
+        
+        values = {}
+        for key, value in self.data.items():
+            if key.startswith('split_value_') and value.strip():
+                try:
+                    values[int(key[len('split_value_'):])] = value
+                except ValueError:
+                    continue
+        return values or None
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        amount = cleaned_data.get('amount')
+        method = cleaned_data.get('split_method')
+        if not (self.pool and amount and method):
+            return cleaned_data
+        
+        member_ids = pool_member_ids(self.pool.id)
+        values = self.split_values(member_ids)
+        
+        # Editing other details keeps the existing splits
+        resplit = {'amount', 'split_method'} & set(self.changed_data)
+        if self.instance.pk and not resplit and values is None:
+            return cleaned_data
+        
+        # Resolve the split once; the view saves self.split_allocation as-is
+        try:
+            self.split_allocation = allocate_split(method, amount, member_ids, values)
+        except SplitError as e:
+            raise forms.ValidationError(str(e))
+        
+        return cleaned_data
 
 
 class MemberForm(forms.Form):
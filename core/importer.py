@@ -0,0 +1,256 @@
+"""
+Bulk expense import for FinSplit.
+Streams expenses from CSV or NDJSON into a pool in batches: one member lookup,
+one Expense INSERT, one ExpenseSplit INSERT and one ledger update per batch.
+"""
+
+import codecs
+import csv
+import json
+import logging
+import time
+from datetime import datetime, time as day_start
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .ledger import LedgerBatch
+from .models import Expense, ExpenseSplit, Member
+from .settlement import from_paise
+from .splits import SplitError, allocate_split, pool_member_ids
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 500
+
+# Columns (CSV) or keys (NDJSON) of an imported expense. Only title, amount
+# and paid_by are required. participants is "alice;bob" (equal split among
+# them), "alice=2;bob=1" (values for the split method), or a list / object
+# in NDJSON. With split_method "exclude" it names the members left out.
+IMPORT_FIELDS = (
+    'title', 'amount', 'paid_by', 'date', 'description', 'split_method', 'participants',
+)
+
+
+class ImportRowError(ValueError):
+    """Raised for a row that cannot be imported."""
+
+
+def _csv_rows(stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _ndjson_rows(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = ImportRowError(f'Invalid JSON: {e}')
+        else:
+            if not isinstance(row, dict):
+                row = ImportRowError('Each line must be a JSON object.')
+        yield line_number, row
+
+
+def read_rows(stream, file_format):
+    """
+    Yield (line number, row dict) from a text or binary stream, one row at a
+    time. Rows that cannot be parsed are yielded as ImportRowError instances.
+    """
+    if file_format not in IMPORT_FORMATS:
+        raise ValueError(f'Unsupported import format "{file_format}".')
+    if not isinstance(stream.read(0), str):
+        stream = codecs.getreader('utf-8-sig')(stream)
+    if file_format == 'csv':
+        return _csv_rows(stream)
+    return _ndjson_rows(stream)
+
+
+def _participants(value):
+    """[(username, value or None)] from the participants column."""
+    if not value:
+        return []
+    if isinstance(value, dict):
+        return [(str(name).strip(), share) for name, share in value.items()]
+    if isinstance(value, str):
+        value = [part for part in value.split(';') if part.strip()]
+    participants = []
+    for part in value:
+        name, _, share = str(part).partition('=')
+        participants.append((name.strip(), share.strip() or None))
+    return participants
+
+
+def _expense_date(value):
+    if not value:
+        return timezone.now()
+    # Well-formed but impossible dates such as 2024-02-30 raise ValueError
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        raise ImportRowError(f'Invalid date "{value}".')
+    if moment is None:
+        if day is None:
+            raise ImportRowError(f'Invalid date "{value}".')
+        moment = datetime.combine(day, day_start.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _build_row(row, pool, members, pool_user_ids, created_by):
+    """
+    Validate one row. ``members`` resolves the usernames named in the batch;
+    ``pool_user_ids`` are all active members, who share rows that name none.
+    Returns (Expense, [(user_id, paise)]).
+    """
+    if isinstance(row, ImportRowError):
+        raise row
+
+    title = str(row.get('title') or '').strip()
+    if not title:
+        raise ImportRowError('title is required.')
+    try:
+        amount = Decimal(str(row.get('amount') or '').strip())
+    except InvalidOperation:
+        raise ImportRowError(f'Invalid amount "{row.get("amount")}".')
+    if not amount.is_finite() or amount <= 0 or amount != amount.quantize(Decimal('0.01')):
+        raise ImportRowError(f'Invalid amount "{row.get("amount")}".')
+
+    payer = str(row.get('paid_by') or '').strip()
+    if payer not in members:
+        raise ImportRowError(f'Payer "{payer}" is not a member of this pool.')
+
+    method = str(row.get('split_method') or 'equal').strip()
+    participants = _participants(row.get('participants'))
+    unknown = [name for name, _ in participants if name not in members]
+    if unknown:
+        raise ImportRowError(f'Not members of this pool: {", ".join(unknown)}.')
+
+    if method == 'exclude':
+        user_ids = pool_user_ids
+        values = {members[name]: True for name, _ in participants}
+    elif participants and method == 'equal':
+        user_ids = [members[name] for name, _ in participants]
+        values = {}
+    else:
+        user_ids = pool_user_ids
+        values = {members[name]: share for name, share in participants if share is not None}
+
+    try:
+        allocation = allocate_split(method, amount, user_ids, values)
+    except SplitError as e:
+        raise ImportRowError(str(e))
+
+    expense = Expense(
+        pool=pool,
+        title=title[:200],
+        description=str(row.get('description') or ''),
+        amount=amount,
+        paid_by_id=members[payer],
+        created_by=created_by,
+        expense_date=_expense_date(str(row.get('date') or '').strip()),
+        split_method=method,
+    )
+    return expense, allocation
+
+
+def _member_ids(pool, rows):
+    """{username: user_id} for the active pool members named in a batch of rows."""
+    names = set()
+    for _, row in rows:
+        if isinstance(row, dict):
+            names.add(str(row.get('paid_by') or '').strip())
+            names.update(name for name, _ in _participants(row.get('participants')))
+    return dict(
+        Member.objects.filter(pool=pool, is_active=True, user__username__in=names)
+        .values_list('user__username', 'user_id')
+    )
+
+
+def _write_batch(pool, rows, pool_user_ids, created_by, result):
+    if not rows:
+        return
+    members = _member_ids(pool, rows)
+
+    built = []
+    for line_number, row in rows:
+        try:
+            built.append((line_number, *_build_row(row, pool, members, pool_user_ids, created_by)))
+        except (ImportRowError, SplitError, AttributeError, TypeError) as e:
+            result['errors'].append({'line': line_number, 'error': str(e)})
+
+    if not built:
+        return
+
+    try:
+        # One savepoint per batch, so a failing batch does not undo earlier ones
+        with transaction.atomic():
+            expenses = Expense.objects.bulk_create([expense for _, expense, _ in built])
+            batch = LedgerBatch(invalidate=False)
+            splits = []
+            for expense, (_, _, allocation) in zip(expenses, built):
+                batch.expense(pool.id, expense.paid_by_id, expense.amount)
+                for user_id, paise in allocation:
+                    if paise:
+                        splits.append(ExpenseSplit(
+                            expense=expense,
+                            user_id=user_id,
+                            amount=from_paise(paise),
+                            percentage=(Decimal(paise) / expense.amount).quantize(Decimal('0.01')),
+                        ))
+                        batch.split(pool.id, user_id, from_paise(paise))
+            ExpenseSplit.objects.bulk_create(splits)
+            batch.apply()
+    except Exception as e:
+        logger.error(f"Failed to import batch into pool {pool.id}: {str(e)}")
+        result['errors'].extend(
+            {'line': line_number, 'error': f'Batch failed: {e}'} for line_number, _, _ in built
+        )
+        return
+
+    result['created'] += len(built)
+
+
+def import_expenses(pool, stream, file_format='csv', created_by=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Import expenses into ``pool`` from a CSV or NDJSON stream.
+
+    Rows are read lazily and written ``batch_size`` at a time. A bad row is
+    reported and skipped; the rest of the file is still imported. The pool's
+    caches are invalidated once, after the last batch. Returns a dict with
+    'created', 'failed', 'errors' ([{'line', 'error'}]) and 'elapsed_ms'.
+    """
+    from .cache_utils import invalidate_pool_cache
+
+    started = time.perf_counter()
+    created_by = created_by or pool.created_by
+    result = {'created': 0, 'errors': []}
+    pool_user_ids = pool_member_ids(pool.id)
+
+    rows = []
+    for line_number, row in read_rows(stream, file_format):
+        rows.append((line_number, row))
+        if len(rows) >= batch_size:
+            _write_batch(pool, rows, pool_user_ids, created_by, result)
+            rows = []
+    _write_batch(pool, rows, pool_user_ids, created_by, result)
+
+    if result['created']:
+        transaction.on_commit(lambda: invalidate_pool_cache(pool.id))
+
+    result['failed'] = len(result['errors'])
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    logger.info(
+        f"Imported {result['created']} expense(s) into pool {pool.id}, "
+        f"{result['failed']} row(s) failed, in {result['elapsed_ms']:.0f} ms"
+    )
+    return result
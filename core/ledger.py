@@ -0,0 +1,133 @@
+"""
+Balance ledger for FinSplit.
+Keeps one MemberBalance row per pool member in step with expenses, splits and
+settled transactions, so reading balances never has to walk a pool's expenses.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+import logging
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from .models import Pool, MemberBalance
+from .balances import aggregate_pool_balances
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FIELDS = ('paid', 'owed', 'sent', 'received')
+ZERO = Decimal('0.00')
+
+
+def _net(changes):
+    """Net effect of a set of field changes (positive means owed money)."""
+    return (
+        changes.get('paid', ZERO) - changes.get('owed', ZERO)
+        + changes.get('sent', ZERO) - changes.get('received', ZERO)
+    )
+
+
+class LedgerBatch:
+    """
+    Collects ledger changes for any number of pools and users and writes
+    them in two queries per pool (one INSERT for missing rows, one UPDATE).
+    Pass invalidate=False when the caller invalidates the pools' caches itself.
+    """
+
+    def __init__(self, invalidate=True):
+        self.invalidate = invalidate
+        self.pools = defaultdict(lambda: defaultdict(lambda: defaultdict(Decimal)))
+
+    def add(self, pool_id, user_id, field, amount):
+        self.pools[pool_id][user_id][field] += Decimal(amount)
+
+    def expense(self, pool_id, paid_by_id, amount, sign=1):
+        self.add(pool_id, paid_by_id, 'paid', sign * amount)
+
+    def split(self, pool_id, user_id, amount, sign=1):
+        self.add(pool_id, user_id, 'owed', sign * amount)
+
+    def settlement(self, pool_id, from_user_id, to_user_id, amount, sign=1):
+        self.add(pool_id, from_user_id, 'sent', sign * amount)
+        self.add(pool_id, to_user_id, 'received', sign * amount)
+
+    def apply(self):
+        """Write all collected changes and invalidate the affected pools' caches."""
+        with transaction.atomic():
+            for pool_id, deltas in self.pools.items():
+                _apply_pool_deltas(pool_id, deltas, self.invalidate)
+        self.pools.clear()
+
+
+def _apply_pool_deltas(pool_id, deltas, invalidate=True):
+    deltas = {
+        user_id: changes for user_id, changes in deltas.items()
+        if any(changes.values())
+    }
+    if not deltas:
+        return
+
+    MemberBalance.objects.bulk_create(
+        [MemberBalance(pool_id=pool_id, user_id=user_id) for user_id in deltas],
+        ignore_conflicts=True,
+    )
+
+    updates = {'updated_at': timezone.now()}
+    for field in LEDGER_FIELDS + ('net',):
+        whens = []
+        for user_id, changes in deltas.items():
+            amount = _net(changes) if field == 'net' else changes.get(field, ZERO)
+            if amount:
+                whens.append(When(user_id=user_id, then=Value(amount)))
+        if whens:
+            updates[field] = F(field) + Case(
+                *whens,
+                default=Value(ZERO),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+
+    MemberBalance.objects.filter(pool_id=pool_id, user_id__in=list(deltas)).update(**updates)
+    bump_pool_version(pool_id)
+    if invalidate:
+        transaction.on_commit(lambda: _invalidate_pool(pool_id))
+
+
+def bump_pool_version(pool_id):
+    """
+    Mark a pool as changed, in the current transaction. Pool.version and
+    updated_at answer conditional requests without reading any balances.
+    """
+    Pool.objects.filter(pk=pool_id).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def _invalidate_pool(pool_id):
+    from .cache_utils import invalidate_pool_cache
+    invalidate_pool_cache(pool_id)
+
+
+def rebuild_pool_ledger(pool_id):
+    """Recompute a pool's ledger from scratch. Returns the number of rows written."""
+    with transaction.atomic():
+        # Serialise with concurrent ledger writers where the database supports it
+        list(Pool.objects.select_for_update().filter(pk=pool_id).values_list('pk', flat=True))
+        rows = [
+            MemberBalance(
+                pool_id=pool_id,
+                user_id=user_id,
+                paid=totals['paid'],
+                owed=totals['owed'],
+                sent=totals['sent'],
+                received=totals['received'],
+                net=totals['net'],
+            )
+            for user_id, totals in aggregate_pool_balances(pool_id).items()
+        ]
+        MemberBalance.objects.filter(pool_id=pool_id).delete()
+        MemberBalance.objects.bulk_create(rows)
+        bump_pool_version(pool_id)
+        transaction.on_commit(lambda: _invalidate_pool(pool_id))
+
+    logger.info(f"Rebuilt ledger for pool {pool_id} ({len(rows)} rows)")
+    return len(rows)
@@ -0,0 +1,83 @@
+"""
+Compare cache backends under concurrent worker processes.
+
+Each worker reads random keys from a shared key space and, on a miss, stores
+a balance-sized value, the way cache_result does. Per-process caches
+(LocMem) miss on every key another worker already computed; shared ones
+(file-based, shared memory) do not.
+"""
+import multiprocessing
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.shm_cache import SharedMemoryCache
+
+
+def _make_backend(name, location):
+    if name == 'locmem':
+        return LocMemCache('benchmark', {'OPTIONS': {'MAX_ENTRIES': 1000}})
+    if name == 'filebased':
+        return FileBasedCache(location, {'OPTIONS': {'MAX_ENTRIES': 100000}})
+    return SharedMemoryCache(location, {'OPTIONS': {'BUCKETS': 512, 'WAYS': 8, 'SLOT_SIZE': 8192}})
+
+
+def _worker(name, location, operations, keys, seed, results):
+    backend = _make_backend(name, location)
+    rng = random.Random(seed)
+    value = {user_id: {'paid': 1250.5, 'owes': 310.25, 'balance': 940.25} for user_id in range(20)}
+    hits = 0
+    started = time.perf_counter()
+    for _ in range(operations):
+        key = f'finsplit:pool_balances:{rng.randrange(keys)}'
+        if backend.get(key) is not None:
+            hits += 1
+        else:
+            backend.set(key, value, 300)
+    results.put((time.perf_counter() - started, hits))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark LocMem, file-based and shared-memory caches with concurrent workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent worker processes.')
+        parser.add_argument('--operations', type=int, default=5000, help='Cache reads per worker.')
+        parser.add_argument('--keys', type=int, default=500, help='Distinct keys in the workload.')
+        parser.add_argument(
+            '--backends', nargs='+', default=['locmem', 'filebased', 'shm'],
+            choices=['locmem', 'filebased', 'shm'], help='Backends to compare.'
+        )
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(f"{'backend':>10}  {'ops/s':>10}  {'hit rate':>8}")
+        for name in options['backends']:
+            directory = tempfile.mkdtemp(prefix='finsplit-cache-bench-')
+            location = directory if name == 'filebased' else f'{directory}/cache'
+            try:
+                results = context.Queue()
+                workers = [
+                    context.Process(
+                        target=_worker,
+                        args=(name, location, options['operations'], options['keys'], seed, results),
+                    )
+                    for seed in range(options['workers'])
+                ]
+                for worker in workers:
+                    worker.start()
+                timings = [results.get() for _ in workers]
+                for worker in workers:
+                    worker.join()
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+            total = options['operations'] * options['workers']
+            wall = max(elapsed for elapsed, _ in timings)
+            hits = sum(hit_count for _, hit_count in timings)
+            self.stdout.write(f'{name:>10}  {total / wall:>10.0f}  {hits / total:>8.1%}')
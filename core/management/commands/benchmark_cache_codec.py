@@ -0,0 +1,95 @@
+"""
+Measure the size of cached pool values with and without core.cache_codec.
+"""
+import pickle
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.cache_codec import decode, encode
+
+
+def _balances(size, rng):
+    balances = {}
+    for user_id in range(1, size + 1):
+        paid = rng.randrange(0, 5_000_000) / 100
+        owes = rng.randrange(0, 5_000_000) / 100
+        balances[user_id] = {
+            'user_id': user_id,
+            'username': f'member{user_id}',
+            'paid': paid,
+            'owes': owes,
+            'balance': round(paid - owes, 2),
+        }
+    return balances
+
+
+def _members(size):
+    return [
+        {
+            'id': user_id,
+            'username': f'member{user_id}',
+            'email': f'member{user_id}@example.com',
+            'first_name': 'First',
+            'last_name': 'Last',
+        }
+        for user_id in range(1, size + 1)
+    ]
+
+
+def _model_balances(balances):
+    """The shape of Pool.get_balances(): a User instance per member."""
+    return {
+        user_id: {
+            'user': User(id=user_id, username=row['username'], email=f"{row['username']}@example.com"),
+            'paid': row['paid'],
+            'owes': row['owes'],
+            'balance': row['balance'],
+        }
+        for user_id, row in balances.items()
+    }
+
+
+def _size(value):
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def _timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - started) / repeat * 1_000_000
+
+
+class Command(BaseCommand):
+    help = 'Report bytes per cached entry and encode/decode time for pool balances and members.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Pool sizes (members) to measure.'
+        )
+        parser.add_argument('--repeat', type=int, default=50, help='Runs averaged per timing.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        self.stdout.write(
+            f"{'prefix':>14} {'members':>8} {'User objs':>10} {'plain':>9} {'encoded':>9} "
+            f"{'ratio':>6} {'encode us':>10} {'decode us':>10}"
+        )
+        for size in options['sizes']:
+            balances = _balances(size, rng)
+            for prefix, value, baseline in (
+                ('pool_balances', balances, _size(_model_balances(balances))),
+                ('pool_members', _members(size), None),
+            ):
+                plain = _size(value)
+                stored, encode_us = _timed(lambda: encode(prefix, value), options['repeat'])
+                decoded, decode_us = _timed(lambda: decode(prefix, *stored), options['repeat'])
+                assert decoded == value
+                encoded = _size(stored)
+                self.stdout.write(
+                    f"{prefix:>14} {size:>8} {baseline if baseline else '-':>10} {plain:>9} {encoded:>9} "
+                    f"{plain / encoded:>5.1f}x {encode_us:>10.0f} {decode_us:>10.0f}"
+                )
@@ -0,0 +1,140 @@
+"""
+Compare a thread and a connection per email with core.email_dispatcher,
+sending to a local SMTP sink that discards what it receives.
+"""
+import socketserver
+import threading
+import time
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.management.base import BaseCommand, CommandError
+
+from core.email_dispatcher import EmailDispatcher
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accept every message and discard it."""
+
+    def _reply(self, line):
+        time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        # Stands in for TCP + TLS setup with a remote server
+        time.sleep(self.server.handshake)
+        self._reply('220 sink ESMTP')
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self._reply('250 sink')
+            elif command == 'DATA':
+                self._reply('354 end with .')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                with self.server.lock:
+                    self.server.messages += 1
+                self._reply('250 queued')
+            elif command == 'QUIT':
+                self._reply('221 bye')
+                return
+            else:
+                self._reply('250 ok')
+
+
+class _Sink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, handshake, latency):
+        super().__init__(('127.0.0.1', 0), _SinkHandler)
+        self.handshake = handshake
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+
+
+def _message(number):
+    email = EmailMultiAlternatives(
+        f'Benchmark {number}', 'Plain body ' * 20, 'bench@finsplit.test', [f'user{number}@finsplit.test']
+    )
+    email.attach_alternative('<p>HTML body</p>' * 20, 'text/html')
+    return email
+
+
+class Command(BaseCommand):
+    help = 'Measure email throughput: a thread per email versus the pooled dispatcher, against a local SMTP sink.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Emails sent per run.')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Dispatcher pool sizes.')
+        parser.add_argument('--batch-size', type=int, default=50, help='Emails a worker takes from the queue at a time.')
+        parser.add_argument(
+            '--handshake-ms', type=float, default=20.0, help='Delay the sink adds to each new connection.'
+        )
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay the sink adds to each reply.')
+
+    def handle(self, *args, **options):
+        if options['messages'] < 1 or min(options['workers']) < 1:
+            raise CommandError('--messages and --workers must be at least 1')
+
+        sink = _Sink(options['handshake_ms'] / 1000, options['latency_ms'] / 1000)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        host, port = sink.server_address
+
+        def connect():
+            return get_connection(
+                'django.core.mail.backends.smtp.EmailBackend',
+                host=host, port=port, username='', password='', use_tls=False, use_ssl=False,
+                fail_silently=False,
+            )
+
+        messages = [_message(number) for number in range(options['messages'])]
+        self.stdout.write(
+            f"{len(messages)} emails, sink handshake {options['handshake_ms']:.0f} ms, "
+            f"latency {options['latency_ms']:.0f} ms per reply"
+        )
+        self.stdout.write(f"{'mode':>22} {'seconds':>8} {'emails/s':>9} {'connections':>12} {'delivered':>10}")
+
+        def run(label, send):
+            before = (sink.connections, sink.messages)
+            started = time.perf_counter()
+            send()
+            elapsed = time.perf_counter() - started
+            connections, delivered = sink.connections - before[0], sink.messages - before[1]
+            self.stdout.write(
+                f"{label:>22} {elapsed:>8.2f} {len(messages) / elapsed:>9.0f} {connections:>12} {delivered:>10}"
+            )
+
+        def thread_per_email():
+            # What email_utils used to do: send_mail() in a new thread per email
+            threads = [
+                threading.Thread(target=lambda message=message: connect().send_messages([message]))
+                for message in messages
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        run('thread per email', thread_per_email)
+
+        for workers in options['workers']:
+            def pooled(workers=workers):
+                dispatcher = EmailDispatcher(
+                    workers=workers, queue_size=len(messages), batch_size=options['batch_size'],
+                    connection_factory=connect,
+                )
+                for message in messages:
+                    dispatcher.send(message)
+                dispatcher.flush()
+                dispatcher.shutdown()
+
+            run(f'dispatcher x{workers}', pooled)
+
+        sink.shutdown()
+        sink.server_close()
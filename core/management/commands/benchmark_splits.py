@@ -0,0 +1,71 @@
+"""
+Time how long it takes to write an expense's splits for pools of various sizes.
+
+Compares the old one-INSERT-per-member approach with save_expense_splits().
+Everything runs in a transaction that is rolled back, so no data is kept.
+"""
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Pool, Member, Expense, ExpenseSplit
+from core.splits import equal_allocation, save_expense_splits
+from core.settlement import from_paise
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ExpenseSplit inserts (per-row vs bulk) for several pool sizes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+            help='Pool sizes (number of members) to benchmark.'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the best is reported.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'members':>8}  {'per-row ms':>11}  {'bulk ms':>9}  {'speedup':>8}")
+        for size in options['sizes']:
+            per_row, bulk = self.run_size(size, options['repeat'])
+            self.stdout.write(f'{size:>8}  {per_row:>11.2f}  {bulk:>9.2f}  {per_row / bulk:>7.1f}x')
+
+    def run_size(self, size, repeat):
+        with transaction.atomic():
+            owner = User.objects.create(username='bench_split_owner')
+            users = User.objects.bulk_create(
+                [User(username=f'bench_split_{size}_{index}') for index in range(size - 1)]
+            )
+            users = [owner] + list(User.objects.filter(username__startswith=f'bench_split_{size}_'))
+            pool = Pool.objects.create(name=f'Benchmark {size}', created_by=owner)
+            Member.objects.bulk_create([Member(pool=pool, user=user) for user in users])
+            user_ids = [user.id for user in users]
+
+            per_row = min(self.time_per_row(pool, owner, user_ids) for _ in range(repeat))
+            bulk = min(self.time_bulk(pool, owner, user_ids) for _ in range(repeat))
+
+            transaction.set_rollback(True)
+        return per_row, bulk
+
+    def new_expense(self, pool, owner):
+        return Expense.objects.create(
+            pool=pool, title='Benchmark', amount=Decimal('100.00'),
+            paid_by=owner, created_by=owner,
+        )
+
+    def time_per_row(self, pool, owner, user_ids):
+        expense = self.new_expense(pool, owner)
+        started = time.perf_counter()
+        with transaction.atomic():
+            for user_id, paise in equal_allocation(expense.amount, user_ids):
+                ExpenseSplit.objects.create(expense=expense, user_id=user_id, amount=from_paise(paise))
+        return (time.perf_counter() - started) * 1000
+
+    def time_bulk(self, pool, owner, user_ids):
+        expense = self.new_expense(pool, owner)
+        started = time.perf_counter()
+        with transaction.atomic():
+            save_expense_splits(expense, equal_allocation(expense.amount, user_ids))
+        return (time.perf_counter() - started) * 1000
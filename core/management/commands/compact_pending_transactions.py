@@ -0,0 +1,53 @@
+"""
+Remove duplicate pending settlement suggestions.
+
+Older versions of the settle page inserted a pending Transaction for every
+suggested transfer on every page load. This keeps the newest pending row for
+each (pool, from_user, to_user, amount) and deletes the other copies.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Delete duplicate pending, unsettled transactions, keeping the newest of each.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', type=int, dest='pool_id', help='Only compact this pool.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per query.')
+        parser.add_argument('--dry-run', action='store_true', help='Report duplicates without deleting.')
+
+    def handle(self, *args, **options):
+        pending = Transaction.objects.filter(status='pending', is_settled=False)
+        if options['pool_id']:
+            pending = pending.filter(pool_id=options['pool_id'])
+
+        seen = set()
+        duplicates = []
+        rows = pending.order_by('-created_at', '-id').values_list(
+            'id', 'pool_id', 'from_user_id', 'to_user_id', 'amount'
+        )
+        for transaction_id, *key in rows.iterator(chunk_size=2000):
+            key = tuple(key)
+            if key in seen:
+                duplicates.append(transaction_id)
+            else:
+                seen.add(key)
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(duplicates)} duplicate pending transaction(s) would be deleted.')
+            return
+
+        batch_size = options['batch_size']
+        deleted = 0
+        for start in range(0, len(duplicates), batch_size):
+            with transaction.atomic():
+                deleted += Transaction.objects.filter(
+                    id__in=duplicates[start:start + batch_size]
+                ).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} duplicate pending transaction(s); {len(seen)} remain.'
+        ))
@@ -0,0 +1,61 @@
+"""
+Bulk import expenses into a pool from a CSV or NDJSON file.
+"""
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import DEFAULT_BATCH_SIZE, IMPORT_FORMATS, import_expenses
+from core.models import Pool
+
+
+class Command(BaseCommand):
+    help = 'Import expenses into a pool from CSV or NDJSON (use - for stdin).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pool_id', type=int, help='ID of the pool to import into.')
+        parser.add_argument('path', help='File to import, or - to read standard input.')
+        parser.add_argument(
+            '--format', choices=IMPORT_FORMATS, dest='file_format',
+            help='File format; guessed from the file extension when omitted.'
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows written per batch.')
+        parser.add_argument('--user', help='Username recorded as creator (defaults to the pool creator).')
+        parser.add_argument('--max-errors', type=int, default=50, help='Row errors to print.')
+
+    def handle(self, *args, **options):
+        try:
+            pool = Pool.objects.get(id=options['pool_id'])
+        except Pool.DoesNotExist:
+            raise CommandError(f"Pool {options['pool_id']} does not exist")
+
+        created_by = None
+        if options['user']:
+            created_by = User.objects.filter(username=options['user']).first()
+            if created_by is None:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        path = options['path']
+        file_format = options['file_format']
+        if file_format is None:
+            file_format = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+        if path == '-':
+            result = import_expenses(pool, sys.stdin, file_format, created_by, options['batch_size'])
+        else:
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    result = import_expenses(pool, stream, file_format, created_by, options['batch_size'])
+            except OSError as e:
+                raise CommandError(str(e))
+
+        for error in result['errors'][:options['max_errors']]:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        if result['failed'] > options['max_errors']:
+            self.stderr.write(f"... and {result['failed'] - options['max_errors']} more")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['created']} expense(s) into {pool.name}; "
+            f"{result['failed']} row(s) failed, in {result['elapsed_ms']:.0f} ms."
+        ))
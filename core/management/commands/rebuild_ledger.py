@@ -0,0 +1,36 @@
+"""
+Recompute the balance ledger from expenses, splits and settled transactions.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ledger import rebuild_pool_ledger
+from core.models import Pool
+
+
+class Command(BaseCommand):
+    help = 'Rebuild MemberBalance rows from scratch for one or more pools (all pools by default).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pool', type=int, action='append', dest='pool_ids',
+            help='ID of a pool to rebuild. Can be given more than once.'
+        )
+
+    def handle(self, *args, **options):
+        pool_ids = options['pool_ids']
+        if pool_ids:
+            missing = set(pool_ids) - set(Pool.objects.filter(id__in=pool_ids).values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Unknown pool id(s): {', '.join(map(str, sorted(missing)))}")
+        else:
+            pool_ids = Pool.objects.values_list('id', flat=True)
+
+        total_pools = 0
+        total_rows = 0
+        for pool_id in pool_ids:
+            total_rows += rebuild_pool_ledger(pool_id)
+            total_pools += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt ledger for {total_pools} pool(s), {total_rows} balance row(s).'
+        ))
@@ -0,0 +1,24 @@
+"""
+Send notification digests that are due. Run it every few minutes (e.g. from
+cron); each digest goes to the outbox for send_outbox to deliver.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.digests import DIGEST_WINDOW, send_due_digests
+
+
+class Command(BaseCommand):
+    help = 'Email one digest to each user whose oldest pending notification is older than the digest window.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window', type=int, default=DIGEST_WINDOW,
+            help='Seconds a notification may wait before its digest is sent.',
+        )
+
+    def handle(self, *args, **options):
+        if options['window'] < 0:
+            raise CommandError('--window cannot be negative')
+
+        digests, events = send_due_digests(options['window'])
+        self.stdout.write(self.style.SUCCESS(f"Sent {digests} digest(s) covering {events} notification(s)."))
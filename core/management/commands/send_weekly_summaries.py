@@ -0,0 +1,110 @@
+"""
+Queue the weekly summary email of every user. Schedule it weekly, e.g.
+``0 8 * * MON python manage.py send_weekly_summaries`` in cron.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import multiprocessing
+import os
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.email_utils import send_email_async
+from core.outbox import enqueue_emails, outbox_enabled
+from core.summaries import render_weekly_summary, weekly_summary_contexts
+
+SUBJECT = "Your Weekly FinSplit Summary"
+
+
+class Command(BaseCommand):
+    help = "Compute every user's weekly activity and balances in bulk and queue their summary emails."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Length of the summarised period.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users summarised per batch of queries.')
+        parser.add_argument(
+            '--workers', type=int, default=min(4, (os.cpu_count() or 1) - 1),
+            help='Processes rendering emails alongside this one, which runs the queries; 0 renders here.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Compute and render, but queue nothing.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 0 or options['days'] < 1:
+            raise CommandError('--chunk-size and --days must be at least 1 and --workers cannot be negative')
+
+        since = timezone.now() - timedelta(days=options['days'])
+        users = (
+            User.objects.filter(is_active=True).exclude(email='')
+            .order_by('id').values('id', 'username', 'first_name', 'email')
+        )
+        total = users.count()
+        self.stdout.write(f"Summarising {total} user(s) since {since:%Y-%m-%d %H:%M}.")
+
+        # Templates render in fresh processes; forked ones would share this process's DB connection
+        executor = None
+        if options['workers']:
+            executor = ProcessPoolExecutor(
+                options['workers'], mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+            )
+
+        pool_stats = {}
+        done = queued = 0
+        last_id = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                chunk = list(users.filter(id__gt=last_id)[:options['chunk_size']])
+                if not chunk:
+                    break
+                last_id = chunk[-1]['id']
+
+                contexts = list(weekly_summary_contexts(chunk, since, pool_stats).values())
+                if executor:
+                    bodies = executor.map(
+                        render_weekly_summary, contexts, chunksize=max(1, len(contexts) // (options['workers'] * 4))
+                    )
+                else:
+                    bodies = map(render_weekly_summary, contexts)
+                emails = [
+                    {
+                        'subject': SUBJECT, 'body': text, 'html_body': html,
+                        'from_email': settings.DEFAULT_FROM_EMAIL, 'recipients': [context['email']],
+                    }
+                    for context, (html, text) in zip(contexts, bodies)
+                ]
+
+                if not options['dry_run']:
+                    queued += self._queue(emails)
+                done += len(chunk)
+
+                elapsed = time.perf_counter() - started
+                rate = done / elapsed if elapsed else 0
+                eta = (total - done) / rate if rate else 0
+                self.stdout.write(
+                    f"{done}/{total} users ({done * 100 // max(total, 1)}%), {queued} email(s) queued, "
+                    f"{rate:.0f} users/s, about {eta:.0f}s left"
+                )
+        finally:
+            if executor:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Queued {queued} weekly summar{'y' if queued == 1 else 'ies'} for {done} user(s) "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
+
+    def _queue(self, emails):
+        if outbox_enabled():
+            return enqueue_emails(emails)
+        with transaction.atomic():
+            for email in emails:
+                send_email_async(
+                    email['subject'], email['body'], email['from_email'], email['recipients'], email['html_body']
+                )
+        return len(emails)
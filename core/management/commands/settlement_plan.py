@@ -0,0 +1,41 @@
+"""
+Print the suggested settlement transfers for a pool.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Pool
+from core.settlement import plan_settlements
+
+
+class Command(BaseCommand):
+    help = 'Show the transfers that would settle every balance in a pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pool_id', type=int, help='ID of the pool to settle.')
+        parser.add_argument(
+            '--mode', choices=['greedy', 'optimal'], default='greedy',
+            help='greedy (any pool size) or optimal (fewest transfers, with a time budget).'
+        )
+        parser.add_argument(
+            '--time-budget', type=float, default=None,
+            help='CPU seconds the optimal solver may use before falling back to greedy.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            pool = Pool.objects.get(id=options['pool_id'])
+        except Pool.DoesNotExist:
+            raise CommandError(f"Pool {options['pool_id']} does not exist")
+
+        balances = pool.get_balances()
+        plan = plan_settlements(balances, mode=options['mode'], time_budget=options['time_budget'])
+
+        for settlement in plan.settlements:
+            self.stdout.write(
+                f"{settlement['from_user'].username} pays "
+                f"{settlement['to_user'].username} ₹{settlement['amount']}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(plan.settlements)} transfer(s) for {len(balances)} member(s) '
+            f'by {plan.algorithm} in {plan.elapsed_ms:.2f} ms.'
+        ))
@@ -0,0 +1,47 @@
+"""
+Pre-warm the caches of the most recently active pools, e.g. after a deploy.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Pool
+from core.warmer import warm_pools
+
+
+class Command(BaseCommand):
+    help = 'Warm the cached summaries, balances and members of the top-N most recently active pools.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=100, help='Number of pools to warm.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Pools warmed at the same time.')
+        parser.add_argument(
+            '--members', action='store_true', help="Also warm the pools' members' dashboards."
+        )
+        parser.add_argument('pool_ids', nargs='*', type=int, help='Warm these pools instead of the top N.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        pool_ids = options['pool_ids']
+        if not pool_ids:
+            # Pool.updated_at moves with every expense, member and transaction
+            pool_ids = list(
+                Pool.objects.filter(is_active=True)
+                .order_by('-updated_at')
+                .values_list('id', flat=True)[:options['top']]
+            )
+        if not pool_ids:
+            self.stdout.write('No pools to warm.')
+            return
+
+        metrics = warm_pools(pool_ids, options['concurrency'], options['members'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {metrics['count']} cache(s) for {len(pool_ids)} pool(s) in {metrics['wall_ms']:.0f} ms "
+            f"with concurrency {options['concurrency']}; {metrics['failed']} failed."
+        ))
+        if metrics['count']:
+            self.stdout.write(
+                f"Per item: mean {metrics['mean_ms']:.1f} ms, p95 {metrics['p95_ms']:.1f} ms, "
+                f"max {metrics['max_ms']:.1f} ms."
+            )
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:35
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_ledger(apps, schema_editor):
+    """Populate the ledger from existing expenses, splits and settled transactions."""
+    from collections import defaultdict
+
+    Expense = apps.get_model('core', 'Expense')
+    ExpenseSplit = apps.get_model('core', 'ExpenseSplit')
+    Transaction = apps.get_model('core', 'Transaction')
+    MemberBalance = apps.get_model('core', 'MemberBalance')
+
+    totals = defaultdict(lambda: defaultdict(Decimal))
+    for pool_id, user_id, amount in Expense.objects.values_list('pool_id', 'paid_by_id', 'amount').iterator():
+        totals[(pool_id, user_id)]['paid'] += amount
+    for pool_id, user_id, amount in ExpenseSplit.objects.values_list('expense__pool_id', 'user_id', 'amount').iterator():
+        totals[(pool_id, user_id)]['owed'] += amount
+    settled = Transaction.objects.filter(is_settled=True).values_list('pool_id', 'from_user_id', 'to_user_id', 'amount')
+    for pool_id, from_user_id, to_user_id, amount in settled.iterator():
+        totals[(pool_id, from_user_id)]['sent'] += amount
+        totals[(pool_id, to_user_id)]['received'] += amount
+
+    MemberBalance.objects.bulk_create([
+        MemberBalance(
+            pool_id=pool_id,
+            user_id=user_id,
+            paid=t['paid'],
+            owed=t['owed'],
+            sent=t['sent'],
+            received=t['received'],
+            net=t['paid'] - t['owed'] + t['sent'] - t['received'],
+        )
+        for (pool_id, user_id), t in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_transaction_is_settled_transaction_settled_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('sent', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('received', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('net', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to='core.pool')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pool_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Member Balance',
+                'verbose_name_plural': 'Member Balances',
+                'unique_together': {('pool', 'user')},
+            },
+        ),
+        migrations.RunPython(build_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_memberbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='plan_version',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_transaction_plan_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='split_method',
+            field=models.CharField(choices=[('equal', 'Equal Split'), ('percentage', 'Percentage Split'), ('shares', 'Split by Shares'), ('manual', 'Exact Amounts'), ('exclude', 'Equal, Excluding Some')], default='equal', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='pool',
+            name='default_split_method',
+            field=models.CharField(choices=[('equal', 'Equal Split'), ('percentage', 'Percentage Split'), ('shares', 'Split by Shares'), ('manual', 'Exact Amounts'), ('exclude', 'Equal, Excluding Some')], default='equal', max_length=20),
+        ),
+    ]
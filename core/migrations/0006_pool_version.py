@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_split_method_choices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pool',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -9,6 +9,22 @@ from decimal import Decimal
 import uuid
 
 
+# How an expense is divided; see core.splits for the strategies
+SPLIT_METHOD_CHOICES = [
+    ('equal', 'Equal Split'),
+    ('percentage', 'Percentage Split'),
+    ('shares', 'Split by Shares'),
+    ('manual', 'Exact Amounts'),
+    ('exclude', 'Equal, Excluding Some'),
+]
+
+# How a user gets notification emails; see core.digests
+EMAIL_DELIVERY_CHOICES = [
+    ('instant', 'Instantly'),
+    ('digest', 'Digest'),
+]
+
+
 class UserProfile(models.Model):
     """Extended user profile with UPI information."""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -32,6 +48,12 @@ class UserProfile(models.Model):
         ],
         blank=True
     )
+    email_delivery = models.CharField(
+        max_length=10,
+        choices=EMAIL_DELIVERY_CHOICES,
+        default='instant',
+        help_text='Get an email for every update, or one digest of them every so often'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -52,21 +74,30 @@ class Pool(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Bumped, with updated_at, whenever the pool's expenses, splits, members
+    # or transactions change (see ledger.bump_pool_version)
+    version = models.PositiveBigIntegerField(default=0, editable=False)
     
     # Pool settings
     default_split_method = models.CharField(
         max_length=20,
-        choices=[
-            ('equal', 'Equal Split'),
-            ('percentage', 'Percentage Split'),
-            ('manual', 'Manual Split'),
-        ],
+        choices=SPLIT_METHOD_CHOICES,
         default='equal'
     )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # version only moves through bump_pool_version()'s UPDATE; writing back
+        # a stale in-memory value could move it backwards and reuse an ETag
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'version']
+        super().save(*args, **kwargs)
+
     def get_total_expenses(self):
         """Calculate total expenses in this pool."""
         return self.expenses.aggregate(
@@ -78,10 +109,14 @@ class Pool(models.Model):
         return self.members.filter(member__is_active=True).count()
 
     def get_balances(self):
-        """Calculate balances for all members in the pool."""
+        """
+        Get balances for all active members, read from the balance ledger.
+        Removed members who still owe or are owed money are included, so the
+        balances always sum to zero.
+        """
         balances = {}
         members = self.members.filter(member__is_active=True)
-        
+
         for member in members:
             balances[member.id] = {
                 'user': member,
@@ -89,23 +124,25 @@ class Pool(models.Model):
                 'owes': Decimal('0.00'),
                 'balance': Decimal('0.00')
             }
-        
-        # Calculate what each member paid
-        for expense in self.expenses.all():
-            if expense.paid_by.id in balances:
-                balances[expense.paid_by.id]['paid'] += expense.amount
-        
-        # Calculate what each member owes
-        for expense in self.expenses.all():
-            splits = expense.splits.all()
-            for split in splits:
-                if split.user.id in balances:
-                    balances[split.user.id]['owes'] += split.amount
-        
-        # Calculate net balance (positive means they are owed money, negative means they owe money)
-        for member_id in balances:
-            balances[member_id]['balance'] = balances[member_id]['paid'] - balances[member_id]['owes']
-        
+
+        # One ledger row per member (positive net means they are owed money)
+        from .balances import get_pool_balances
+        rows = get_pool_balances(self.id)
+        unsettled = [user_id for user_id, row in rows.items() if user_id not in balances and row['net']]
+        for user in User.objects.filter(id__in=unsettled) if unsettled else ():
+            balances[user.id] = {
+                'user': user,
+                'paid': Decimal('0.00'),
+                'owes': Decimal('0.00'),
+                'balance': Decimal('0.00')
+            }
+        for user_id, row in rows.items():
+            if user_id not in balances:
+                continue
+            balances[user_id]['paid'] = row['paid']
+            balances[user_id]['owes'] = row['owed']
+            balances[user_id]['balance'] = row['net']
+
         return balances
 
     class Meta:
@@ -152,11 +189,7 @@ class Expense(models.Model):
     # Split method for this expense
     split_method = models.CharField(
         max_length=20,
-        choices=[
-            ('equal', 'Equal Split'),
-            ('percentage', 'Percentage Split'),
-            ('manual', 'Manual Split'),
-        ],
+        choices=SPLIT_METHOD_CHOICES,
         default='equal'
     )
     
@@ -256,6 +289,9 @@ class Transaction(models.Model):
     
     # Notes
     notes = models.TextField(blank=True)
+    
+    # Settlement plan this transaction was committed from (blank if entered manually)
+    plan_version = models.CharField(max_length=40, blank=True)
 
     def __str__(self):
         return f"{self.from_user.username} → {self.to_user.username}: ₹{self.amount}"
@@ -294,6 +330,33 @@ class Transaction(models.Model):
         verbose_name_plural = "Transactions"
 
 
+class MemberBalance(models.Model):
+    """Running balance of a user in a pool, maintained by core.ledger."""
+    pool = models.ForeignKey(Pool, on_delete=models.CASCADE, related_name='ledger')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pool_balances')
+
+    # Totals from expenses and their splits
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    # Totals from settled transactions
+    sent = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    received = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    # paid - owed + sent - received (positive means they are owed money)
+    net = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} in {self.pool.name}: ₹{self.net}"
+
+    class Meta:
+        unique_together = ['pool', 'user']
+        verbose_name = "Member Balance"
+        verbose_name_plural = "Member Balances"
+
+
 class Invitation(models.Model):
     """Invitations sent to join pools."""
     pool = models.ForeignKey(Pool, on_delete=models.CASCADE, related_name='invitations')
@@ -326,3 +389,70 @@ class Invitation(models.Model):
         verbose_name = "Invitation"
         verbose_name_plural = "Invitations"
 
+
+
+class Outbox(models.Model):
+    """An email waiting to be sent by the send_outbox command (see core.outbox)."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField(default=list)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    # Set while a worker holds the row; an expired claim is picked up again
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # created_at to sent_at
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+        verbose_name = "Outbox Email"
+        verbose_name_plural = "Outbox"
+
+
+class NotificationEvent(models.Model):
+    """An update waiting to go out in a recipient's next digest email (see core.digests)."""
+    KIND_CHOICES = [
+        ('expense', 'Expense'),
+        ('settlement', 'Settlement'),
+        ('invite', 'Invite'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    pool = models.ForeignKey(Pool, on_delete=models.CASCADE, null=True, blank=True, related_name='notification_events')
+    summary = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    url = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event went out in a digest
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.recipient.username}: {self.summary}"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['sent_at', 'recipient'])]
+        verbose_name = "Notification Event"
+        verbose_name_plural = "Notification Events"
@@ -0,0 +1,111 @@
+"""
+Cross-pool debt netting for FinSplit.
+Combines what a user owes and is owed across all of their active pools, so
+that two people who share several pools settle with one transfer instead of
+one per pool.
+"""
+
+from collections import defaultdict
+import logging
+
+from django.contrib.auth.models import User
+from django.db.models import F
+
+from .models import Pool, MemberBalance
+from .settlement import greedy_settlements, from_paise, to_paise
+
+logger = logging.getLogger(__name__)
+
+
+def _pool_vectors(pool_ids):
+    """{pool_id: {user_id: net paise}} for active members, in one query."""
+    vectors = defaultdict(dict)
+    rows = MemberBalance.objects.filter(
+        pool_id__in=pool_ids,
+        user__member__pool_id=F('pool_id'),
+        user__member__is_active=True,
+    ).exclude(net=0).values_list('pool_id', 'user_id', 'net')
+    for pool_id, user_id, net in rows:
+        vectors[pool_id][user_id] = to_paise(net)
+    return vectors
+
+
+def get_user_settlements(user_id):
+    """
+    Net a user's obligations across every active pool they belong to.
+
+    Each pool is settled with the settlement engine, and the transfers that
+    involve the user are combined per counterparty. Transfers are netted
+    pairwise: nobody is asked to pay a person they share no debt with.
+
+    Returns a dict with the netted 'transfers' (each with a per-pool
+    'breakdown' of the obligations it clears), 'you_owe', 'owed_to_you',
+    'net' and 'transfers_before_netting'.
+    """
+    pools = dict(
+        Pool.objects.filter(
+            member__user_id=user_id, member__is_active=True, is_active=True
+        ).values_list('id', 'name')
+    )
+
+    # Signed amount per counterparty and pool: positive means they owe the user
+    pairwise = defaultdict(lambda: defaultdict(int))
+    transfers_before_netting = 0
+    for pool_id, vector in _pool_vectors(list(pools)).items():
+        if user_id not in vector:
+            continue
+        for transfer in greedy_settlements(vector):
+            if transfer.to_user_id == user_id:
+                pairwise[transfer.from_user_id][pool_id] += transfer.amount
+            elif transfer.from_user_id == user_id:
+                pairwise[transfer.to_user_id][pool_id] -= transfer.amount
+            else:
+                continue
+            transfers_before_netting += 1
+
+    usernames = dict(User.objects.filter(id__in=list(pairwise)).values_list('id', 'username'))
+    username = User.objects.filter(id=user_id).values_list('username', flat=True).first()
+
+    transfers = []
+    you_owe = owed_to_you = 0
+    for other_id, by_pool in pairwise.items():
+        net = sum(by_pool.values())
+        if net == 0:
+            continue
+
+        if net > 0:
+            owed_to_you += net
+            from_id, to_id = other_id, user_id
+        else:
+            you_owe += -net
+            from_id, to_id = user_id, other_id
+
+        direction = 1 if net > 0 else -1
+        transfers.append({
+            'from_user_id': from_id,
+            'from_username': usernames.get(from_id, username),
+            'to_user_id': to_id,
+            'to_username': usernames.get(to_id, username),
+            'amount': from_paise(abs(net)),
+            # Amounts against the transfer's direction are offsets netted away
+            'breakdown': [
+                {
+                    'pool_id': pool_id,
+                    'pool_name': pools[pool_id],
+                    'amount': from_paise(direction * amount),
+                }
+                for pool_id, amount in sorted(by_pool.items())
+                if amount
+            ],
+        })
+
+    transfers.sort(key=lambda transfer: (-transfer['amount'], transfer['from_user_id'], transfer['to_user_id']))
+
+    return {
+        'user_id': user_id,
+        'transfers': transfers,
+        'you_owe': from_paise(you_owe),
+        'owed_to_you': from_paise(owed_to_you),
+        'net': from_paise(owed_to_you - you_owe),
+        'transfers_before_netting': transfers_before_netting,
+    }
@@ -0,0 +1,169 @@
+"""
+Transactional email outbox for FinSplit.
+Email helpers insert an Outbox row inside the request's transaction, so an
+email exists exactly when the change it reports was committed and survives
+worker restarts. The send_outbox command claims rows in batches, sends them
+over one reused connection and retries failures with exponential backoff.
+"""
+
+from datetime import timedelta
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Outbox
+
+logger = logging.getLogger(__name__)
+
+EMAIL_OUTBOX = getattr(settings, 'FINSPLIT_EMAIL_OUTBOX', {})
+BATCH_SIZE = EMAIL_OUTBOX.get('BATCH_SIZE', 100)
+MAX_ATTEMPTS = EMAIL_OUTBOX.get('MAX_ATTEMPTS', 6)
+BACKOFF_BASE = EMAIL_OUTBOX.get('BACKOFF_BASE', 30)
+BACKOFF_MAX = EMAIL_OUTBOX.get('BACKOFF_MAX', 3600)
+CLAIM_TIMEOUT = EMAIL_OUTBOX.get('CLAIM_TIMEOUT', 300)
+# Seconds between extensions of a claim while its batch is being sent
+RENEW_INTERVAL = EMAIL_OUTBOX.get('RENEW_INTERVAL', CLAIM_TIMEOUT / 3)
+
+
+def outbox_enabled():
+    """Whether email helpers write to the outbox (read per call so tests can override it)."""
+    return getattr(settings, 'FINSPLIT_EMAIL_OUTBOX', {}).get('ENABLED', True)
+
+
+def enqueue_email(subject, body, from_email, recipients, html_body=''):
+    """Insert an email for the send_outbox worker; a single INSERT."""
+    return Outbox.objects.create(
+        subject=subject[:255],
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email,
+        recipients=list(recipients),
+    )
+
+
+def enqueue_emails(emails, batch_size=500):
+    """Insert many emails at once; ``emails`` are dicts of enqueue_email()'s arguments."""
+    rows = Outbox.objects.bulk_create([
+        Outbox(
+            subject=email['subject'][:255],
+            body=email['body'],
+            html_body=email.get('html_body') or '',
+            from_email=email['from_email'],
+            recipients=list(email['recipients']),
+        )
+        for email in emails
+    ], batch_size=batch_size)
+    return len(rows)
+
+
+def backoff(attempts):
+    """Seconds to wait before attempt number ``attempts + 1``."""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def claim_batch(size=BATCH_SIZE):
+    """
+    Claim up to ``size`` due emails for this worker. Rows are taken with a
+    conditional UPDATE, so concurrent workers never claim the same row, and
+    rows held by a worker that died are claimed again once their claim expires.
+    """
+    now = timezone.now()
+    due = Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_until__lt=now)
+    ids = list(Outbox.objects.filter(due).order_by('next_attempt_at').values_list('id', flat=True)[:size])
+    if not ids:
+        return []
+
+    token = uuid.uuid4()
+    Outbox.objects.filter(due, id__in=ids).update(
+        status='sending', claim_token=token, claimed_until=now + timedelta(seconds=CLAIM_TIMEOUT)
+    )
+    return list(Outbox.objects.filter(claim_token=token, status='sending'))
+
+
+def renew_claim(rows):
+    """
+    Push back the expiry of this worker's claim on ``rows``. Returns the ids
+    it still holds; a row missing from the result was claimed by another
+    worker after this claim expired, and must not be sent or saved here.
+    """
+    if not rows:
+        return set()
+    held = Outbox.objects.filter(
+        id__in=[row.id for row in rows], claim_token=rows[0].claim_token, status='sending'
+    )
+    held.update(claimed_until=timezone.now() + timedelta(seconds=CLAIM_TIMEOUT))
+    return set(held.values_list('id', flat=True))
+
+
+def _message(row, connection):
+    message = EmailMultiAlternatives(
+        row.subject, row.body, row.from_email, row.recipients, connection=connection
+    )
+    if row.html_body:
+        message.attach_alternative(row.html_body, 'text/html')
+    return message
+
+
+def deliver_batch(rows, connection=None):
+    """
+    Send claimed rows over one connection, opening or reopening it as
+    needed. The claim is renewed every RENEW_INTERVAL seconds, so a slow
+    batch is not claimed and sent again by another worker. Returns
+    (connection, counts) so the caller can reuse the connection for its
+    next batch.
+    """
+    counts = {'sent': 0, 'retried': 0, 'failed': 0, 'latencies_ms': []}
+    done = []
+    held = {row.id for row in rows}
+    renewed = time.monotonic()
+    for index, row in enumerate(rows):
+        if time.monotonic() - renewed >= RENEW_INTERVAL:
+            held = renew_claim(rows[index:])
+            renewed = time.monotonic()
+        if row.id not in held:
+            logger.warning(f"Lost the claim on outbox email {row.id}; leaving it to the worker that holds it")
+            continue
+        try:
+            if connection is None:
+                connection = get_connection(fail_silently=False)
+                connection.open()
+            connection.send_messages([_message(row, connection)])
+        except Exception as e:
+            # The connection may be unusable; start the next email on a fresh one
+            try:
+                connection.close()
+            except Exception:
+                pass
+            connection = None
+            row.attempts += 1
+            row.last_error = str(e)[:1000]
+            if row.attempts >= MAX_ATTEMPTS:
+                row.status = 'failed'
+                counts['failed'] += 1
+                logger.error(f"Giving up on outbox email {row.id} after {row.attempts} attempts: {str(e)}")
+            else:
+                row.status = 'pending'
+                row.next_attempt_at = timezone.now() + timedelta(seconds=backoff(row.attempts))
+                counts['retried'] += 1
+                logger.warning(f"Outbox email {row.id} failed (attempt {row.attempts}), retrying: {str(e)}")
+        else:
+            row.status = 'sent'
+            row.sent_at = timezone.now()
+            row.latency_ms = int((row.sent_at - row.created_at).total_seconds() * 1000)
+            row.attempts += 1
+            counts['sent'] += 1
+            counts['latencies_ms'].append(row.latency_ms)
+        row.claim_token = None
+        row.claimed_until = None
+        done.append(row)
+
+    Outbox.objects.bulk_update(done, [
+        'status', 'attempts', 'next_attempt_at', 'last_error', 'claim_token', 'claimed_until',
+        'sent_at', 'latency_ms',
+    ])
+    return connection, counts
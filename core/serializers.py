@@ -3,7 +3,9 @@ Django REST Framework serializers for core app.
 """
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
 from .models import Pool, Member, Expense, Transaction, ExpenseSplit, UserProfile, Invitation
+from .splits import SplitError, allocate_split, pool_member_ids, save_expense_splits
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -80,18 +82,69 @@ class ExpenseSerializer(serializers.ModelSerializer):
     pool_name = serializers.CharField(source='pool.name', read_only=True)
     splits = ExpenseSplitSerializer(many=True, read_only=True)
     split_summary = serializers.SerializerMethodField()
+    # Inputs for the split method: {user_id: percentage / shares / amount}
+    split_values = serializers.DictField(child=serializers.CharField(), write_only=True, required=False)
+    excluded_user_ids = serializers.ListField(
+        child=serializers.IntegerField(), write_only=True, required=False
+    )
     
     class Meta:
         model = Expense
         fields = [
             'id', 'pool', 'pool_name', 'title', 'description', 'amount',
             'paid_by', 'paid_by_id', 'created_by', 'expense_date', 'created_at',
-            'updated_at', 'split_method', 'receipt_image', 'splits', 'split_summary'
+            'updated_at', 'split_method', 'receipt_image', 'splits', 'split_summary',
+            'split_values', 'excluded_user_ids'
         ]
         read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
     
     def get_split_summary(self, obj):
         return obj.get_split_summary()
+    
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        split_values = attrs.pop('split_values', None)
+        excluded_user_ids = attrs.pop('excluded_user_ids', None)
+        self.split_allocation = None
+        
+        instance = self.instance
+        resplit = split_values is not None or excluded_user_ids is not None or (
+            'amount' in attrs or 'split_method' in attrs
+        )
+        if instance is not None and not resplit:
+            return attrs
+        
+        pool = attrs.get('pool') or instance.pool
+        amount = attrs.get('amount', getattr(instance, 'amount', None))
+        method = attrs.get('split_method') or getattr(instance, 'split_method', None) or 'equal'
+        
+        if method == 'exclude':
+            values = {user_id: True for user_id in excluded_user_ids or []}
+        else:
+            try:
+                values = {int(user_id): value for user_id, value in (split_values or {}).items()}
+            except ValueError:
+                raise serializers.ValidationError({'split_values': 'Keys must be user ids.'})
+        
+        # Resolved once here; create() and update() save the result as-is
+        try:
+            self.split_allocation = allocate_split(method, amount, pool_member_ids(pool.id), values)
+        except SplitError as e:
+            raise serializers.ValidationError({'split_method': str(e)})
+        return attrs
+    
+    def create(self, validated_data):
+        with transaction.atomic():
+            expense = super().create(validated_data)
+            save_expense_splits(expense, self.split_allocation)
+        return expense
+    
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            expense = super().update(instance, validated_data)
+            if self.split_allocation is not None:
+                save_expense_splits(expense, self.split_allocation, replace=True)
+        return expense
 
 
 class TransactionSerializer(serializers.ModelSerializer):
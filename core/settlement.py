@@ -0,0 +1,353 @@
+"""
+Settlement engine for FinSplit.
+Turns a vector of net balances into a short list of transfers that clears
+every balance. All arithmetic is done in integer paise so amounts never drift.
+"""
+
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+import hashlib
+import heapq
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# amount is in paise
+Transfer = namedtuple('Transfer', ['from_user_id', 'to_user_id', 'amount'])
+
+# settlements is a list of dicts as returned by settle_balances(); version
+# identifies the ledger state the plan was built from (see plan_version())
+SettlementPlan = namedtuple(
+    'SettlementPlan', ['settlements', 'algorithm', 'elapsed_ms', 'version'], defaults=[None]
+)
+
+# Exact solver limits (overridable in settings)
+DEFAULT_OPTIMAL_TIME_BUDGET = 0.5     # seconds of CPU time
+DEFAULT_OPTIMAL_MAX_BALANCES = 25     # non-zero balances after pairing
+BUDGET_CHECK_INTERVAL = 1024          # submasks tried between clock reads
+
+
+class BudgetExceeded(Exception):
+    """Raised when the exact solver runs out of its CPU-time budget."""
+
+
+class UnbalancedBalances(ValueError):
+    """Raised when the balances handed to the exact solver do not sum to zero."""
+
+
+def to_paise(amount):
+    """Convert a rupee amount (Decimal, str, int or float) to integer paise."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_paise(paise):
+    """Convert integer paise back to a rupee Decimal with two places."""
+    return (Decimal(paise) / 100).quantize(Decimal('0.01'))
+
+
+def net_paise(balances):
+    """
+    Build {user_id: net paise} from a balances dict such as the one returned by
+    Pool.get_balances() or get_cached_pool_balances(). Zero balances are dropped.
+    """
+    vector = {}
+    for user_id, info in balances.items():
+        paise = to_paise(info['balance'])
+        if paise:
+            vector[user_id] = paise
+    return vector
+
+
+def greedy_settlements(vector):
+    """
+    Settle a {user_id: net paise} vector with at most n - 1 transfers.
+
+    The largest debtor always pays the largest creditor, using a max-heap on
+    each side, so the plan is built in O(n log n). Positive balances are owed
+    money, negative balances owe money. If the vector does not sum to zero the
+    unmatched remainder is left unsettled.
+    """
+    creditors = [(-amount, user_id) for user_id, amount in vector.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in vector.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        credit, debt = -credit, -debt
+
+        amount = min(credit, debt)
+        transfers.append(Transfer(debtor, creditor, amount))
+
+        if credit > amount:
+            heapq.heappush(creditors, (amount - credit, creditor))
+        if debt > amount:
+            heapq.heappush(debtors, (amount - debt, debtor))
+
+    return transfers
+
+
+def _pair_opposites(vector):
+    """
+    Settle every debtor whose debt exactly matches a creditor's credit with a
+    single transfer. Such pairs are always part of some optimal plan.
+    Returns (transfers, remaining vector).
+    """
+    creditors_by_amount = {}
+    for user_id, amount in sorted(vector.items()):
+        if amount > 0:
+            creditors_by_amount.setdefault(amount, []).append(user_id)
+
+    transfers = []
+    remaining = dict(vector)
+    for user_id, amount in sorted(vector.items()):
+        if amount < 0 and creditors_by_amount.get(-amount):
+            creditor = creditors_by_amount[-amount].pop()
+            transfers.append(Transfer(user_id, creditor, -amount))
+            del remaining[user_id]
+            del remaining[creditor]
+    return transfers, remaining
+
+
+def _max_zero_sum_partition(values, deadline):
+    """
+    Split ``values`` (summing to zero) into the largest number of disjoint
+    zero-sum groups. Returns a list of bitmasks, one per group.
+
+    Memoised search over bitmasks of the values still to place: the group
+    holding the lowest remaining value is chosen among the zero-sum submasks
+    of the remainder. Subset sums are looked up in two half-width tables
+    (meet in the middle) instead of one 2**n table.
+    """
+    n = len(values)
+    half = n // 2
+    low_mask = (1 << half) - 1
+
+    def subset_sums(items):
+        sums = [0] * (1 << len(items))
+        for mask in range(1, len(sums)):
+            lowest = mask & -mask
+            sums[mask] = sums[mask ^ lowest] + items[lowest.bit_length() - 1]
+        return sums
+
+    low_sums = subset_sums(values[:half])
+    high_sums = subset_sums(values[half:])
+    memo = {0: ()}
+    steps = 0
+
+    def solve(mask):
+        nonlocal steps
+        if mask in memo:
+            return memo[mask]
+        if time.process_time() > deadline:
+            raise BudgetExceeded()
+
+        lowest = mask & -mask
+        rest = mask ^ lowest
+        best = (mask,)  # one group holding everything left
+        sub = rest
+        while sub:
+            # A single call can try millions of submasks, so the clock is read inside the loop too
+            steps += 1
+            if not steps % BUDGET_CHECK_INTERVAL and time.process_time() > deadline:
+                raise BudgetExceeded()
+            group = sub | lowest
+            if group != mask and low_sums[group & low_mask] + high_sums[group >> half] == 0:
+                candidate = (group,) + solve(mask ^ group)
+                if len(candidate) > len(best):
+                    best = candidate
+            sub = (sub - 1) & rest
+
+        memo[mask] = best
+        return best
+
+    return list(solve((1 << n) - 1))
+
+
+def optimal_settlements(vector, time_budget=None):
+    """
+    Settle a {user_id: net paise} vector with the fewest possible transfers.
+
+    A group of k balances that sums to zero needs k - 1 transfers, so the
+    minimum is n minus the largest number of zero-sum groups the balances can
+    be split into. Raises BudgetExceeded when the search needs more than
+    ``time_budget`` seconds of CPU time, or when there are too many balances
+    for an exact search, and UnbalancedBalances when the vector does not sum
+    to zero.
+    """
+    if time_budget is None:
+        time_budget = getattr(settings, 'SETTLEMENT_OPTIMAL_TIME_BUDGET', DEFAULT_OPTIMAL_TIME_BUDGET)
+    max_balances = getattr(settings, 'SETTLEMENT_OPTIMAL_MAX_BALANCES', DEFAULT_OPTIMAL_MAX_BALANCES)
+    deadline = time.process_time() + time_budget
+
+    drift = sum(vector.values())
+    if drift:
+        raise UnbalancedBalances(f"Balances do not sum to zero (off by {drift} paise)")
+
+    transfers, remaining = _pair_opposites(vector)
+    if not remaining:
+        return transfers
+    if len(remaining) > max_balances:
+        raise BudgetExceeded()
+
+    user_ids = sorted(remaining)
+    values = [remaining[user_id] for user_id in user_ids]
+    for group in _max_zero_sum_partition(values, deadline):
+        members = {
+            user_ids[index]: values[index]
+            for index in range(len(values)) if group >> index & 1
+        }
+        transfers.extend(greedy_settlements(members))
+    return transfers
+
+
+def _settlement_dicts(balances, transfers):
+    settlements = []
+    for transfer in transfers:
+        settlement = {
+            'from_user_id': transfer.from_user_id,
+            'to_user_id': transfer.to_user_id,
+            'amount': from_paise(transfer.amount),
+        }
+        if 'user' in balances[transfer.from_user_id]:
+            settlement['from_user'] = balances[transfer.from_user_id]['user']
+            settlement['to_user'] = balances[transfer.to_user_id]['user']
+        settlements.append(settlement)
+    return settlements
+
+
+def plan_settlements(balances, mode='greedy', time_budget=None):
+    """
+    Build a SettlementPlan for a balances dict keyed by user id.
+
+    ``mode`` is 'greedy' (heap-based, any pool size) or 'optimal' (fewest
+    transfers, falling back to greedy when the time budget runs out). The
+    plan reports which algorithm produced it: 'greedy', 'optimal',
+    'greedy-fallback', or 'unbalanced' when the balances do not sum to zero
+    and only the greedy plan can be offered.
+    """
+    started = time.perf_counter()
+    vector = net_paise(balances)
+
+    algorithm = 'greedy'
+    transfers = None
+    if mode == 'optimal':
+        try:
+            transfers = optimal_settlements(vector, time_budget)
+            algorithm = 'optimal'
+        except BudgetExceeded:
+            algorithm = 'greedy-fallback'
+        except UnbalancedBalances as e:
+            # A ledger bug, not a slow search; greedy still settles what it can
+            logger.error(f"Cannot plan optimal settlements: {str(e)}")
+            algorithm = 'unbalanced'
+    if transfers is None:
+        transfers = greedy_settlements(vector)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return SettlementPlan(_settlement_dicts(balances, transfers), algorithm, round(elapsed_ms, 3))
+
+
+def settle_balances(balances):
+    """
+    Suggested transfers for a balances dict keyed by user id.
+
+    Returns a list of dicts with from_user_id, to_user_id and amount (Decimal
+    rupees). When the balances carry 'user' objects (Pool.get_balances()),
+    from_user and to_user are included as well.
+    """
+    return plan_settlements(balances).settlements
+
+
+# Stored plans
+#
+# A plan only depends on the pool's net balances and the solver mode, so it is
+# cached under a version derived from those. Reloading the settle page reuses
+# the cached plan, and Transactions are only written when a user commits it.
+
+def plan_version(balances, mode='greedy'):
+    """Fingerprint of the net balance vector a plan is computed from."""
+    vector = net_paise(balances)
+    state = ','.join(f'{user_id}:{vector[user_id]}' for user_id in sorted(vector))
+    return hashlib.sha1(f'{mode}|{state}'.encode()).hexdigest()
+
+
+def get_pool_settlement_plan(pool, balances=None, mode='greedy'):
+    """
+    Cached SettlementPlan for a pool's current balances. The cache entry is
+    keyed by plan_version(), so any ledger change yields a fresh plan.
+    """
+    from . import cache_stats
+    from .cache_utils import CACHE_TIMEOUTS, generate_cache_key
+
+    if balances is None:
+        balances = pool.get_balances()
+    version = plan_version(balances, mode)
+    cache_key = generate_cache_key('settlement_plan', pool.id, version)
+
+    stored = cache.get(cache_key)
+    cache_stats.record('settlement_plan', 'misses' if stored is None else 'hits')
+    if stored is not None:
+        transfers = [Transfer(*transfer) for transfer in stored['transfers']]
+        return SettlementPlan(
+            _settlement_dicts(balances, transfers), stored['algorithm'], stored['elapsed_ms'], version
+        )
+
+    plan = plan_settlements(balances, mode=mode)
+    cache_stats.record_compute('settlement_plan', plan.elapsed_ms / 1000)
+    cache.set(cache_key, {
+        'transfers': [
+            (s['from_user_id'], s['to_user_id'], to_paise(s['amount'])) for s in plan.settlements
+        ],
+        'algorithm': plan.algorithm,
+        'elapsed_ms': plan.elapsed_ms,
+    }, CACHE_TIMEOUTS['settlement_plan'])
+    cache_stats.record('settlement_plan', 'sets')
+    return plan._replace(version=version)
+
+
+def commit_settlement_plan(pool, plan):
+    """
+    Materialise a plan as pending Transactions with a single bulk_create.
+
+    Pending suggestions from older plans are cancelled rather than left next
+    to the new ones; pending transactions recorded by hand (no plan_version)
+    are kept. Committing the same plan again is a no-op. Returns the list of
+    created transactions (empty when already committed).
+    """
+    from .models import Transaction
+
+    with transaction.atomic():
+        pending = Transaction.objects.select_for_update().filter(
+            pool=pool, status='pending', is_settled=False
+        )
+        if pending.filter(plan_version=plan.version).exists():
+            return []
+
+        superseded = (
+            pending.exclude(plan_version='').exclude(plan_version=plan.version).update(status='cancelled')
+        )
+        created = Transaction.objects.bulk_create([
+            Transaction(
+                pool=pool,
+                from_user_id=settlement['from_user_id'],
+                to_user_id=settlement['to_user_id'],
+                amount=settlement['amount'],
+                status='pending',
+                plan_version=plan.version,
+            )
+            for settlement in plan.settlements
+        ])
+
+    logger.info(
+        f"Committed settlement plan {plan.version} for pool {pool.id}: "
+        f"{len(created)} created, {superseded} superseded"
+    )
+    return created
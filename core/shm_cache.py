@@ -0,0 +1,405 @@
+"""
+Shared-memory cache backend for FinSplit.
+
+Stores cache entries in a memory-mapped file, so every worker process on a
+host shares one cache (and one set of invalidations) without running Redis
+or memcached. Configure it with:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.shm_cache.SharedMemoryCache',
+            'LOCATION': '/var/lib/finsplit/finsplit-cache',
+            'OPTIONS': {'BUCKETS': 512, 'WAYS': 8, 'SLOT_SIZE': 8192},
+        }
+    }
+
+The file is split into BUCKETS buckets of WAYS fixed-size slots. A key is
+hashed to one bucket and can live in any of its slots; when all of them are
+taken, the least recently used entry of the bucket is evicted. Each bucket
+is guarded by a byte-range lock on the file (for other processes) and a
+striped thread lock (for threads of this process). Values that do not fit
+in a slot are not cached.
+
+Entries are unpickled, so the file must be private: it is created 0600 in a
+directory created 0700, and an existing file that belongs to another user,
+is readable or writable by others, or is a symlink is refused.
+"""
+
+import collections
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import stat
+import struct
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+MAGIC = b'FSPLTSHM'
+FORMAT_VERSION = 1
+
+# magic, format version, ways, buckets, slot size
+FILE_HEADER = struct.Struct('<8sHHII')
+FILE_HEADER_SIZE = 64
+# hits, misses, sets, evictions
+BUCKET_HEADER = struct.Struct('<QQQQ')
+# used, key hash, expiry (0 = never), last access, key length, value length
+SLOT_HEADER = struct.Struct('<B7xQddII')
+
+THREAD_LOCK_STRIPES = 64
+EVICTION_LOG_SIZE = 10000
+
+# One mapping per file and process: POSIX record locks belong to the
+# process, and closing any descriptor of the file would drop all of them
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+class _Mapping:
+    """The shared file of one cache location, mapped into this process."""
+
+    def __init__(self, path, buckets, ways, slot_size):
+        self.path = path
+        self.buckets = buckets
+        self.ways = ways
+        self.slot_size = slot_size
+        self.bucket_size = BUCKET_HEADER.size + ways * slot_size
+        self.size = FILE_HEADER_SIZE + buckets * self.bucket_size
+        self.thread_locks = [threading.Lock() for _ in range(THREAD_LOCK_STRIPES)]
+        # Keys this process evicted, until drain_evictions() collects them
+        self.evicted = collections.deque(maxlen=EVICTION_LOG_SIZE)
+
+        self.fd = _open_private(path)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            header = FILE_HEADER.pack(MAGIC, FORMAT_VERSION, ways, buckets, slot_size)
+            if os.fstat(self.fd).st_size != self.size or os.pread(self.fd, FILE_HEADER.size, 0) != header:
+                # New file, or one laid out for other options: start empty
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, header, 0)
+            self.map = mmap.mmap(self.fd, self.size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def bucket_offset(self, bucket):
+        return FILE_HEADER_SIZE + bucket * self.bucket_size
+
+    def lock(self, bucket):
+        return _BucketLock(self, bucket)
+
+    def lock_all(self):
+        return _BucketLock(self, None)
+
+
+def _open_private(path):
+    """Open (creating if needed) a cache file only this user can read or write."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+        # The umask may have taken bits off the requested mode
+        os.fchmod(fd, 0o600)
+        return fd
+    except FileExistsError:
+        pass
+
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NOFOLLOW)
+    except OSError as e:
+        raise ImproperlyConfigured(f"Cannot open cache file {path}: {str(e)}")
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o600:
+        os.close(fd)
+        raise ImproperlyConfigured(
+            f"Refusing cache file {path}: it must be a regular file owned by this user with mode 0600"
+        )
+    return fd
+
+
+class _BucketLock:
+    """Exclusive lock on one bucket (or on the whole file when bucket is None)."""
+
+    def __init__(self, mapping, bucket):
+        self.mapping = mapping
+        self.bucket = bucket
+
+    def __enter__(self):
+        mapping = self.mapping
+        if self.bucket is None:
+            self.thread_locks = mapping.thread_locks
+            start, length = 0, 0
+        else:
+            self.thread_locks = [mapping.thread_locks[self.bucket % THREAD_LOCK_STRIPES]]
+            start, length = mapping.bucket_offset(self.bucket), mapping.bucket_size
+        for lock in self.thread_locks:
+            lock.acquire()
+        fcntl.lockf(mapping.fd, fcntl.LOCK_EX, length, start)
+        self.range = (length, start)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self.mapping.fd, fcntl.LOCK_UN, *self.range)
+        for lock in reversed(self.thread_locks):
+            lock.release()
+
+
+def _get_mapping(path, buckets, ways, slot_size):
+    key = (path, os.getpid())
+    with _mappings_lock:
+        mapping = _mappings.get(key)
+        if mapping is None:
+            mapping = _mappings[key] = _Mapping(path, buckets, ways, slot_size)
+        return mapping
+
+
+class SharedMemoryCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._location = location
+        self._buckets = int(options.get('BUCKETS', 512))
+        self._ways = int(options.get('WAYS', 8))
+        self._slot_size = int(options.get('SLOT_SIZE', 8192))
+        self._mapping = None
+
+    @property
+    def mapping(self):
+        if self._mapping is None or self._mapping.map.closed:
+            self._mapping = _get_mapping(self._location, self._buckets, self._ways, self._slot_size)
+        return self._mapping
+
+    # Slot access; callers hold the bucket lock
+
+    def _locate(self, key):
+        raw = key.encode()
+        key_hash = int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), 'little')
+        return raw, key_hash, key_hash % self._buckets
+
+    def _slot_offset(self, bucket, way):
+        return (
+            self.mapping.bucket_offset(bucket) + BUCKET_HEADER.size + way * self._slot_size
+        )
+
+    def _count(self, bucket, field, amount=1):
+        buf = self.mapping.map
+        offset = self.mapping.bucket_offset(bucket)
+        counters = list(BUCKET_HEADER.unpack_from(buf, offset))
+        counters[field] += amount
+        BUCKET_HEADER.pack_into(buf, offset, *counters)
+
+    def _find(self, raw, key_hash, bucket, now):
+        """(way, slot header) of a live entry for the key, or (None, None)."""
+        buf = self.mapping.map
+        for way in range(self._ways):
+            offset = self._slot_offset(bucket, way)
+            used, slot_hash, expires, accessed, key_len, value_len = SLOT_HEADER.unpack_from(buf, offset)
+            if not used or slot_hash != key_hash:
+                continue
+            start = offset + SLOT_HEADER.size
+            if buf[start:start + key_len] != raw:
+                continue
+            if expires and expires <= now:
+                buf[offset] = 0
+                return None, None
+            return way, (expires, key_len, value_len)
+        return None, None
+
+    def _read(self, bucket, way, header, now):
+        buf = self.mapping.map
+        offset = self._slot_offset(bucket, way)
+        expires, key_len, value_len = header
+        struct.pack_into('<d', buf, offset + 24, now)  # last access
+        start = offset + SLOT_HEADER.size + key_len
+        return buf[start:start + value_len]
+
+    def _write(self, raw, key_hash, bucket, pickled, expires, now, way=None):
+        """Store an entry, reusing ``way`` or picking a free or LRU slot. False if too big."""
+        if SLOT_HEADER.size + len(raw) + len(pickled) > self._slot_size:
+            if way is not None:
+                self.mapping.map[self._slot_offset(bucket, way)] = 0
+            return False
+
+        buf = self.mapping.map
+        if way is None:
+            victim, victim_access, victim_key_len, evicting = None, None, 0, False
+            for candidate in range(self._ways):
+                used, _, slot_expires, accessed, key_len, _ = SLOT_HEADER.unpack_from(
+                    buf, self._slot_offset(bucket, candidate)
+                )
+                if not used or (slot_expires and slot_expires <= now):
+                    victim, evicting = candidate, False
+                    break
+                if victim_access is None or accessed < victim_access:
+                    victim, victim_access, victim_key_len, evicting = candidate, accessed, key_len, True
+            way = victim
+            if evicting:
+                self._count(bucket, 3)
+                start = self._slot_offset(bucket, way) + SLOT_HEADER.size
+                self.mapping.evicted.append(bytes(buf[start:start + victim_key_len]))
+
+        offset = self._slot_offset(bucket, way)
+        SLOT_HEADER.pack_into(buf, offset, 0, key_hash, expires or 0.0, now, len(raw), len(pickled))
+        start = offset + SLOT_HEADER.size
+        buf[start:start + len(raw)] = raw
+        buf[start + len(raw):start + len(raw) + len(pickled)] = pickled
+        buf[offset] = 1  # mark used last, once the entry is complete
+        self._count(bucket, 2)
+        return True
+
+    def _expiry(self, timeout):
+        return self.get_backend_timeout(timeout)
+
+    # Cache API
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        raw, key_hash, bucket = self._locate(key)
+        now = time.time()
+        with self.mapping.lock(bucket):
+            way, _ = self._find(raw, key_hash, bucket, now)
+            if way is not None:
+                return False
+            return self._write(raw, key_hash, bucket, pickled, self._expiry(timeout), now)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        raw, key_hash, bucket = self._locate(key)
+        now = time.time()
+        with self.mapping.lock(bucket):
+            way, header = self._find(raw, key_hash, bucket, now)
+            if way is None:
+                self._count(bucket, 1)
+                return default
+            pickled = self._read(bucket, way, header, now)
+            self._count(bucket, 0)
+        return pickle.loads(pickled)
+
+    def _set(self, key, value, timeout):
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        raw, key_hash, bucket = self._locate(key)
+        now = time.time()
+        with self.mapping.lock(bucket):
+            way, _ = self._find(raw, key_hash, bucket, now)
+            return self._write(raw, key_hash, bucket, pickled, self._expiry(timeout), now, way)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._set(key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        raw, key_hash, bucket = self._locate(key)
+        now = time.time()
+        with self.mapping.lock(bucket):
+            way, _ = self._find(raw, key_hash, bucket, now)
+            if way is None:
+                return False
+            expires = self._expiry(timeout)
+            struct.pack_into('<d', self.mapping.map, self._slot_offset(bucket, way) + 16, expires or 0.0)
+            return True
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        raw, key_hash, bucket = self._locate(key)
+        with self.mapping.lock(bucket):
+            way, _ = self._find(raw, key_hash, bucket, time.time())
+            if way is None:
+                return False
+            self.mapping.map[self._slot_offset(bucket, way)] = 0
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        raw, key_hash, bucket = self._locate(key)
+        now = time.time()
+        with self.mapping.lock(bucket):
+            way, header = self._find(raw, key_hash, bucket, now)
+            if way is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(self._read(bucket, way, header, now)) + delta
+            expires = header[0] or None
+            self._write(raw, key_hash, bucket, pickle.dumps(new_value, self.pickle_protocol), expires, now, way)
+        return new_value
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        raw, key_hash, bucket = self._locate(key)
+        with self.mapping.lock(bucket):
+            way, _ = self._find(raw, key_hash, bucket, time.time())
+        return way is not None
+
+    def get_many(self, keys, version=None):
+        found = {}
+        for key in keys:
+            value = self.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = []
+        for key, value in data.items():
+            if not self._set(self.make_and_validate_key(key, version=version), value, timeout):
+                failed.append(key)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.delete(key, version=version)
+
+    def clear(self):
+        mapping = self.mapping
+        with mapping.lock_all():
+            for bucket in range(self._buckets):
+                offset = mapping.bucket_offset(bucket)
+                BUCKET_HEADER.pack_into(mapping.map, offset, 0, 0, 0, 0)
+                for way in range(self._ways):
+                    mapping.map[self._slot_offset(bucket, way)] = 0
+
+    def close(self, **kwargs):
+        # The mapping is shared by every cache instance of this process
+        pass
+
+    def drain_evictions(self):
+        """Keys evicted by this process since the last call."""
+        evicted = self.mapping.evicted
+        keys = []
+        while True:
+            try:
+                keys.append(evicted.popleft().decode())
+            except IndexError:
+                return keys
+
+    def get_stats(self):
+        """Hit, miss, set and eviction counts summed across all workers."""
+        buf = self.mapping.map
+        totals = [0, 0, 0, 0]
+        entries = 0
+        now = time.time()
+        for bucket in range(self._buckets):
+            for index, count in enumerate(BUCKET_HEADER.unpack_from(buf, self.mapping.bucket_offset(bucket))):
+                totals[index] += count
+            for way in range(self._ways):
+                used, _, expires, _, _, _ = SLOT_HEADER.unpack_from(buf, self._slot_offset(bucket, way))
+                if used and not (expires and expires <= now):
+                    entries += 1
+        return {
+            'hits': totals[0],
+            'misses': totals[1],
+            'sets': totals[2],
+            'evictions': totals[3],
+            'entries': entries,
+            'capacity': self._buckets * self._ways,
+        }
+
+
+_MISSING = object()
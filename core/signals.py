@@ -1,10 +1,13 @@
 """
 Django signals for core app.
 """
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from django.db import transaction
+from django.db.models import Q
+from .models import UserProfile, Pool, Member, Expense, ExpenseSplit, Transaction
+from .ledger import LedgerBatch, bump_pool_version, rebuild_pool_ledger
 
 
 @receiver(post_save, sender=User)
@@ -20,3 +23,230 @@ def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, 'profile'):
         instance.profile.save()
 
+
+# Balance ledger maintenance
+
+def _deleted_with_owner(origin):
+    """True when a row is removed as part of deleting its pool (the ledger goes too)."""
+    return getattr(origin, 'model', type(origin)) is Pool
+
+
+def _deleted_with_user(origin):
+    """True when a row is removed as part of deleting a user; rebuild_ledgers_after_user_delete covers it."""
+    return getattr(origin, 'model', type(origin)) is User
+
+
+@receiver(pre_delete, sender=User)
+def remember_user_pools(sender, instance, **kwargs):
+    """Pools whose ledgers the user's expenses, splits and transactions feed into."""
+    instance._ledger_pool_ids = (
+        set(Member.objects.filter(user=instance).values_list('pool_id', flat=True))
+        | set(Expense.objects.filter(Q(paid_by=instance) | Q(created_by=instance)).values_list('pool_id', flat=True))
+        | set(ExpenseSplit.objects.filter(user=instance).values_list('expense__pool_id', flat=True))
+        | set(Transaction.objects.filter(
+            Q(from_user=instance) | Q(to_user=instance), is_settled=True
+        ).values_list('pool_id', flat=True))
+    )
+
+
+@receiver(post_delete, sender=User)
+def rebuild_ledgers_after_user_delete(sender, instance, **kwargs):
+    """
+    Deleting a user cascades through expenses and splits other members share,
+    so the remaining members' balances are rebuilt rather than reversed row by row.
+    """
+    pool_ids = getattr(instance, '_ledger_pool_ids', ())
+    for pool_id in Pool.objects.filter(pk__in=pool_ids).values_list('pk', flat=True):
+        rebuild_pool_ledger(pool_id)
+
+
+def _previous_state(sender, instance, fields):
+    """Load the stored values of an instance that is about to be updated."""
+    if instance._state.adding or instance.pk is None:
+        return None
+    return sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+@receiver(pre_save, sender=Expense)
+def remember_expense_state(sender, instance, **kwargs):
+    instance._ledger_previous = _previous_state(sender, instance, ['pool_id', 'paid_by_id', 'amount'])
+
+
+@receiver(post_save, sender=Expense)
+def update_ledger_for_expense(sender, instance, **kwargs):
+    """Move the paid amount of a created or edited expense into the ledger."""
+    batch = LedgerBatch()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous:
+        batch.expense(previous['pool_id'], previous['paid_by_id'], previous['amount'], sign=-1)
+    batch.expense(instance.pool_id, instance.paid_by_id, instance.amount)
+    batch.apply()
+
+
+@receiver(pre_delete, sender=Expense)
+def reverse_ledger_for_expense(sender, instance, origin=None, **kwargs):
+    """Reverse an expense and all of its splits in one batch before they are deleted."""
+    if _deleted_with_owner(origin) or _deleted_with_user(origin):
+        return
+    batch = LedgerBatch()
+    batch.expense(instance.pool_id, instance.paid_by_id, instance.amount, sign=-1)
+    for user_id, amount in instance.splits.values_list('user_id', 'amount'):
+        batch.split(instance.pool_id, user_id, amount, sign=-1)
+    batch.apply()
+
+
+def _split_pool_id(instance):
+    if 'expense' in instance._state.fields_cache:
+        return instance.expense.pool_id
+    return Expense.objects.filter(pk=instance.expense_id).values_list('pool_id', flat=True).first()
+
+
+@receiver(pre_save, sender=ExpenseSplit)
+def remember_split_state(sender, instance, **kwargs):
+    instance._ledger_previous = _previous_state(sender, instance, ['expense__pool_id', 'user_id', 'amount'])
+
+
+@receiver(post_save, sender=ExpenseSplit)
+def update_ledger_for_split(sender, instance, **kwargs):
+    """Move the owed amount of a created or edited split into the ledger."""
+    batch = LedgerBatch()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous:
+        batch.split(previous['expense__pool_id'], previous['user_id'], previous['amount'], sign=-1)
+    batch.split(_split_pool_id(instance), instance.user_id, instance.amount)
+    batch.apply()
+
+
+@receiver(post_delete, sender=ExpenseSplit)
+def reverse_ledger_for_split(sender, instance, origin=None, **kwargs):
+    if _deleted_with_owner(origin) or _deleted_with_user(origin):
+        return
+    # Splits deleted along with their expense are reversed by the expense handler
+    if getattr(origin, 'model', type(origin)) is Expense:
+        return
+    pool_id = _split_pool_id(instance)
+    if pool_id is None:
+        return
+    batch = LedgerBatch()
+    batch.split(pool_id, instance.user_id, instance.amount, sign=-1)
+    batch.apply()
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction_state(sender, instance, **kwargs):
+    instance._ledger_previous = _previous_state(
+        sender, instance, ['pool_id', 'from_user_id', 'to_user_id', 'amount', 'is_settled']
+    )
+
+
+@receiver(post_save, sender=Transaction)
+def update_ledger_for_transaction(sender, instance, **kwargs):
+    """Only settled transactions move money between members."""
+    batch = LedgerBatch()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous and previous['is_settled']:
+        batch.settlement(
+            previous['pool_id'], previous['from_user_id'], previous['to_user_id'],
+            previous['amount'], sign=-1
+        )
+    if instance.is_settled:
+        batch.settlement(instance.pool_id, instance.from_user_id, instance.to_user_id, instance.amount)
+    batch.apply()
+
+
+@receiver(post_delete, sender=Transaction)
+def reverse_ledger_for_transaction(sender, instance, origin=None, **kwargs):
+    if _deleted_with_owner(origin) or _deleted_with_user(origin) or not instance.is_settled:
+        return
+    batch = LedgerBatch()
+    batch.settlement(
+        instance.pool_id, instance.from_user_id, instance.to_user_id, instance.amount, sign=-1
+    )
+    batch.apply()
+
+
+# Pool versions
+#
+# The ledger bumps a pool's version when balances move. These cover changes
+# that leave balances alone: expense titles, pending transactions, members,
+# the pool's own details and the members' usernames and UPI ids.
+
+@receiver(post_save, sender=Pool)
+def bump_version_on_pool_change(sender, instance, created, **kwargs):
+    if not created:
+        bump_pool_version(instance.pk)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def bump_version_on_pool_activity(sender, instance, origin=None, **kwargs):
+    # Nothing to bump when the pool itself is being deleted
+    if getattr(origin, 'model', type(origin)) is not Pool:
+        bump_pool_version(instance.pool_id)
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'username' in update_fields:
+        instance._previous_profile = _previous_state(sender, instance, ['username'])
+
+
+@receiver(pre_save, sender=UserProfile)
+def remember_upi_id(sender, instance, **kwargs):
+    instance._previous_profile = _previous_state(sender, instance, ['upi_id'])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+def bump_versions_on_profile_change(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_previous_profile', None)
+    field = 'username' if sender is User else 'upi_id'
+    if previous and previous[field] != getattr(instance, field):
+        user_id = instance.pk if sender is User else instance.user_id
+        for pool_id in Member.objects.filter(user_id=user_id).values_list('pool_id', flat=True):
+            bump_pool_version(pool_id)
+
+
+# Cache invalidation
+#
+# Balance changes invalidate through the ledger. These cover the rest of what
+# cached pool and user data is built from: pool details, membership,
+# expense fields such as the title and pending transactions.
+
+def _invalidate_after_commit(pool_id=None, user_ids=()):
+    from .cache_utils import invalidate_pool_cache, invalidate_user_cache
+
+    def invalidate():
+        if pool_id is not None:
+            invalidate_pool_cache(pool_id)
+        for user_id in user_ids:
+            invalidate_user_cache(user_id)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Pool)
+def invalidate_pool_on_change(sender, instance, created, **kwargs):
+    if not created:
+        # Members' pool lists show the pool's name and description
+        member_ids = list(Member.objects.filter(pool=instance).values_list('user_id', flat=True))
+        _invalidate_after_commit(instance.pk, member_ids)
+
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def invalidate_membership(sender, instance, **kwargs):
+    _invalidate_after_commit(instance.pool_id, [instance.user_id])
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def invalidate_pool_activity(sender, instance, **kwargs):
+    # Pending transactions do not touch the ledger but are listed by the API
+    _invalidate_after_commit(instance.pool_id)
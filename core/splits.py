@@ -0,0 +1,185 @@
+"""
+Split allocation for FinSplit.
+Divides an expense into per-member shares in integer paise, so the shares
+always add up to the expense amount, and writes them in a single INSERT.
+"""
+
+from decimal import Decimal
+import logging
+
+from django.db import transaction
+
+from .ledger import LedgerBatch
+from .models import ExpenseSplit, Member
+from .settlement import from_paise, to_paise
+
+logger = logging.getLogger(__name__)
+
+
+class SplitError(ValueError):
+    """Raised when a split cannot be allocated from the given inputs."""
+
+
+def allocate_paise(total, weights):
+    """
+    Divide ``total`` paise in proportion to ``weights`` (non-negative numbers).
+
+    Every share is first rounded down; the paise left over go one each to the
+    shares with the largest remainders, earlier positions winning ties. The
+    result always sums to ``total``.
+    """
+    weights = [Decimal(str(weight)) for weight in weights]
+    if any(weight < 0 for weight in weights):
+        raise SplitError('Shares cannot be negative.')
+    weight_total = sum(weights)
+    if weight_total <= 0:
+        raise SplitError('At least one member must have a positive share.')
+
+    shares = []
+    remainders = []
+    for index, weight in enumerate(weights):
+        share, remainder = divmod(total * weight, weight_total)
+        shares.append(int(share))
+        remainders.append((-remainder, index))
+
+    for _, index in sorted(remainders)[:total - sum(shares)]:
+        shares[index] += 1
+    return shares
+
+
+def _decimal(value):
+    try:
+        number = Decimal(str(value).strip() or '0')
+    except ArithmeticError:
+        number = None
+    if number is None or not number.is_finite():
+        raise SplitError(f'"{value}" is not a number.')
+    return number
+
+
+# Split strategies
+#
+# Each strategy takes the total in paise, the members' user ids and the
+# per-member values supplied with the expense ({user_id: value}), and returns
+# one paise amount per member, in the same order as user_ids.
+
+def _equal(total, user_ids, values):
+    return allocate_paise(total, [1] * len(user_ids))
+
+
+def _percentage(total, user_ids, values):
+    percentages = [_decimal(values.get(user_id, 0)) for user_id in user_ids]
+    if sum(percentages) != 100:
+        raise SplitError('Percentages must add up to 100.')
+    return allocate_paise(total, percentages)
+
+
+def _shares(total, user_ids, values):
+    return allocate_paise(total, [_decimal(values.get(user_id, 0)) for user_id in user_ids])
+
+
+def _exact(total, user_ids, values):
+    amounts = [_decimal(values.get(user_id, 0)) for user_id in user_ids]
+    if any(amount < 0 for amount in amounts):
+        raise SplitError('Split amounts cannot be negative.')
+    if any(amount != amount.quantize(Decimal('0.01')) for amount in amounts):
+        raise SplitError('Split amounts cannot have more than two decimal places.')
+    shares = [to_paise(amount) for amount in amounts]
+    if sum(shares) != total:
+        raise SplitError(
+            f'Split amounts add up to ₹{from_paise(sum(shares))}, not ₹{from_paise(total)}.'
+        )
+    return shares
+
+
+def _exclude(total, user_ids, values):
+    # values holds the excluded members; everyone else pays an equal share
+    weights = [0 if values.get(user_id) else 1 for user_id in user_ids]
+    if not any(weights):
+        raise SplitError('At least one member must be left in the split.')
+    return allocate_paise(total, weights)
+
+
+SPLIT_STRATEGIES = {
+    'equal': _equal,
+    'percentage': _percentage,
+    'shares': _shares,
+    'manual': _exact,
+    'exclude': _exclude,
+}
+
+
+def allocate_split(method, amount, user_ids, values=None):
+    """
+    Divide ``amount`` rupees among ``user_ids`` with the named strategy.
+
+    ``values`` maps user ids to the strategy's input: a percentage, a number
+    of shares, an exact amount, or (for 'exclude') a true value for members
+    left out. Values for users outside ``user_ids`` are rejected. Returns an
+    [(user_id, paise)] allocation ready for save_expense_splits().
+    """
+    strategy = SPLIT_STRATEGIES.get(method)
+    if strategy is None:
+        raise SplitError(f'Unknown split method "{method}".')
+
+    user_ids = list(user_ids)
+    values = values or {}
+    unknown = set(values) - set(user_ids)
+    if unknown:
+        raise SplitError(f'Users {sorted(unknown)} are not members of this pool.')
+
+    return list(zip(user_ids, strategy(to_paise(amount), user_ids, values)))
+
+
+def equal_allocation(amount, user_ids):
+    """[(user_id, paise)] splitting ``amount`` rupees equally among ``user_ids``."""
+    return allocate_split('equal', amount, user_ids)
+
+
+def pool_member_ids(pool_id):
+    """Active members of a pool, in the order allocations are made."""
+    return list(
+        Member.objects.filter(pool_id=pool_id, is_active=True)
+        .order_by('user_id').values_list('user_id', flat=True)
+    )
+
+
+def save_expense_splits(expense, allocation, replace=False):
+    """
+    Write an [(user_id, paise)] allocation as the expense's splits.
+
+    All rows go in with one bulk_create and the ledger is updated with one
+    batch, inside the caller's transaction when there is one. With
+    ``replace`` the expense's existing splits are deleted first.
+    """
+    total = to_paise(expense.amount)
+    user_ids = [user_id for user_id, _ in allocation]
+    if len(set(user_ids)) != len(user_ids):
+        raise SplitError('Each member can only appear once in a split.')
+    if any(paise < 0 for _, paise in allocation):
+        raise SplitError('Split amounts cannot be negative.')
+    if sum(paise for _, paise in allocation) != total:
+        raise SplitError('Split amounts do not add up to the expense amount.')
+
+    splits = [
+        ExpenseSplit(
+            expense=expense,
+            user_id=user_id,
+            amount=from_paise(paise),
+            percentage=(Decimal(paise * 100) / total).quantize(Decimal('0.01')) if total else None,
+        )
+        for user_id, paise in allocation
+        if paise
+    ]
+
+    with transaction.atomic():
+        if replace:
+            expense.splits.all().delete()
+        # bulk_create skips the split signals, so the ledger is updated here
+        ExpenseSplit.objects.bulk_create(splits)
+        batch = LedgerBatch()
+        for split in splits:
+            batch.split(expense.pool_id, split.user_id, split.amount)
+        batch.apply()
+
+    return splits
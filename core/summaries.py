@@ -0,0 +1,126 @@
+"""
+Weekly summary emails for FinSplit.
+weekly_summary_contexts() builds the summaries of many users at once from a
+few grouped queries per chunk of users. Contexts hold plain values only, so
+they can be rendered in worker processes (see send_weekly_summaries).
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+import logging
+
+from django.conf import settings
+from django.db.models import Count, F, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .email_render import render_email
+from .models import Expense, ExpenseSplit, Member, MemberBalance, Pool
+
+logger = logging.getLogger(__name__)
+
+WEEKLY_RECENT_EXPENSES = 5
+
+
+def _site_url(path):
+    return f"{settings.SITE_URL}{path}" if hasattr(settings, 'SITE_URL') else f'http://localhost:8000{path}'
+
+
+def _pool_stats(pool_ids, since):
+    """Name, this week's expense count and total, and latest expenses of each pool."""
+    stats = {
+        pool['id']: {
+            'id': pool['id'],
+            'name': pool['name'],
+            'url': _site_url(f"/pools/{pool['id']}/"),
+            'expense_count': 0,
+            'week_total': Decimal('0.00'),
+            'recent': [],
+        }
+        for pool in Pool.objects.filter(id__in=pool_ids).order_by().values('id', 'name')
+    }
+    week = Expense.objects.filter(pool_id__in=pool_ids, created_at__gte=since)
+    for row in week.values('pool_id').annotate(count=Count('id'), total=Sum('amount')).order_by():
+        stats[row['pool_id']].update(expense_count=row['count'], week_total=row['total'])
+
+    recent = (
+        week.annotate(position=Window(RowNumber(), partition_by=F('pool_id'), order_by=F('created_at').desc()))
+        .filter(position__lte=WEEKLY_RECENT_EXPENSES)
+        .values('pool_id', 'title', 'amount', 'paid_by__username', 'created_at')
+        .order_by('pool_id', '-created_at')
+    )
+    for row in recent:
+        stats[row['pool_id']]['recent'].append({
+            'title': row['title'],
+            'amount': row['amount'],
+            'paid_by': row['paid_by__username'],
+            'created_at': row['created_at'],
+        })
+    return stats
+
+
+def weekly_summary_contexts(users, since, pool_stats=None):
+    """
+    {user_id: context for emails/weekly_summary.html} for ``users`` (dicts
+    with id, username, first_name and email) who belong to an active pool.
+    ``pool_stats`` is a dict reused across calls so each pool is only
+    summarised once per run.
+    """
+    pool_stats = {} if pool_stats is None else pool_stats
+    user_ids = [user['id'] for user in users]
+
+    memberships = defaultdict(list)
+    for user_id, pool_id in Member.objects.filter(
+        user_id__in=user_ids, is_active=True, pool__is_active=True
+    ).values_list('user_id', 'pool_id'):
+        memberships[user_id].append(pool_id)
+    if not memberships:
+        return {}
+
+    missing = {pool_id for pool_ids in memberships.values() for pool_id in pool_ids} - set(pool_stats)
+    if missing:
+        pool_stats.update(_pool_stats(missing, since))
+
+    nets = {
+        (user_id, pool_id): net
+        for user_id, pool_id, net in MemberBalance.objects.filter(user_id__in=user_ids)
+        .values_list('user_id', 'pool_id', 'net')
+    }
+    week_shares = dict(
+        ExpenseSplit.objects.filter(user_id__in=user_ids, expense__created_at__gte=since)
+        .values('user_id').annotate(total=Sum('amount')).order_by()
+        .values_list('user_id', 'total')
+    )
+
+    now = timezone.now()
+    contexts = {}
+    for user in users:
+        pool_ids = memberships.get(user['id'])
+        if not pool_ids:
+            continue
+        pools = []
+        for pool_id in pool_ids:
+            if pool_id not in pool_stats:
+                continue
+            net = nets.get((user['id'], pool_id), Decimal('0.00'))
+            pools.append({**pool_stats[pool_id], 'net': net, 'owed': abs(net)})
+        pools.sort(key=lambda pool: (-pool['expense_count'], pool['name']))
+        contexts[user['id']] = {
+            'user': {'username': user['username'], 'first_name': user['first_name']},
+            'email': user['email'],
+            'since': since,
+            'until': now,
+            'pools': pools,
+            'expense_count': sum(pool['expense_count'] for pool in pools),
+            'week_share': week_shares.get(user['id'], Decimal('0.00')),
+            'owed_to_you': sum((pool['net'] for pool in pools if pool['net'] > 0), Decimal('0.00')),
+            'you_owe': sum((-pool['net'] for pool in pools if pool['net'] < 0), Decimal('0.00')),
+            'site_name': 'FinSplit',
+            'dashboard_url': _site_url('/dashboard/'),
+        }
+    return contexts
+
+
+def render_weekly_summary(context):
+    """(html, text) of one weekly summary; runs in send_weekly_summaries' workers."""
+    return render_email('emails/weekly_summary.html', context)
@@ -1,3 +1,1266 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.db import transaction as db_transaction
+from django.db import connection
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.template.loader import get_template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .balances import aggregate_pool_balances, get_pool_balances
+from .models import (
+    Pool, Member, Expense, ExpenseSplit, Transaction, MemberBalance, NotificationEvent, Outbox, UserProfile,
+)
+from .cache_utils import (
+    bump_generation, cache_result, clear_caches, generate_cache_key, get_cached_pool_balances,
+    get_cached_pool_members, get_cached_user_pools, get_generations, shared_cache_stats
+)
+from . import api_views, cache_codec, cache_utils, outbox
+from .cache_stats import get_prefix_stats, reset_prefix_stats
+from .email_dispatcher import EmailDispatcher, dispatcher
+from .digests import send_due_digests
+from .email_render import body_cache, personalize, placeholder, render_email
+from .email_utils import (
+    send_email_async, send_expense_notification_email, send_pool_invite_email, send_settlement_reminder_email,
+    send_weekly_summary_email, validate_email_templates,
+)
+from .forms import UserProfileForm
+from .importer import import_expenses
+from .local_cache import LocalCache
+from .netting import get_user_settlements
+from .outbox import claim_batch, deliver_batch
+from .shm_cache import SharedMemoryCache
+from .summaries import weekly_summary_contexts
+from .warmer import CacheWarmer, mark_active, warmer
+from .splits import SplitError, allocate_paise, allocate_split, equal_allocation, save_expense_splits
+from .settlement import (
+    from_paise, greedy_settlements, plan_settlements, settle_balances, get_pool_settlement_plan,
+    optimal_settlements, UnbalancedBalances
+)
+
+
+_cache_dir = None
+_cache_settings = None
+
+
+def setUpModule():
+    global _cache_dir, _cache_settings
+    # Shared-memory cache files outlive the run, so tests get their own
+    _cache_dir = tempfile.TemporaryDirectory()
+    _cache_settings = override_settings(CACHES={
+        alias: {**config, 'LOCATION': os.path.join(_cache_dir.name, alias)}
+        for alias, config in settings.CACHES.items()
+    })
+    _cache_settings.enable()
+    clear_caches()
+    # Warming threads would read outside the test transaction
+    warmer.enabled = False
+
+
+def tearDownModule():
+    _cache_settings.disable()
+    _cache_dir.cleanup()
+
+
+class PoolTestMixin:
+    """Helpers for building small pools in tests."""
+
+    def make_pool(self, *usernames):
+        users = [User.objects.create(username=name, email=f'{name}@example.com') for name in usernames]
+        pool = Pool.objects.create(name='Trip', created_by=users[0])
+        for user in users:
+            Member.objects.create(pool=pool, user=user, is_admin=user == users[0])
+        return pool, users
+
+    def add_expense(self, pool, paid_by, amount, split_between):
+        amount = Decimal(amount)
+        expense = Expense.objects.create(
+            pool=pool, title='Dinner', amount=amount, paid_by=paid_by, created_by=paid_by
+        )
+        share = (amount / len(split_between)).quantize(Decimal('0.01'))
+        for user in split_between:
+            ExpenseSplit.objects.create(expense=expense, user=user, amount=share)
+        return expense
+
+    def net(self, pool, user):
+        return pool.get_balances()[user.id]['balance']
+
+
+class LedgerTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        self.pool, (self.alice, self.bob, self.carol) = self.make_pool('alice', 'bob', 'carol')
+
+    def test_expense_and_splits_update_ledger(self):
+        self.add_expense(self.pool, self.alice, '90.00', [self.alice, self.bob, self.carol])
+
+        self.assertEqual(self.net(self.pool, self.alice), Decimal('60.00'))
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('-30.00'))
+        self.assertEqual(self.pool.get_balances()[self.alice.id]['paid'], Decimal('90.00'))
+
+    def test_edit_and_delete_are_reversed(self):
+        expense = self.add_expense(self.pool, self.alice, '90.00', [self.alice, self.bob, self.carol])
+        expense.paid_by = self.bob
+        expense.save()
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('60.00'))
+
+        expense.delete()
+        for user in (self.alice, self.bob, self.carol):
+            self.assertEqual(self.net(self.pool, user), Decimal('0.00'))
+
+    def test_only_settled_transactions_count(self):
+        self.add_expense(self.pool, self.alice, '90.00', [self.alice, self.bob, self.carol])
+        transaction = Transaction.objects.create(
+            pool=self.pool, from_user=self.bob, to_user=self.alice, amount=Decimal('30.00')
+        )
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('-30.00'))
+
+        transaction.mark_settled(self.alice)
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('0.00'))
+        self.assertEqual(self.net(self.pool, self.alice), Decimal('30.00'))
+
+    def test_deleting_a_user_rebuilds_the_other_members_balances(self):
+        self.add_expense(self.pool, self.alice, '90.00', [self.alice, self.bob, self.carol])
+        self.add_expense(self.pool, self.bob, '60.00', [self.bob, self.carol])
+        Transaction.objects.create(
+            pool=self.pool, from_user=self.carol, to_user=self.bob, amount=Decimal('10.00')
+        ).mark_settled(self.bob)
+
+        self.bob.delete()
+
+        # Only alice's 90.00 remains, split with the deleted bob's share gone
+        self.assertEqual(self.net(self.pool, self.alice), Decimal('60.00'))
+        self.assertEqual(self.net(self.pool, self.carol), Decimal('-30.00'))
+        ledger = {row.user_id: row.net for row in MemberBalance.objects.filter(pool=self.pool)}
+        self.assertEqual(ledger, {
+            user_id: totals['net'] for user_id, totals in aggregate_pool_balances(self.pool.id).items()
+        })
+
+    def test_rebuild_matches_incremental_ledger(self):
+        self.add_expense(self.pool, self.alice, '90.00', [self.alice, self.bob, self.carol])
+        self.add_expense(self.pool, self.carol, '40.00', [self.bob, self.carol])
+        before = self.pool.get_balances()
+
+        MemberBalance.objects.filter(pool=self.pool).update(net=Decimal('999.00'))
+        call_command('rebuild_ledger', pool_ids=[self.pool.id], stdout=StringIO())
+
+        self.assertEqual(self.pool.get_balances(), before)
+
+
+class BalanceEngineTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        self.pool, self.users = self.make_pool('alice', 'bob', 'carol', 'dave')
+
+    def add_expenses(self, count):
+        for i in range(count):
+            self.add_expense(self.pool, self.users[i % 4], '12.00', self.users)
+
+    def test_aggregation_matches_ledger(self):
+        self.add_expenses(6)
+        Transaction.objects.create(
+            pool=self.pool, from_user=self.users[1], to_user=self.users[0],
+            amount=Decimal('5.00'), is_settled=True
+        )
+
+        aggregated = aggregate_pool_balances(self.pool.id)
+        ledger = get_pool_balances(self.pool.id)
+        for user in self.users:
+            for field in ('paid', 'owed', 'sent', 'received', 'net'):
+                self.assertEqual(aggregated[user.id][field], ledger[user.id][field])
+
+    def test_query_count_does_not_grow_with_expenses(self):
+        for count in (1, 25):
+            self.add_expenses(count)
+            clear_caches()
+            with self.assertNumQueries(4):
+                aggregate_pool_balances(self.pool.id)
+            with self.assertNumQueries(2):
+                self.pool.get_balances()
+            with self.assertNumQueries(3):
+                get_cached_pool_balances(self.pool.id)
+
+
+class SettlementTests(SimpleTestCase):
+
+    def assert_settles(self, vector, transfers):
+        remaining = dict(vector)
+        for transfer in transfers:
+            self.assertGreater(transfer.amount, 0)
+            remaining[transfer.from_user_id] += transfer.amount
+            remaining[transfer.to_user_id] -= transfer.amount
+        self.assertFalse(any(remaining.values()))
+
+    def test_each_credit_is_paid_once(self):
+        vector = {1: 6000, 2: -3000, 3: -3000}
+        transfers = greedy_settlements(vector)
+
+        self.assert_settles(vector, transfers)
+        self.assertEqual(len(transfers), 2)
+
+    def test_large_pool_uses_at_most_n_minus_one_transfers(self):
+        rng = random.Random(7)
+        vector = {user_id: rng.randint(-500000, 500000) for user_id in range(1, 5000)}
+        vector[5000] = -sum(vector.values())
+
+        transfers = greedy_settlements(vector)
+
+        self.assert_settles(vector, transfers)
+        self.assertLess(len(transfers), len(vector))
+
+    def test_rupee_amounts_round_trip_through_paise(self):
+        balances = {1: {'balance': Decimal('33.34')}, 2: {'balance': Decimal('-33.34')}}
+        self.assertEqual(
+            settle_balances(balances),
+            [{'from_user_id': 2, 'to_user_id': 1, 'amount': Decimal('33.34')}]
+        )
+
+    def test_optimal_mode_finds_fewer_transfers_than_greedy(self):
+        # {1, 2 | 3, 4, 5} splits into two zero-sum groups; greedy crosses them
+        balances = {
+            1: {'balance': Decimal('50')}, 2: {'balance': Decimal('-50')},
+            3: {'balance': Decimal('70')}, 4: {'balance': Decimal('-40')},
+            5: {'balance': Decimal('-30')}, 6: {'balance': Decimal('45')},
+            7: {'balance': Decimal('-25')}, 8: {'balance': Decimal('-20')},
+        }
+        greedy = plan_settlements(balances)
+        optimal = plan_settlements(balances, mode='optimal')
+
+        self.assertEqual(optimal.algorithm, 'optimal')
+        self.assertEqual(len(optimal.settlements), 5)
+        self.assertLessEqual(len(optimal.settlements), len(greedy.settlements))
+
+    def test_optimal_mode_falls_back_when_budget_runs_out(self):
+        rng = random.Random(3)
+        balances = {user_id: {'balance': Decimal(rng.randint(-9000, 9000))} for user_id in range(40)}
+        balances[40] = {'balance': -sum(b['balance'] for b in balances.values())}
+
+        plan = plan_settlements(balances, mode='optimal', time_budget=0.01)
+
+        self.assertEqual(plan.algorithm, 'greedy-fallback')
+        self.assertLess(len(plan.settlements), len(balances))
+
+    def test_budget_is_enforced_inside_a_single_search_step(self):
+        rng = random.Random(11)
+        balances = {user_id: {'balance': Decimal(rng.randint(-9000, 9000))} for user_id in range(24)}
+        balances[24] = {'balance': -sum(b['balance'] for b in balances.values())}
+
+        started = time.process_time()
+        plan = plan_settlements(balances, mode='optimal', time_budget=0.05)
+
+        self.assertEqual(plan.algorithm, 'greedy-fallback')
+        self.assertLess(time.process_time() - started, 1)
+
+    def test_unbalanced_input_is_reported_separately(self):
+        with self.assertRaises(UnbalancedBalances):
+            optimal_settlements({1: 500, 2: -300})
+
+        plan = plan_settlements({1: {'balance': Decimal('5')}, 2: {'balance': Decimal('-3')}}, mode='optimal')
+        self.assertEqual(plan.algorithm, 'unbalanced')
+
+
+class SettlementPlanTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        self.pool, self.users = self.make_pool('alice', 'bob', 'carol')
+        self.add_expense(self.pool, self.users[0], '90.00', self.users)
+        self.client.force_login(self.users[0])
+
+    def test_viewing_the_settle_page_writes_nothing(self):
+        url = reverse('core:pool_settle', args=[self.pool.id])
+        self.client.get(url)
+        self.client.get(url)
+
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_commit_is_idempotent_and_supersedes_old_suggestions(self):
+        stale = Transaction.objects.create(
+            pool=self.pool, from_user=self.users[1], to_user=self.users[0], amount=Decimal('1.00'),
+            plan_version='0' * 40,
+        )
+        plan = get_pool_settlement_plan(self.pool)
+        url = reverse('core:pool_settle_commit', args=[self.pool.id])
+
+        self.client.post(url, {'version': plan.version})
+        self.client.post(url, {'version': plan.version})
+
+        pending = Transaction.objects.filter(status='pending')
+        self.assertEqual(pending.count(), 2)
+        self.assertEqual(set(pending.values_list('plan_version', flat=True)), {plan.version})
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'cancelled')
+
+    def test_removed_members_with_a_balance_stay_in_the_plan(self):
+        Member.objects.filter(pool=self.pool, user=self.users[2]).update(is_active=False)
+
+        balances = self.pool.get_balances()
+        self.assertEqual(balances[self.users[2].id]['balance'], Decimal('-30.00'))
+        self.assertEqual(sum(info['balance'] for info in balances.values()), 0)
+        self.assertEqual(plan_settlements(balances, mode='optimal').algorithm, 'optimal')
+
+    def test_commit_keeps_manual_pending_transactions(self):
+        manual = Transaction.objects.create(
+            pool=self.pool, from_user=self.users[2], to_user=self.users[0], amount=Decimal('10.00')
+        )
+        plan = get_pool_settlement_plan(self.pool)
+        self.client.post(reverse('core:pool_settle_commit', args=[self.pool.id]), {'version': plan.version})
+
+        manual.refresh_from_db()
+        self.assertEqual(manual.status, 'pending')
+
+    def test_compact_pending_transactions_removes_duplicates(self):
+        for _ in range(3):
+            Transaction.objects.create(
+                pool=self.pool, from_user=self.users[1], to_user=self.users[0], amount=Decimal('30.00')
+            )
+
+        call_command('compact_pending_transactions', stdout=StringIO())
+
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+class CrossPoolNettingTests(PoolTestMixin, TestCase):
+
+    def test_debts_in_opposite_directions_net_to_one_transfer(self):
+        trip, (alice, bob) = self.make_pool('alice', 'bob')
+        flat = Pool.objects.create(name='Flat', created_by=bob)
+        for user in (alice, bob):
+            Member.objects.create(pool=flat, user=user)
+
+        self.add_expense(trip, alice, '100.00', [alice, bob])   # bob owes alice 50
+        self.add_expense(flat, bob, '60.00', [alice, bob])      # alice owes bob 30
+
+        result = get_user_settlements(alice.id)
+
+        self.assertEqual(result['transfers_before_netting'], 2)
+        self.assertEqual(len(result['transfers']), 1)
+        transfer = result['transfers'][0]
+        self.assertEqual((transfer['from_user_id'], transfer['to_user_id']), (bob.id, alice.id))
+        self.assertEqual(transfer['amount'], Decimal('20.00'))
+        self.assertEqual(
+            {part['pool_name']: part['amount'] for part in transfer['breakdown']},
+            {'Trip': Decimal('50.00'), 'Flat': Decimal('-30.00')}
+        )
+        self.assertEqual(result['net'], Decimal('20.00'))
+
+    def test_both_sides_of_a_transfer_see_the_same_amount(self):
+        trip, (alice, bob, carol) = self.make_pool('alice', 'bob', 'carol')
+        flat = Pool.objects.create(name='Flat', created_by=bob)
+        for user in (bob, carol):
+            Member.objects.create(pool=flat, user=user)
+        self.add_expense(trip, alice, '90.00', [alice, bob, carol])
+        self.add_expense(trip, carol, '30.00', [bob, carol])
+        self.add_expense(flat, bob, '80.00', [bob, carol])
+
+        views = {user.id: get_user_settlements(user.id) for user in (alice, bob, carol)}
+        for user_id, result in views.items():
+            for transfer in result['transfers']:
+                other_id = transfer['to_user_id'] if transfer['from_user_id'] == user_id else transfer['from_user_id']
+                matching = [
+                    other for other in views[other_id]['transfers']
+                    if (other['from_user_id'], other['to_user_id']) == (transfer['from_user_id'], transfer['to_user_id'])
+                ]
+                self.assertEqual(len(matching), 1)
+                self.assertEqual(matching[0]['amount'], transfer['amount'])
+                self.assertEqual(matching[0]['breakdown'], transfer['breakdown'])
+
+
+class SplitAllocationTests(PoolTestMixin, TestCase):
+
+    def test_largest_remainder_allocation_sums_exactly(self):
+        self.assertEqual(allocate_paise(10000, [1, 1, 1]), [3334, 3333, 3333])
+        self.assertEqual(allocate_paise(100, [1, 2, 3]), [17, 33, 50])
+        for _ in range(50):
+            weights = [random.randint(0, 9) for _ in range(random.randint(1, 12))] + [1]
+            total = random.randint(0, 10 ** 6)
+            self.assertEqual(sum(allocate_paise(total, weights)), total)
+        with self.assertRaises(SplitError):
+            allocate_paise(100, [0, 0])
+
+    def test_splits_are_written_in_bulk_and_reach_the_ledger(self):
+        pool, users = self.make_pool('alice', 'bob', 'carol')
+        expense = Expense.objects.create(
+            pool=pool, title='Taxi', amount=Decimal('100.00'), paid_by=users[0], created_by=users[0]
+        )
+        # One INSERT for the splits and three ledger queries, plus savepoints
+        with self.assertNumQueries(8):
+            save_expense_splits(expense, equal_allocation(expense.amount, [u.id for u in users]))
+
+        self.assertEqual(
+            sorted(expense.splits.values_list('amount', flat=True)),
+            [Decimal('33.33'), Decimal('33.33'), Decimal('33.34')]
+        )
+        self.assertEqual(self.net(pool, users[0]), Decimal('66.66'))
+        self.assertEqual(sum(b['balance'] for b in pool.get_balances().values()), 0)
+
+    def test_api_replaces_splits_and_rejects_bad_totals(self):
+        pool, (alice, bob) = self.make_pool('alice', 'bob')
+        expense = self.add_expense(pool, alice, '50.00', [alice, bob])
+        self.client.force_login(alice)
+        url = f'/api/expenses/{expense.id}/split/'
+
+        response = self.client.post(url, {'splits': [
+            {'user_id': alice.id, 'amount': '10.00'}, {'user_id': bob.id, 'amount': '30.00'},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, {'splits': [
+            {'user_id': alice.id, 'amount': '10.00'}, {'user_id': bob.id, 'amount': '40.00'},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.net(pool, bob), Decimal('-40.00'))
+
+
+class SplitStrategyTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        self.pool, self.users = self.make_pool('alice', 'bob', 'carol')
+        self.alice, self.bob, self.carol = self.users
+        self.ids = [user.id for user in self.users]
+
+    def amounts(self, method, values=None, amount='100.00'):
+        return [from_paise(paise) for _, paise in allocate_split(method, amount, self.ids, values)]
+
+    def test_strategies(self):
+        self.assertEqual(
+            self.amounts('percentage', {self.alice.id: '50', self.bob.id: '25', self.carol.id: '25'}),
+            [Decimal('50.00'), Decimal('25.00'), Decimal('25.00')]
+        )
+        self.assertEqual(
+            self.amounts('shares', {self.alice.id: 2, self.bob.id: 1}),
+            [Decimal('66.67'), Decimal('33.33'), Decimal('0.00')]
+        )
+        self.assertEqual(
+            self.amounts('manual', {self.alice.id: '70.50', self.bob.id: '29.50'}),
+            [Decimal('70.50'), Decimal('29.50'), Decimal('0.00')]
+        )
+        self.assertEqual(
+            self.amounts('exclude', {self.carol.id: True}),
+            [Decimal('50.00'), Decimal('50.00'), Decimal('0.00')]
+        )
+
+    def test_invalid_inputs_are_rejected(self):
+        outsider = User.objects.create(username='mallory')
+        invalid = [
+            ('percentage', {self.alice.id: '60', self.bob.id: '30'}),
+            ('manual', {self.alice.id: '90.00'}),
+            ('manual', {self.alice.id: '100.005'}),
+            ('shares', {self.alice.id: '-1', self.bob.id: '2'}),
+            ('shares', {self.alice.id: 'lots'}),
+            ('exclude', {user_id: True for user_id in self.ids}),
+            ('equal', {outsider.id: 1}),
+            ('thirds', {}),
+        ]
+        for method, values in invalid:
+            with self.subTest(method=method, values=values), self.assertRaises(SplitError):
+                allocate_split(method, '100.00', self.ids, values)
+
+    def test_form_resolves_the_split_once(self):
+        self.client.force_login(self.alice)
+        response = self.client.post(reverse('core:expense_add', args=[self.pool.id]), {
+            'title': 'Groceries', 'amount': '90.00', 'paid_by': self.alice.id,
+            'expense_date': '2026-01-01T10:00', 'split_method': 'shares',
+            f'split_value_{self.alice.id}': '1', f'split_value_{self.bob.id}': '2',
+        })
+        self.assertEqual(response.status_code, 302)
+        expense = Expense.objects.get(title='Groceries')
+        self.assertEqual(
+            dict(expense.splits.values_list('user_id', 'amount')),
+            {self.alice.id: Decimal('30.00'), self.bob.id: Decimal('60.00')}
+        )
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('-60.00'))
+
+    def test_serializer_creates_splits(self):
+        self.client.force_login(self.alice)
+        response = self.client.post('/api/expenses/', {
+            'pool': self.pool.id, 'title': 'Cab', 'amount': '60.00', 'paid_by_id': self.bob.id,
+            'split_method': 'exclude', 'excluded_user_ids': [self.bob.id],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('60.00'))
+        self.assertEqual(self.net(self.pool, self.carol), Decimal('-30.00'))
+
+        response = self.client.post('/api/expenses/', {
+            'pool': self.pool.id, 'title': 'Cab', 'amount': '60.00', 'paid_by_id': self.bob.id,
+            'split_method': 'percentage', 'split_values': {str(self.bob.id): '50'},
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExpenseImportTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        self.pool, (self.alice, self.bob, self.carol) = self.make_pool('alice', 'bob', 'carol')
+
+    def test_csv_import_reports_bad_rows_and_keeps_the_rest(self):
+        data = (
+            'title,amount,paid_by,date,split_method,participants\n'
+            'Dinner,90.00,alice,2025-03-01,,\n'
+            'Taxi,30.00,bob,2025-03-02,equal,alice;bob\n'
+            'Hotel,100.00,carol,2025-03-03,shares,alice=1;carol=3\n'
+            'Mystery,10.00,mallory,,,\n'
+            'Broken,-5,alice,,,\n'
+            'Odd,10.00,alice,,percentage,alice=20\n'
+        )
+        # Pool members, then name lookup + 9 writes for the first batch, name lookup for the second
+        with self.assertNumQueries(12):
+            result = import_expenses(self.pool, StringIO(data), 'csv', batch_size=4)
+
+        self.assertEqual(result['created'], 3)
+        self.assertEqual([error['line'] for error in result['errors']], [5, 6, 7])
+        self.assertEqual(self.pool.expenses.count(), 3)
+        self.assertEqual(self.net(self.pool, self.alice), Decimal('20.00'))   # 90 - (30 + 15 + 25)
+        self.assertEqual(self.net(self.pool, self.carol), Decimal('-5.00'))   # 100 - (30 + 75)
+        self.assertEqual(aggregate_pool_balances(self.pool.id)[self.bob.id]['net'], self.net(self.pool, self.bob))
+
+    def test_rows_naming_nobody_are_shared_by_every_member(self):
+        # The batch only names alice and bob; carol still shares the expenses
+        data = (
+            'title,amount,paid_by,split_method,participants\n'
+            'Dinner,90.00,alice,,\n'
+            'Taxi,60.00,alice,exclude,bob\n'
+        )
+        import_expenses(self.pool, StringIO(data), 'csv')
+
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('-30.00'))
+        self.assertEqual(self.net(self.pool, self.carol), Decimal('-60.00'))
+        self.assertEqual(self.net(self.pool, self.alice), Decimal('90.00'))
+
+    def test_out_of_range_dates_are_row_errors(self):
+        data = (
+            'title,amount,paid_by,date\n'
+            'Leap,30.00,alice,2024-02-30\n'
+            'Late,30.00,alice,2024-03-01T25:00:00\n'
+            'Fine,30.00,alice,2024-02-29\n'
+        )
+        result = import_expenses(self.pool, StringIO(data), 'csv')
+
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['line'] for error in result['errors']], [2, 3])
+        self.assertIn('Invalid date', result['errors'][0]['error'])
+
+    def test_ndjson_import_through_the_api(self):
+        self.client.force_login(self.alice)
+        lines = [
+            {'title': 'Lunch', 'amount': '60', 'paid_by': 'alice', 'participants': {'bob': '40', 'carol': '20'},
+             'split_method': 'manual'},
+            'not json',
+        ]
+        body = '\n'.join(json.dumps(line) if isinstance(line, dict) else line for line in lines)
+        response = self.client.post(
+            f'/api/pools/{self.pool.id}/import/', body, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(response.json()['errors'][0]['line'], 2)
+        self.assertEqual(self.net(self.pool, self.bob), Decimal('-40.00'))
+
+
+class PoolExportTests(PoolTestMixin, TestCase):
+
+    def test_streams_csv_and_ndjson_with_date_filters(self):
+        pool, (alice, bob) = self.make_pool('alice', 'bob')
+        old = self.add_expense(pool, alice, '40.00', [alice, bob])
+        Expense.objects.filter(pk=old.pk).update(expense_date='2024-01-15T12:00:00Z')
+        self.add_expense(pool, bob, '10.00', [alice, bob])
+        self.client.force_login(alice)
+        url = reverse('core:pool_export', args=[pool.id])
+
+        response = self.client.get(url, {'type': 'splits'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'expense_id,date,title,user,amount,percentage')
+        self.assertEqual(len(lines), 5)
+
+        response = self.client.get(url, {'format': 'ndjson', 'start': '2024-01-01', 'end': '2024-01-31'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['id'], row['amount'], row['paid_by']) for row in rows], [(old.id, '40.00', 'alice')])
+
+        self.assertEqual(self.client.get(url, {'type': 'members'}).status_code, 400)
+
+
+class CacheGenerationTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def test_expense_in_one_pool_keeps_other_pools_cached(self):
+        pool_a, (alice, bob) = self.make_pool('alice', 'bob')
+        pool_b = Pool.objects.create(name='Flat', created_by=alice)
+        for user in (alice, bob):
+            Member.objects.create(pool=pool_b, user=user)
+        self.add_expense(pool_b, alice, '30.00', [alice, bob])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            balances_a = get_cached_pool_balances(pool_a.id)
+            balances_b = get_cached_pool_balances(pool_b.id)
+            self.add_expense(pool_a, bob, '50.00', [alice, bob])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cached_pool_balances(pool_b.id), balances_b)
+        self.assertNotEqual(get_cached_pool_balances(pool_a.id), balances_a)
+        self.assertEqual(get_cached_pool_balances(pool_a.id)[bob.id]['balance'], 25.0)
+
+    def test_errors_are_cached_as_misses_not_empty_results(self):
+        pool, (alice,) = self.make_pool('alice')
+        with mock.patch('core.balances.get_pool_balances', side_effect=RuntimeError('database went away')):
+            self.assertIsNone(get_cached_pool_balances(pool.id))
+        with mock.patch('core.models.Pool.objects') as pools:
+            pools.filter.side_effect = RuntimeError('database went away')
+            self.assertIsNone(get_cached_user_pools(alice.id))
+
+    def test_evicted_counter_does_not_revive_old_entries(self):
+        pool, (alice,) = self.make_pool('alice')
+        get_cached_pool_members(pool.id)
+        old_generation = get_generations([('pool', pool.id)])[0]
+
+        cache.delete(f'finsplit:gen:pool:{pool.id}')
+        bump_generation('pool', pool.id)
+
+        self.assertGreater(get_generations([('pool', pool.id)])[0], old_generation)
+
+
+class APICacheMiddlewareTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.pool, (self.alice, self.bob) = self.make_pool('alice', 'bob')
+        Pool.objects.create(name='Solo', created_by=self.bob)
+        Member.objects.create(pool=Pool.objects.get(name='Solo'), user=self.bob)
+
+    def test_responses_are_cached_per_user(self):
+        self.client.force_login(self.alice)
+        alice_pools = self.client.get('/api/pools/').json()
+        self.client.force_login(self.bob)
+        self.assertNotEqual(self.client.get('/api/pools/').json(), alice_pools)
+
+    def test_matching_etag_is_answered_without_running_the_view(self):
+        self.client.force_login(self.alice)
+        etag = self.client.get('/api/pools/')['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with mock.patch.object(api_views.PoolViewSet, 'list') as view:
+            response = self.client.get('/api/pools/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        view.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(self.pool, self.alice, '30.00', [self.alice, self.bob])
+        response = self.client.get('/api/pools/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class PoolVersionTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.pool, (self.alice, self.bob) = self.make_pool('alice', 'bob')
+        self.client.force_login(self.alice)
+
+    def version(self):
+        return Pool.objects.values_list('version', flat=True).get(pk=self.pool.pk)
+
+    def test_changes_bump_the_version(self):
+        version = self.version()
+        expense = self.add_expense(self.pool, self.alice, '30.00', [self.alice, self.bob])
+        self.assertGreater(self.version(), version)
+        version = self.version()
+        Transaction.objects.create(pool=self.pool, from_user=self.bob, to_user=self.alice, amount=Decimal('15.00'))
+        self.assertGreater(self.version(), version)
+        version = self.version()
+        expense.delete()
+        self.assertGreater(self.version(), version)
+
+    def test_saving_a_stale_pool_never_moves_the_version_back(self):
+        stale = Pool.objects.get(pk=self.pool.pk)
+        self.add_expense(self.pool, self.alice, '30.00', [self.alice, self.bob])
+        version = self.version()
+
+        stale.name = 'Renamed'
+        stale.save()
+
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(Pool.objects.get(pk=self.pool.pk).name, 'Renamed')
+
+    def test_unchanged_pool_is_not_recomputed(self):
+        url = f'/api/pools/{self.pool.id}/balances/'
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        clear_caches()
+
+        with mock.patch.object(Pool, 'get_balances') as get_balances:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            clear_caches()
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        get_balances.assert_not_called()
+
+        self.add_expense(self.pool, self.alice, '30.00', [self.alice, self.bob])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pool_page_answers_conditional_requests(self):
+        url = reverse('core:pool_detail', args=[self.pool.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CacheWarmerTests(PoolTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.pool, (self.alice, self.bob) = self.make_pool('alice', 'bob')
+
+    def test_invalidated_active_pools_are_rewarmed(self):
+        background = CacheWarmer(workers=2)
+        with mock.patch('core.warmer.warmer', background):
+            with db_transaction.atomic():
+                self.add_expense(self.pool, self.alice, '30.00', [self.alice, self.bob])
+            background.wait()
+            self.assertEqual(background.stats()['queued'], 0)
+
+            mark_active('pool', self.pool.id)
+            # Warming starts on commit, once the expense and its splits are written
+            with db_transaction.atomic():
+                self.add_expense(self.pool, self.alice, '10.00', [self.alice, self.bob])
+            background.wait()
+        self.assertGreaterEqual(background.stats()['warmed'], 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cached_pool_balances(self.pool.id)[self.bob.id]['balance'], -20.0)
+
+    def test_command_warms_top_pools(self):
+        out = StringIO()
+        call_command('warm_cache', '--top', '5', '--concurrency', '2', '--members', stdout=out)
+        self.assertIn('Warmed 3 cache(s) for 1 pool(s)', out.getvalue())
+        with self.assertNumQueries(0):
+            get_cached_pool_members(self.pool.id)
+
+
+class CacheStatsTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        clear_caches()
+        reset_prefix_stats()
+
+    def test_lookups_are_counted_per_prefix(self):
+        pool, (alice, bob) = self.make_pool('alice', 'bob')
+        get_cached_pool_balances(pool.id)
+        get_cached_pool_balances(pool.id)
+        # Counts from another worker arrive through the shared counters
+        cache.set('finsplit:stats:pool_balances:hits', 5, None)
+
+        row = get_prefix_stats()['prefixes']['pool_balances']
+        self.assertEqual((row['hits'], row['misses'], row['sets'], row['computes']), (6, 1, 1, 1))
+        self.assertEqual(row['hit_rate'], round(6 / 7, 4))
+        self.assertIsNotNone(row['compute_ms_mean'])
+
+    def test_statistics_are_staff_only(self):
+        pool, (alice,) = self.make_pool('alice')
+        self.client.force_login(alice)
+        self.assertEqual(self.client.get('/api/cache-stats/').status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin_cache_stats')).status_code, 302)
+
+        alice.is_staff = True
+        alice.save()
+        response = self.client.get('/api/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('api_response', response.json()['prefixes']['prefixes'])
+        self.assertContains(self.client.get(reverse('admin_cache_stats')), 'pool_balances')
+
+
+class CacheCodecTests(SimpleTestCase):
+
+    def test_balances_round_trip_compactly(self):
+        balances = {
+            user_id: {'user_id': user_id, 'username': f'user{user_id}', 'paid': 10.1, 'owes': 33.33, 'balance': -23.23}
+            for user_id in range(1, 200)
+        }
+        flags, payload = cache_codec.encode('pool_balances', balances)
+        self.assertEqual(flags, cache_codec.COMPACT | cache_codec.COMPRESSED)
+        self.assertLess(len(pickle.dumps(payload)), len(pickle.dumps(balances)) / 4)
+        self.assertEqual(cache_codec.decode('pool_balances', flags, payload), balances)
+
+    def test_unexpected_shapes_are_stored_as_they_are(self):
+        odd = {1: {'user_id': 1, 'username': 'a', 'paid': 0.001, 'owes': 0.0, 'balance': 0.0}}
+        self.assertEqual(cache_codec.encode('pool_balances', odd), (cache_codec.PLAIN, odd))
+        self.assertEqual(cache_codec.encode('pool_members', []), (cache_codec.PLAIN, []))
+
+
+class _FakeConnection:
+    """Records batch sizes; fails while log["failures"] > 0 and waits for ``gate`` if given."""
+
+    def __init__(self, log, gate=None):
+        self.log = log
+        self.gate = gate
+
+    def open(self):
+        self.log['opened'] += 1
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        if self.gate:
+            self.gate.wait()
+        if self.log['failures'] > 0:
+            self.log['failures'] -= 1
+            raise ConnectionError('server went away')
+        self.log['batches'].append(len(messages))
+        return len(messages)
+
+
+class EmailDispatcherTests(SimpleTestCase):
+
+    def dispatcher(self, log, gate=None, **options):
+        dispatcher = EmailDispatcher(connection_factory=lambda: _FakeConnection(log, gate=gate), **options)
+        self.addCleanup(dispatcher.shutdown)
+        return dispatcher
+
+    def message(self, number=0):
+        return mail.EmailMessage(f'Subject {number}', 'Body', 'from@example.com', ['to@example.com'])
+
+    def test_batches_share_one_connection_per_worker(self):
+        log = {'opened': 0, 'failures': 0, 'batches': []}
+        dispatcher = self.dispatcher(log, workers=2, batch_size=10)
+        for number in range(45):
+            self.assertTrue(dispatcher.send(self.message(number)))
+        dispatcher.flush()
+        self.assertEqual(sum(log['batches']), 45)
+        self.assertLessEqual(max(log['batches']), 10)
+        self.assertLessEqual(log['opened'], 2)
+        self.assertEqual(dispatcher.stats()['sent'], 45)
+
+    def test_full_queue_pushes_back_on_senders(self):
+        log = {'opened': 0, 'failures': 0, 'batches': []}
+        gate = threading.Event()
+        dispatcher = self.dispatcher(log, gate, workers=1, queue_size=1, batch_size=1, batch_wait=0)
+        self.assertTrue(dispatcher.send(self.message(1)))
+        # Wait until the worker holds the first message, then fill the queue
+        while dispatcher.stats()['pending']:
+            time.sleep(0.01)
+        self.assertTrue(dispatcher.send(self.message(2)))
+        self.assertFalse(dispatcher.send(self.message(3), timeout=0.05))
+        gate.set()
+        dispatcher.flush()
+        self.assertEqual(log['batches'], [1, 1])
+        self.assertEqual(dispatcher.stats()['rejected'], 1)
+
+    def test_failed_batch_is_retried_on_a_new_connection(self):
+        log = {'opened': 0, 'failures': 1, 'batches': []}
+        dispatcher = self.dispatcher(log, workers=1)
+        dispatcher.send(self.message())
+        dispatcher.flush()
+        self.assertEqual(log['batches'], [1])
+        self.assertEqual(log['opened'], 2)
+
+    def test_failure_mid_batch_does_not_resend_delivered_messages(self):
+        delivered = []
+
+        def send_messages(messages):
+            # Like the SMTP backend, a failure can come after part of the list went out
+            for message in messages:
+                if len(delivered) == 2 and not getattr(send_messages, 'failed', False):
+                    send_messages.failed = True
+                    raise ConnectionError('server went away')
+                delivered.append(message.subject)
+            return len(messages)
+
+        connection = mock.Mock(**{'send_messages.side_effect': send_messages})
+        # A long batch_wait gathers all five messages into one batch
+        dispatcher = EmailDispatcher(connection_factory=lambda: connection, workers=1, batch_size=5, batch_wait=5)
+        self.addCleanup(dispatcher.shutdown)
+        for number in range(5):
+            dispatcher.send(self.message(number))
+        dispatcher.flush()
+        self.assertEqual(delivered, [f'Subject {number}' for number in range(5)])
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        mail.outbox = []
+
+    def queue(self, number=0):
+        return send_email_async(f'Subject {number}', 'Plain', 'from@example.com', ['to@example.com'], '<p>Hi</p>')
+
+    def test_helpers_only_insert_inside_the_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with db_transaction.atomic():
+                self.queue(1)
+                raise RuntimeError('request failed')
+        self.assertFalse(Outbox.objects.exists())
+
+        with self.assertNumQueries(1):
+            self.queue(2)
+        self.assertEqual(Outbox.objects.get().status, 'pending')
+        self.assertEqual(mail.outbox, [])
+
+    def test_worker_sends_due_emails_and_records_latency(self):
+        for number in range(3):
+            self.queue(number)
+        call_command('send_outbox', '--once', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        for row in Outbox.objects.all():
+            self.assertEqual((row.status, row.attempts), ('sent', 1))
+            self.assertIsNotNone(row.latency_ms)
+
+    def test_failures_back_off_then_give_up(self):
+        self.queue()
+        broken = mock.Mock(**{'send_messages.side_effect': ConnectionError('refused')})
+        with mock.patch('core.outbox.get_connection', return_value=broken):
+            deliver_batch(claim_batch())
+            row = Outbox.objects.get()
+            self.assertEqual((row.status, row.attempts, row.last_error), ('pending', 1, 'refused'))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+            self.assertEqual(claim_batch(), [])
+
+            Outbox.objects.update(attempts=outbox.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+            deliver_batch(claim_batch())
+        self.assertEqual(Outbox.objects.get().status, 'failed')
+
+    def test_slow_batches_renew_their_claim_and_skip_rows_taken_over(self):
+        for number in range(3):
+            self.queue(number)
+        rows = claim_batch()
+        taken_over = rows[2]
+
+        def send_messages(messages):
+            # While the first email is sent, another worker claims the last one
+            Outbox.objects.filter(id=taken_over.id).update(claim_token=None, status='pending')
+            return len(messages)
+
+        connection = mock.Mock(**{'send_messages.side_effect': send_messages})
+        with mock.patch('core.outbox.RENEW_INTERVAL', 0):
+            _, counts = deliver_batch(rows, connection)
+
+        self.assertEqual(counts['sent'], 2)
+        self.assertEqual(Outbox.objects.get(id=taken_over.id).status, 'pending')
+        self.assertEqual(Outbox.objects.filter(status='sent').count(), 2)
+
+    def test_disabled_outbox_sends_through_the_dispatcher_after_commit(self):
+        with self.settings(FINSPLIT_EMAIL_OUTBOX={'ENABLED': False}):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue()
+                self.assertEqual(mail.outbox, [])
+        dispatcher.flush()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(Outbox.objects.exists())
+
+
+class DigestTests(PoolTestMixin, TestCase):
+
+    def test_digest_users_get_one_email_per_window(self):
+        pool, (alice, bob, carol) = self.make_pool('alice', 'bob', 'carol')
+        UserProfile.objects.filter(user=bob).update(email_delivery='digest')
+        for _ in range(3):
+            expense = self.add_expense(pool, alice, '30.00', [alice, bob, carol])
+            send_expense_notification_email(expense, [bob, carol])
+
+        self.assertEqual(Outbox.objects.count(), 3)
+        self.assertTrue(all(row.recipients == ['carol@example.com'] for row in Outbox.objects.all()))
+        self.assertEqual(NotificationEvent.objects.filter(recipient=bob, sent_at__isnull=True).count(), 3)
+
+        # Not due until the oldest event is a window old
+        self.assertEqual(send_due_digests(window=3600), (0, 0))
+        self.assertEqual(send_due_digests(window=0), (1, 3))
+        digest = Outbox.objects.latest('id')
+        self.assertEqual(digest.recipients, ['bob@example.com'])
+        self.assertEqual(digest.html_body.count('alice paid for Dinner'), 3)
+        self.assertEqual(send_due_digests(window=0), (0, 0))
+
+    def test_signup_form_keeps_instant_delivery_by_default(self):
+        form = UserProfileForm({'upi_id': 'new@upi'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['email_delivery'], '')
+        self.assertEqual(form.save(commit=False).email_delivery, 'instant')
+
+
+class EmailRenderTests(SimpleTestCase):
+
+    def setUp(self):
+        body_cache.clear()
+
+    def test_event_is_rendered_once_and_personalized_per_recipient(self):
+        context = {
+            'transaction': mock.Mock(amount=Decimal('12.50'), settled_at=None),
+            'is_payer': True,
+        }
+        with mock.patch('core.email_render.get_template', wraps=get_template) as compile_template:
+            for _ in range(3):
+                html, text = render_email(
+                    'emails/settlement_confirmation.html', context,
+                    event_key=('settlement', 7, True), recipient_fields=('recipient_name',),
+                )
+        self.assertEqual(compile_template.call_count, 1)
+        self.assertIn(placeholder('recipient_name'), text)
+        self.assertIn('Hi Tom &amp; Jerry,', personalize(html, {'recipient_name': 'Tom & Jerry'}))
+        self.assertIn('Hi Tom & Jerry,', personalize(text, {'recipient_name': 'Tom & Jerry'}, html=False))
+
+
+class EmailContentTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        body_cache.clear()
+
+    def test_cached_bodies_follow_every_rendered_field(self):
+        pool, (alice, bob) = self.make_pool('alice', 'bob')
+        send_pool_invite_email(alice, pool, 'new@example.com')
+        alice.email = 'alice@work.example.com'
+        alice.save()
+        send_pool_invite_email(alice, pool, 'other@example.com')
+        self.assertIn('sent by alice@work.example.com', Outbox.objects.latest('id').html_body)
+
+        expense = self.add_expense(pool, alice, '20.00', [alice, bob])
+        send_expense_notification_email(expense, [bob])
+        alice.first_name = 'Alice'
+        alice.save()
+        send_expense_notification_email(expense, [bob])
+        self.assertIn('Alice', Outbox.objects.latest('id').html_body)
+
+        reminder = Transaction.objects.create(pool=pool, from_user=bob, to_user=alice, amount=Decimal('10.00'))
+        UserProfile.objects.filter(user=alice).update(upi_id='old@upi')
+        send_settlement_reminder_email(Transaction.objects.get(pk=reminder.pk))
+        UserProfile.objects.filter(user=alice).update(upi_id='new@upi')
+        send_settlement_reminder_email(Transaction.objects.get(pk=reminder.pk))
+        self.assertIn('new@upi', Outbox.objects.latest('id').html_body)
+
+
+class WeeklySummaryTests(PoolTestMixin, TestCase):
+
+    def test_contexts_for_many_users_take_a_fixed_number_of_queries(self):
+        pool, users = self.make_pool('alice', 'bob', 'carol')
+        other = Pool.objects.create(name='Flat', created_by=users[1])
+        Member.objects.create(pool=other, user=users[1])
+        self.add_expense(pool, users[0], '90.00', users)
+        self.add_expense(other, users[1], '40.00', [users[1]])
+        rows = list(User.objects.order_by('id').values('id', 'username', 'first_name', 'email'))
+
+        with self.assertNumQueries(6):
+            contexts = weekly_summary_contexts(rows, timezone.now() - timedelta(days=7))
+        bob = contexts[users[1].id]
+        self.assertEqual([summary['name'] for summary in bob['pools']], ['Flat', 'Trip'])
+        self.assertEqual(bob['week_share'], Decimal('70.00'))
+        self.assertEqual(bob['you_owe'], Decimal('30.00'))
+        self.assertEqual(contexts[users[0].id]['owed_to_you'], Decimal('60.00'))
+
+    def test_command_queues_one_summary_per_member(self):
+        pool, users = self.make_pool('alice', 'bob')
+        self.add_expense(pool, users[0], '10.00', users)
+        User.objects.create(username='loner', email='loner@example.com')
+        out = StringIO()
+        call_command('send_weekly_summaries', '--workers', '0', '--chunk-size', '1', stdout=out)
+        self.assertEqual(
+            sorted(row.recipients[0] for row in Outbox.objects.all()), ['alice@example.com', 'bob@example.com']
+        )
+        self.assertIn('Dinner', Outbox.objects.first().html_body)
+        self.assertIn('3/3 users', out.getvalue())
+
+    def test_single_user_summary_and_templates(self):
+        pool, users = self.make_pool('alice', 'bob')
+        send_weekly_summary_email(users[0])
+        self.assertEqual(Outbox.objects.get().recipients, ['alice@example.com'])
+        self.assertTrue(validate_email_templates())
+
+
+class FragmentCacheTests(PoolTestMixin, TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.pool, (self.alice, self.bob) = self.make_pool('alice', 'bob')
+        self.add_expense(self.pool, self.alice, '30.00', [self.alice, self.bob])
+        self.client.force_login(self.alice)
+
+    def queries_for(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, ' '.join(query['sql'] for query in context.captured_queries)
+
+    def test_unchanged_pool_renders_panels_from_cache(self):
+        url = reverse('core:pool_detail', args=[self.pool.id])
+        response, _ = self.queries_for(url)
+        self.assertContains(response, 'bob')
+        self.assertContains(response, 'Admin')
+
+        response, sql = self.queries_for(url)
+        self.assertContains(response, 'Dinner')
+        # Only the page count is read to resolve the page number
+        for column in ('core_expense"."title"', 'core_memberbalance', 'core_userprofile'):
+            self.assertNotIn(column, sql)
+
+        # Page values that resolve to the same page share one fragment
+        fragment_key = mock.patch(
+            'django.templatetags.cache.make_template_fragment_key', wraps=make_template_fragment_key
+        )
+        with fragment_key as key:
+            for page in ('a1', 'a2', '1', '999'):
+                self.client.get(url, {'page': page})
+        self.assertEqual(len({tuple(call.args[1]) for call in key.call_args_list if call.args[0] == 'pool_expenses'}), 1)
+
+        Expense.objects.filter(pk=self.pool.expenses.get().pk).update(title='Lunch')
+        self.assertContains(self.client.get(url), 'Dinner')
+        self.add_expense(self.pool, self.bob, '10.00', [self.alice, self.bob])
+        self.assertContains(self.client.get(url), 'Lunch')
+
+    def test_dashboard_pools_list_is_cached(self):
+        url = reverse('core:dashboard')
+        self.assertContains(self.queries_for(url)[0], '2 members')
+        response, sql = self.queries_for(url)
+        self.assertContains(response, '2 members')
+        self.assertNotIn('SUM(', sql)
+
+
+class CacheResultTests(SimpleTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.calls = 0
+
+    def counted(self, value=None, delay=0):
+        def compute(key):
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_none_results_are_cached(self):
+        lookup = cache_result('test_negative')(self.counted(None))
+        self.assertIsNone(lookup(1))
+        self.assertIsNone(lookup(1))
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_misses_compute_once(self):
+        lookup = cache_result('test_single_flight')(self.counted({'total': 1}, delay=0.2))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(lookup(7))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'total': 1}] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_expired_entry_is_served_stale_while_another_caller_refreshes(self):
+        lookup = cache_result('test_stale')(self.counted('fresh'))
+        key = generate_cache_key('test_stale', 3)
+        cache.set(key, ('stale', 0.01, time.time() - 1, 0), 60)
+        cache.add(f'{key}:lock', 1, 60)
+
+        self.assertEqual(lookup(3), 'stale')
+        self.assertEqual(self.calls, 0)
+
+        cache.delete(f'{key}:lock')
+        self.assertEqual(lookup(3), 'fresh')
+        self.assertEqual(self.calls, 1)
+
+    def test_local_tier_serves_repeat_reads_and_follows_other_processes(self):
+        lookup = cache_result('test_tiers', scopes=lambda pool_id: [('pool', pool_id)])(self.counted('value'))
+        lookup(4)
+        shared_hits = shared_cache_stats['hits']
+        self.assertEqual(lookup(4), 'value')
+        self.assertEqual(shared_cache_stats['hits'], shared_hits)
+        self.assertEqual(self.calls, 1)
+
+        # Another worker invalidates the pool: bumps its counter and the epoch
+        cache.incr('finsplit:gen:pool:4')
+        cache.incr(cache_utils.EPOCH_KEY)
+        with mock.patch.object(cache_utils, 'LOCAL_CACHE_POLL_INTERVAL', 0):
+            lookup(4)
+        self.assertEqual(self.calls, 2)
+
+    def test_local_cache_is_a_bounded_lru(self):
+        local = LocalCache(max_entries=2)
+        local.set('a', 1, 60)
+        local.set('b', 2, 60)
+        local.get('a')
+        local.set('c', 3, 60)
+        self.assertIsNone(local.get('b'))
+        self.assertEqual((local.get('a'), local.get('c')), (1, 3))
+        local.set('d', 4, 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(local.get('d'))
+        self.assertEqual(local.stats()['evictions'], 2)
+        self.assertEqual(local.stats()['expirations'], 1)
+
+
+def _increment(location, times):
+    backend = SharedMemoryCache(location, {'OPTIONS': {'BUCKETS': 4, 'WAYS': 2, 'SLOT_SIZE': 256}})
+    for _ in range(times):
+        backend.incr('counter')
+
+
+class SharedMemoryCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache')
+
+    def backend(self, **options):
+        options = {'BUCKETS': 4, 'WAYS': 2, 'SLOT_SIZE': 256, **options}
+        return SharedMemoryCache(self.location, {'OPTIONS': options})
+
+    def test_files_others_can_access_are_refused(self):
+        self.backend().set('pool', 1)
+        self.assertEqual(os.stat(self.location).st_mode & 0o777, 0o600)
+
+        shared = self.location + '-shared'
+        os.close(os.open(shared, os.O_CREAT | os.O_WRONLY, 0o600))
+        os.chmod(shared, 0o666)
+        with self.assertRaises(ImproperlyConfigured):
+            SharedMemoryCache(shared, {}).get('pool')
+
+        link = self.location + '-link'
+        os.symlink(self.location, link)
+        with self.assertRaises(ImproperlyConfigured):
+            SharedMemoryCache(link, {}).get('pool')
+
+    def test_entries_are_shared_between_instances(self):
+        first, second = self.backend(), self.backend()
+        first.set('pool', {'total': 5})
+        self.assertEqual(second.get('pool'), {'total': 5})
+        self.assertFalse(second.add('pool', 'other'))
+        second.delete('pool')
+        self.assertIsNone(first.get('pool'))
+
+    def test_incr_is_atomic_across_processes(self):
+        self.backend().set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_increment, args=(self.location, 200)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.backend().get('counter'), 800)
+
+    def test_full_buckets_evict_and_oversized_values_are_skipped(self):
+        backend = self.backend(BUCKETS=1)
+        for key in ('a', 'b', 'c'):
+            backend.set(key, key)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('c'), 'c')
+        self.assertFalse(backend.add('big', 'x' * 1000))
+        self.assertIsNone(backend.get('big'))
+        self.assertEqual(backend.get_stats()['evictions'], 1)
+        self.assertEqual(backend.drain_evictions(), [':1:a'])
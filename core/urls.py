@@ -17,6 +17,7 @@ urlpatterns = [
     path('pools/<int:pool_id>/', views.pool_detail, name='pool_detail'),
     path('pools/<int:pool_id>/edit/', views.pool_edit, name='pool_edit'),
     path('pools/<int:pool_id>/delete/', views.pool_delete, name='pool_delete'),
+    path('pools/<int:pool_id>/export/', views.pool_export, name='pool_export'),
     
     # Member management
     path('pools/<int:pool_id>/members/add/', views.member_add, name='member_add'),
@@ -30,6 +31,7 @@ urlpatterns = [
     
     # Settlement
     path('pools/<int:pool_id>/settle/', views.pool_settle, name='pool_settle'),
+    path('pools/<int:pool_id>/settle/commit/', views.pool_settle_commit, name='pool_settle_commit'),
     path('transactions/<int:transaction_id>/mark_paid/', views.transaction_mark_paid, name='transaction_mark_paid'),
     
     # Authentication
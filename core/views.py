@@ -6,14 +6,23 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.urls import reverse
+from django.db import transaction as db_transaction
+from django.db.models import Count, DecimalField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+from django.utils.functional import SimpleLazyObject
 import logging
+from decimal import Decimal
 from django.contrib.auth.models import User
 from .models import Pool, Member, Expense, Transaction, UserProfile
+from .conditional import pool_page_condition
 from .forms import PoolForm, ExpenseForm, MemberForm, UserProfileForm
+from .settlement import get_pool_settlement_plan, commit_settlement_plan
+from .splits import save_expense_splits
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +37,24 @@ def home(request):
 @login_required
 def dashboard(request):
     """User dashboard showing pools and recent activity."""
+    from .cache_utils import CACHE_TIMEOUTS, get_cached_user_settlements
+    from .warmer import mark_active
+    
+    mark_active('user', request.user.id)
     user_pools = Pool.objects.filter(members=request.user, is_active=True)
+    # One query for the ids and versions that key the cached pools list;
+    # the pools themselves are only loaded when it has to be rendered again
+    pool_versions = list(user_pools.order_by('id').values_list('id', 'version'))
+    pools = user_pools.annotate(
+        active_member_count=Coalesce(Subquery(
+            Member.objects.filter(pool=OuterRef('pk'), is_active=True)
+            .values('pool').annotate(count=Count('pk')).values('count')
+        ), 0),
+        total_expenses=Coalesce(Subquery(
+            Expense.objects.filter(pool=OuterRef('pk'))
+            .values('pool').annotate(total=Sum('amount')).values('total')
+        ), Value(Decimal('0.00')), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    )
     recent_expenses = Expense.objects.filter(
         pool__in=user_pools
     ).order_by('-created_at')[:10]
@@ -39,9 +65,13 @@ def dashboard(request):
     )
     
     context = {
-        'pools': user_pools,
+        'pools': pools,
+        'pool_count': len(pool_versions),
+        'pool_versions': pool_versions,
+        'fragment_timeout': CACHE_TIMEOUTS['fragments'],
         'recent_expenses': recent_expenses,
         'pending_transactions': pending_transactions,
+        'cross_pool': get_cached_user_settlements(request.user.id),
     }
     return render(request, 'core/dashboard.html', context)
 
@@ -97,48 +127,70 @@ def pool_create(request):
 
 
 @login_required
+@pool_page_condition
 def pool_detail(request, pool_id):
     """Pool detail view with expenses and members."""
-    from .cache_utils import get_cached_pool_balances, get_cached_pool_summary
-    
-    pool = get_object_or_404(Pool, id=pool_id, members=request.user)
+    from .cache_utils import CACHE_TIMEOUTS, get_cached_pool_balances, get_cached_pool_summary
     
-    # Get expenses with pagination
-    expenses = pool.expenses.all()
-    paginator = Paginator(expenses, 10)
+    pool = get_object_or_404(Pool.objects.select_related('created_by'), id=pool_id, members=request.user)
     page_number = request.GET.get('page')
-    expenses_page = paginator.get_page(page_number)
     
-    # Get members
-    members = pool.members.filter(member__is_active=True)
+    # The expense page, members and balances are rendered as fragments cached
+    # by pool version (see pool_detail.html), so they are only queried when
+    # a fragment has to be rendered again. The expense fragment is keyed on
+    # the resolved page number (one COUNT), not the raw ?page= value.
+    expenses_page = SimpleLazyObject(lambda: Paginator(
+        pool.expenses.select_related('paid_by'), 10
+    ).get_page(page_number))
+    members = Member.objects.filter(pool=pool, is_active=True).select_related('user__profile')
     
-    # Get cached balances for better performance
-    try:
-        balances = get_cached_pool_balances(pool_id)
-    except:
-        # Fallback to model method if caching fails
-        balances = pool.get_balances()
+    def pool_balances():
+        try:
+            balances = get_cached_pool_balances(pool_id)
+        except Exception:
+            balances = None
+        if balances is not None:
+            return balances
+        # Fallback to the ledger directly if caching fails
+        return {
+            user_id: {
+                'user_id': user_id,
+                'username': balance['user'].username,
+                'paid': balance['paid'],
+                'owes': balance['owes'],
+                'balance': balance['balance'],
+            }
+            for user_id, balance in pool.get_balances().items()
+        }
     
     # Get pending transactions
     transactions = Transaction.objects.filter(
         pool=pool,
         status='pending'
-    )
+    ).select_related('from_user', 'to_user')
     
     # Get cached pool summary
     try:
         pool_summary = get_cached_pool_summary(pool_id)
-        total_expenses = pool_summary['total_expenses'] if pool_summary else pool.get_total_expenses()
-    except:
-        total_expenses = pool.get_total_expenses()
+    except Exception:
+        pool_summary = None
+    if not pool_summary:
+        pool_summary = {
+            'total_expenses': pool.get_total_expenses(),
+            'member_count': pool.get_member_count(),
+            'expense_count': pool.expenses.count(),
+        }
     
     context = {
         'pool': pool,
         'expenses_page': expenses_page,
         'members': members,
-        'balances': balances,
+        'balances': SimpleLazyObject(pool_balances),
         'transactions': transactions,
-        'total_expenses': total_expenses,
+        'total_expenses': pool_summary['total_expenses'],
+        'member_count': pool_summary['member_count'],
+        'expense_count': pool_summary['expense_count'],
+        'fragment_timeout': CACHE_TIMEOUTS['fragments'],
     }
     return render(request, 'core/pool_detail.html', context)
 
@@ -264,13 +316,15 @@ def expense_add(request, pool_id):
     if request.method == 'POST':
         form = ExpenseForm(request.POST, request.FILES, pool=pool)
         if form.is_valid():
-            expense = form.save(commit=False)
-            expense.pool = pool
-            expense.created_by = request.user
-            expense.save()
-            
-            # Create expense splits based on the split method
-            create_expense_splits(expense, request.POST)
+            # Expense, splits and ledger rows are written together
+            with db_transaction.atomic():
+                expense = form.save(commit=False)
+                expense.pool = pool
+                expense.created_by = request.user
+                expense.save()
+                
+                # Splits were resolved by the form for the chosen split method
+                save_expense_splits(expense, form.split_allocation)
             
             # Invalidate cache for this pool
             invalidate_pool_cache(pool_id)
@@ -291,48 +345,38 @@ def expense_add(request, pool_id):
     return render(request, 'core/expense_form.html', {'form': form, 'pool': pool, 'title': 'Add Expense'})
 
 
-def create_expense_splits(expense, post_data):
-    """Create expense splits based on the split method."""
-    from .models import ExpenseSplit
-    from decimal import Decimal
-    
-    # Get pool members
-    pool_members = expense.pool.members.filter(member__is_active=True)
+@login_required
+def pool_export(request, pool_id):
+    """Stream a pool's expenses, splits or transactions as CSV or NDJSON."""
+    from .exporter import EXPORTS, EXPORT_FORMATS, stream_export
     
-    if expense.split_method == 'equal':
-        # Equal split among all active members
-        split_amount = expense.amount / pool_members.count()
-        for member in pool_members:
-            ExpenseSplit.objects.create(
-                expense=expense,
-                user=member,
-                amount=split_amount,
-                percentage=(split_amount / expense.amount * 100)
-            )
+    pool = get_object_or_404(Pool, id=pool_id, members=request.user)
     
-    elif expense.split_method == 'percentage':
-        # Percentage-based split (would need additional form handling)
-        # For now, default to equal split
-        split_amount = expense.amount / pool_members.count()
-        for member in pool_members:
-            ExpenseSplit.objects.create(
-                expense=expense,
-                user=member,
-                amount=split_amount,
-                percentage=(split_amount / expense.amount * 100)
-            )
+    kind = request.GET.get('type', 'expenses')
+    file_format = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or file_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown export type or format.')
     
-    elif expense.split_method == 'manual':
-        # Manual split (would need additional form handling)
-        # For now, default to equal split
-        split_amount = expense.amount / pool_members.count()
-        for member in pool_members:
-            ExpenseSplit.objects.create(
-                expense=expense,
-                user=member,
-                amount=split_amount,
-                percentage=(split_amount / expense.amount * 100)
-            )
+    dates = []
+    for param in ('start', 'end'):
+        value = request.GET.get(param)
+        try:
+            date = parse_date(value) if value else None
+        except ValueError:
+            date = None
+        if value and date is None:
+            return HttpResponseBadRequest('Dates must be YYYY-MM-DD.')
+        dates.append(date)
+    start_date, end_date = dates
+    
+    content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(
+        stream_export(pool.id, kind, file_format, start_date, end_date),
+        content_type=f'{content_type}; charset=utf-8'
+    )
+    filename = f'pool-{pool.id}-{kind}.{file_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
 @login_required
@@ -361,13 +405,18 @@ def expense_edit(request, expense_id):
     if request.method == 'POST':
         form = ExpenseForm(request.POST, request.FILES, instance=expense, pool=expense.pool)
         if form.is_valid():
-            form.save()
+            with db_transaction.atomic():
+                form.save()
+                if form.split_allocation is not None:
+                    save_expense_splits(expense, form.split_allocation, replace=True)
             messages.success(request, 'Expense updated successfully!')
             return redirect('core:expense_detail', expense_id=expense.id)
     else:
         form = ExpenseForm(instance=expense, pool=expense.pool)
     
-    return render(request, 'core/expense_form.html', {'form': form, 'expense': expense, 'title': 'Edit Expense'})
+    return render(request, 'core/expense_form.html', {
+        'form': form, 'expense': expense, 'pool': expense.pool, 'title': 'Edit Expense'
+    })
 
 
 @login_required
@@ -391,40 +440,12 @@ def pool_settle(request, pool_id):
     
     balances = pool.get_balances()
     
-    # Calculate optimal settlements (simplified algorithm)
-    settlements = []
-    creditors = []  # People who are owed money
-    debtors = []    # People who owe money
-    
-    for user_id, balance_info in balances.items():
-        if balance_info['balance'] > 0:
-            creditors.append((balance_info['user'], balance_info['balance']))
-        elif balance_info['balance'] < 0:
-            debtors.append((balance_info['user'], abs(balance_info['balance'])))
-    
-    # Simple settlement algorithm
-    for debtor, debt_amount in debtors:
-        for creditor, credit_amount in creditors:
-            if debt_amount > 0 and credit_amount > 0:
-                settlement_amount = min(debt_amount, credit_amount)
-                
-                # Create a Transaction object for the suggested settlement
-                transaction = Transaction.objects.create(
-                    pool=pool,
-                    from_user=debtor,
-                    to_user=creditor,
-                    amount=settlement_amount,
-                    status='pending' # New transactions are pending by default
-                )
-                
-                settlements.append({
-                    'from_user': debtor,
-                    'to_user': creditor,
-                    'amount': settlement_amount,
-                    'id': transaction.id # Pass the transaction ID to the template
-                })
-                debt_amount -= settlement_amount
-                credit_amount -= settlement_amount
+    # ?mode=optimal asks for the fewest transfers (falls back to greedy on large pools)
+    mode = 'optimal' if request.GET.get('mode') == 'optimal' else 'greedy'
+    
+    # Plans are cached per balance state; nothing is written until the plan is committed
+    plan = get_pool_settlement_plan(pool, balances, mode=mode)
+    settlements = plan.settlements
     
     for transaction in pool.transactions.all():
         transaction.is_involved = (request.user == transaction.from_user or request.user == transaction.to_user)
@@ -433,11 +454,35 @@ def pool_settle(request, pool_id):
         'pool': pool,
         'balances': balances,
         'settlements': settlements,
+        'settlement_mode': mode,
+        'settlement_algorithm': plan.algorithm,
+        'settlement_elapsed_ms': plan.elapsed_ms,
+        'settlement_version': plan.version,
         'transactions': pool.transactions.all(), # Pass all transactions with the new flag
     }
     return render(request, 'core/pool_settle.html', context)
 
 
+@login_required
+@require_http_methods(['POST'])
+def pool_settle_commit(request, pool_id):
+    """Turn the current settlement plan into pending transactions."""
+    pool = get_object_or_404(Pool, id=pool_id, members=request.user)
+    mode = 'optimal' if request.POST.get('mode') == 'optimal' else 'greedy'
+    
+    plan = get_pool_settlement_plan(pool, mode=mode)
+    if request.POST.get('version') != plan.version:
+        messages.warning(request, 'Balances changed since you opened this page. Please review the updated plan.')
+    else:
+        created = commit_settlement_plan(pool, plan)
+        if created:
+            messages.success(request, f'{len(created)} settlement payment(s) added. Creditors can mark them as settled once paid.')
+        else:
+            messages.info(request, 'This settlement plan has already been committed.')
+    
+    return redirect(f"{reverse('core:pool_settle', args=[pool.id])}?mode={mode}")
+
+
 @login_required
 def transaction_mark_paid(request, transaction_id):
     """Mark a transaction as settled - only creditor can do this."""
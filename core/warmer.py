@@ -0,0 +1,195 @@
+"""
+Background cache warming for FinSplit.
+Remembers which pools and users were active recently and, when a write
+invalidates one of them, recomputes its cached values on a small thread
+pool, so the next visitor finds them ready instead of paying for the
+recompute.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+WARMER = getattr(settings, 'FINSPLIT_CACHE_WARMER', {})
+WARMER_WORKERS = WARMER.get('WORKERS', 2)
+WARMER_MAX_PENDING = WARMER.get('MAX_PENDING', 100)
+ACTIVE_WINDOW = WARMER.get('ACTIVE_WINDOW', 900)
+
+
+# Activity tracking
+#
+# Activity is kept in the shared cache, so a pool viewed through one worker
+# is re-warmed by whichever worker handles the write. Each process refreshes
+# a marker at most once per tenth of the window.
+
+_marked = {}
+
+
+def _activity_key(kind, object_id):
+    return f"finsplit:active:{kind}:{object_id}"
+
+
+def mark_active(kind, object_id):
+    """Record that a pool or user ('pool' / 'user') is being used."""
+    now = time.monotonic()
+    if now - _marked.get((kind, object_id), float('-inf')) < ACTIVE_WINDOW / 10:
+        return
+    if len(_marked) > 10000:
+        _marked.clear()
+    _marked[(kind, object_id)] = now
+    try:
+        cache.set(_activity_key(kind, object_id), 1, ACTIVE_WINDOW)
+    except Exception as e:
+        logger.error(f"Failed to record activity for {kind} {object_id}: {str(e)}")
+
+
+def is_active(kind, object_id):
+    return cache.get(_activity_key(kind, object_id)) is not None
+
+
+def _warm(kind, object_id):
+    from .cache_utils import warm_pool_cache, warm_user_cache
+
+    try:
+        if kind == 'pool':
+            warm_pool_cache(object_id)
+        else:
+            warm_user_cache(object_id)
+    finally:
+        # Worker threads have their own database connections
+        connections.close_all()
+
+
+def _summarize(timings):
+    if not timings:
+        return {'count': 0, 'total_ms': 0.0, 'mean_ms': None, 'p95_ms': None, 'max_ms': None}
+    ordered = sorted(timings)
+    return {
+        'count': len(ordered),
+        'total_ms': round(sum(ordered), 3),
+        'mean_ms': round(sum(ordered) / len(ordered), 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+class CacheWarmer:
+    """
+    Re-warms invalidated pools and users on a bounded thread pool.
+
+    A pool or user already waiting to be warmed is not queued again, and
+    requests beyond ``max_pending`` are dropped rather than queued, so a
+    burst of writes cannot build an unbounded backlog.
+    """
+
+    def __init__(self, workers=WARMER_WORKERS, max_pending=WARMER_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.enabled = workers > 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._timings = []
+        self.counts = {'queued': 0, 'warmed': 0, 'failed': 0, 'dropped': 0}
+
+    def _run(self, kind, object_id):
+        with self._lock:
+            self._pending.discard((kind, object_id))
+        started = time.perf_counter()
+        try:
+            _warm(kind, object_id)
+        except Exception as e:
+            with self._lock:
+                self.counts['failed'] += 1
+            logger.error(f"Failed to warm cache for {kind} {object_id}: {str(e)}")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.counts['warmed'] += 1
+            self._timings.append(elapsed_ms)
+            del self._timings[:-1000]
+
+    def submit(self, kind, object_id):
+        """Warm a pool or user in the background. Returns False if it was not queued."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if (kind, object_id) in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.counts['dropped'] += 1
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='finsplit-warmer')
+            self._pending.add((kind, object_id))
+            self.counts['queued'] += 1
+        self._executor.submit(self._run, kind, object_id)
+        return True
+
+    def invalidated(self, kind, object_id):
+        """Called after a pool or user is invalidated: re-warm it if it is active."""
+        if self.enabled and is_active(kind, object_id):
+            self.submit(kind, object_id)
+
+    def wait(self):
+        """Block until everything queued so far has been warmed."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'workers': self.workers,
+                'pending': len(self._pending),
+                **self.counts,
+                'warm_time': _summarize(self._timings),
+            }
+
+
+warmer = CacheWarmer()
+
+
+def warm_pools(pool_ids, concurrency=4, include_members=False):
+    """
+    Warm many pools (and optionally their members) with at most
+    ``concurrency`` threads. Returns timing metrics in milliseconds.
+    """
+    from .models import Member
+
+    jobs = [('pool', pool_id) for pool_id in pool_ids]
+    if include_members:
+        user_ids = Member.objects.filter(
+            pool_id__in=pool_ids, is_active=True
+        ).values_list('user_id', flat=True).distinct()
+        jobs += [('user', user_id) for user_id in user_ids]
+
+    def timed(job):
+        started = time.perf_counter()
+        try:
+            _warm(*job)
+        except Exception as e:
+            logger.error(f"Failed to warm cache for {job[0]} {job[1]}: {str(e)}")
+            return None
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max(1, concurrency), thread_name_prefix='finsplit-warm') as executor:
+        timings = list(executor.map(timed, jobs))
+    wall_ms = (time.perf_counter() - started) * 1000
+
+    succeeded = [elapsed for elapsed in timings if elapsed is not None]
+    return {
+        'wall_ms': round(wall_ms, 3),
+        'failed': len(timings) - len(succeeded),
+        **_summarize(succeeded),
+    }